@@ -0,0 +1,148 @@
+"""\
+Compare Elasticsearch took times for the search filter query shapes.
+
+The legacy shape applies the principals and selected facet terms as an and
+filter, with each facet aggregation filtered by a bool of the other terms and
+the principals. The current shape, built with clincoded.search, applies the
+principals in a filtered query and the selected terms as a bool post_filter.
+
+Terms are taken from the index itself: for each facet field of the item type
+the most frequent terms are selected. Each query is run --repeat times,
+alternating between the shapes, and the took times reported.
+
+Example:
+
+    %(prog)s --host localhost:9200 --index clincoded --item-type gdm --terms 3
+
+"""
+from elasticsearch import Elasticsearch
+import json
+import statistics
+
+EPILOG = __doc__
+
+PRINCIPALS = ['system.Everyone', 'system.Authenticated', 'group.admin']
+
+
+def facet_terms(es, index, item_type, fields, size):
+    """ The most frequent terms of each facet field
+    """
+    from clincoded.search import get_query_field
+    body = {
+        'size': 0,
+        'aggs': {
+            field: {'terms': {'field': get_query_field(field), 'size': size}}
+            for field in fields
+        },
+    }
+    res = es.search(index=index, doc_type=item_type, body=body)
+    return {
+        field: [bucket['key'] for bucket in res['aggregations'][field]['buckets']]
+        for field in fields
+    }
+
+
+def current_query(used_filters, facets, principals):
+    from clincoded.search import (
+        get_filtered_query,
+        get_bool_filter,
+        set_facets,
+    )
+    query = get_filtered_query('*', None, ['embedded.@id'], principals)
+    post_filter = get_bool_filter(used_filters)
+    if post_filter is not None:
+        query['post_filter'] = post_filter
+    set_facets(facets, used_filters, query)
+    return query
+
+
+def legacy_query(used_filters, facets, principals):
+    from clincoded.search import get_query_field
+    principals_filter = {'terms': {'principals_allowed.view': principals}}
+    filters = [principals_filter]
+    for field, terms in used_filters.items():
+        filters.append({'terms': {get_query_field(field): terms}})
+    query = {
+        'query': {'match_all': {}},
+        'filter': {'and': {'filters': filters}},
+        'aggs': {},
+        '_source': ['embedded.@id'],
+    }
+    for field, _ in facets:
+        agg_name = field.replace('.', '-')
+        must = [
+            {'terms': {get_query_field(q_field): q_terms}}
+            for q_field, q_terms in used_filters.items() if q_field != field
+        ]
+        must.append(principals_filter)
+        query['aggs'][agg_name] = {
+            'aggs': {
+                agg_name: {
+                    'terms': {
+                        'field': get_query_field(field),
+                        'min_doc_count': 0,
+                        'size': 100,
+                    },
+                },
+            },
+            'filter': {'bool': {'must': must}},
+        }
+    return query
+
+
+def run(es, index, item_type, facet_fields, terms=3, repeat=20):
+    used_filters = facet_terms(es, index, item_type, facet_fields, terms)
+    used_filters = {field: values for field, values in used_filters.items() if values}
+    facets = [(field, {}) for field in facet_fields]
+    queries = {
+        'legacy': legacy_query(used_filters, facets, PRINCIPALS),
+        'current': current_query(used_filters, facets, PRINCIPALS),
+    }
+    took = {name: [] for name in queries}
+    hits = {}
+    for i in range(repeat):
+        for name, body in sorted(queries.items()):
+            res = es.search(index=index, doc_type=item_type, body=body, size=25)
+            took[name].append(res['took'])
+            hits[name] = res['hits']['total']
+    return {
+        name: {
+            'hits': hits[name],
+            'median_ms': statistics.median(times),
+            'mean_ms': statistics.mean(times),
+            'min_ms': min(times),
+        }
+        for name, times in took.items()
+    }
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Benchmark search filter queries", epilog=EPILOG,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument('--host', default='localhost:9200', help="Elasticsearch host")
+    parser.add_argument('--index', default='clincoded')
+    parser.add_argument('--item-type', required=True)
+    parser.add_argument('--facet', action='append', dest='facets',
+                        help="Facet field (default the item type schema facets)")
+    parser.add_argument('--terms', type=int, default=3, help="Selected terms per facet")
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    facets = args.facets
+    if not facets:
+        from pkg_resources import resource_stream
+        import codecs
+        utf8 = codecs.getreader('utf-8')
+        schema = json.load(utf8(resource_stream('clincoded', 'schemas/%s.json' % args.item_type)))
+        facets = ['type'] + list(schema.get('facets', ()))
+
+    es = Elasticsearch([args.host])
+    result = run(es, args.index, args.item_type, facets, args.terms, args.repeat)
+    print(json.dumps(result, indent=4, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -33,7 +33,6 @@ requires = [
     'simplejson',
     'strict_rfc3339',
     'subprocess_middleware',
-    'xlrd',
     'zope.sqlalchemy',
 ]
 
@@ -73,6 +72,8 @@ setup(
         create-mapping = contentbase.elasticsearch.create_mapping:main
 
         add-date-created = clincoded.commands.add_date_created:main
+        archive-transactions = clincoded.commands.archive_transactions:main
+        audit-all = clincoded.commands.audit_all:main
         check-files = clincoded.commands.check_files:main
         check-rendering = clincoded.commands.check_rendering:main
         deploy = clincoded.commands.deploy:main
@@ -80,6 +81,7 @@ setup(
         extract_test_data = clincoded.commands.extract_test_data:main
         es-index-data = clincoded.commands.es_index_data:main
         es-index-listener = clincoded.commands.es_index_listener:main
+        gc-blobs = clincoded.commands.gc_blobs:main
         import-data = clincoded.commands.import_data:main
         jsonld-rdf = clincoded.commands.jsonld_rdf:main
         migrate-files-aws = clincoded.commands.migrate_files_aws:main
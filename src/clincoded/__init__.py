@@ -67,6 +67,8 @@ def configure_engine(settings, test_setup=False):
     if engine_url.startswith('postgresql'):
         if settings.get('indexer_worker'):
             application_name = 'indexer_worker'
+        elif settings.get('export_worker'):
+            application_name = 'export_worker'
         elif settings.get('indexer'):
             application_name = 'indexer'
         else:
@@ -108,7 +110,8 @@ def set_postgresql_statement_timeout(engine, timeout=20 * 1000):
             dbapi_connection.commit()
 
 
-def load_workbook(app, workbook_filename, docsdir, test=False):
+def load_workbook(app, workbook_filename, docsdir, test=False, batch_size=None,
+                  processes=None):
     from .loadxl import load_all
     from webtest import TestApp
     environ = {
@@ -116,7 +119,8 @@ def load_workbook(app, workbook_filename, docsdir, test=False):
         'REMOTE_USER': 'IMPORT',
     }
     testapp = TestApp(app, environ)
-    load_all(testapp, workbook_filename, docsdir, test=test)
+    load_all(testapp, workbook_filename, docsdir, test=test, batch_size=batch_size,
+             processes=processes)
 
 
 def json_from_path(path, default=None):
@@ -191,6 +195,7 @@ def main(global_config, **local_config):
     if 'elasticsearch.server' in config.registry.settings:
         config.include('contentbase.elasticsearch')
         config.include('.search')
+        config.include('.export')
 
     config.include(static_resources)
     config.include(changelogs)
@@ -209,10 +214,13 @@ def main(global_config, **local_config):
 
     workbook_filename = settings.get('load_workbook', '')
     load_test_only = asbool(settings.get('load_test_only', False))
+    load_batch_size = int(settings.get('load_batch_size', 0)) or None
+    load_processes = int(settings.get('load_processes', 0)) or None
     docsdir = settings.get('load_docsdir', None)
     if docsdir is not None:
         docsdir = [path.strip() for path in docsdir.strip().split('\n')]
     if workbook_filename:
-        load_workbook(app, workbook_filename, docsdir, test=load_test_only)
+        load_workbook(app, workbook_filename, docsdir, test=load_test_only,
+                      batch_size=load_batch_size, processes=load_processes)
 
     return app
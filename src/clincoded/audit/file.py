@@ -99,10 +99,9 @@ def audit_file_controlled_by(value, system):
     if 'target' in value['dataset'] and 'control' in value['dataset']['target'].get('investigated_as', []):
         return
 
-    if 'controlled_by' not in value:
-        value['controlled_by'] = []
+    controlled_by = value.get('controlled_by', [])
 
-    if (value['controlled_by'] == []) and (value['file_format'] in ['fastq']):
+    if (controlled_by == []) and (value['file_format'] in ['fastq']):
         detail = 'Fastq file {} from {} requires controlled_by'.format(
             value['@id'],
             value['dataset']['assay_term_name']
@@ -112,7 +111,7 @@ def audit_file_controlled_by(value, system):
     possible_controls = value['dataset'].get('possible_controls')
     biosample = value['dataset'].get('biosample_term_id')
 
-    for ff in value['controlled_by']:
+    for ff in controlled_by:
         control_bs = ff['dataset'].get('biosample_term_id')
 
         if control_bs != biosample:
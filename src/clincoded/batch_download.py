@@ -1,7 +1,10 @@
 from collections import OrderedDict
 from pyramid.view import view_config
 from pyramid.response import Response
+from pyramid.threadlocal import manager
 from contentbase import simple_path_ids
+from contentbase.elasticsearch import ELASTIC_SEARCH
+from elasticsearch.exceptions import NotFoundError
 from urllib.parse import (
     parse_qs,
     urlencode,
@@ -9,6 +12,7 @@ from urllib.parse import (
 
 import csv
 import io
+import transaction
 
 
 def includeme(config):
@@ -66,10 +70,150 @@ _tsv_mapping = OrderedDict([
 ])
 
 
-@view_config(route_name='metadata', request_method='GET')
-def metadata_tsv(context, request):
+# Number of search results fetched per page when streaming metadata
+METADATA_PAGE_SIZE = 100
+
+# How long elasticsearch keeps a scroll open between pages
+SCROLL_KEEPALIVE = '5m'
+
+_library_fields = ['@id', 'fragmentation_method', 'size_range', 'biosample.age_display']
+
+
+def search_pages(request, param_list, page_size=METADATA_PAGE_SIZE):
+    """ Yields the @graph of each page of search results
+
+    The pages are read with an elasticsearch scroll, so each costs the same
+    however deep it is and together they are a consistent snapshot of the
+    results.
+    """
+    params = dict(param_list)
+    params['limit'] = [str(page_size)]
+    params['scroll'] = [SCROLL_KEEPALIVE]
+    scroll_id = None
+    try:
+        while True:
+            if scroll_id is not None:
+                params['scroll_id'] = [scroll_id]
+            path = '/search/?%s' % urlencode(params, True)
+            results = request.embed(path, as_user=True)
+            scroll_id = results.get('scroll_id')
+            graph = results['@graph']
+            if not graph:
+                return
+            yield graph
+            if scroll_id is None:
+                return
+    finally:
+        if scroll_id is not None:
+            clear_scroll(request, scroll_id)
+
+
+def clear_scroll(request, scroll_id):
+    es = request.registry[ELASTIC_SEARCH]
+    try:
+        es.clear_scroll(scroll_id=scroll_id)
+    except NotFoundError:
+        pass
+
+
+def prefetch_libraries(request, paths):
+    """ Returns a mapping of library @id to library for a page of results
 
-    param_list = parse_qs(request.matchdict['search_params'])
+    The libraries are fetched with a single search, any not found there are
+    embedded individually.
+    """
+    paths = sorted(set(paths))
+    if not paths:
+        return {}
+    params = [('type', 'library'), ('limit', 'all')]
+    params.extend(('field', field) for field in _library_fields)
+    params.extend(('@id', path) for path in paths)
+    results = request.embed('/search/?%s' % urlencode(params), as_user=True)
+    libraries = {library['@id']: library for library in results['@graph']}
+    for path in paths:
+        if path not in libraries:
+            libraries[path] = request.embed(path)
+    return libraries
+
+
+def library_paths(rows):
+    """ The first library of each file, as used by the metadata columns
+    """
+    for row in rows:
+        for f in row['files']:
+            for library in simple_path_ids(f, 'replicate.library'):
+                yield library
+                break
+
+
+def metadata_rows(request, row, header, file_attributes, param_list, libraries):
+    """ Yields the TSV rows for each file of an experiment
+    """
+    exp_data_row = []
+    for column in header:
+        if not _tsv_mapping[column][0].startswith('files'):
+            temp = []
+            for c in _tsv_mapping[column]:
+                c_value = []
+                for value in simple_path_ids(row, c):
+                    if str(value) not in c_value:
+                        c_value.append(str(value))
+                if c == 'replicates.library.biosample.post_synchronization_time' and len(temp):
+                    if len(c_value):
+                        temp[0] = temp[0] + ' + ' + c_value[0]
+                elif len(temp):
+                    if len(c_value):
+                        temp = [x + ' ' + c_value[0] for x in temp]
+                else:
+                    temp = c_value
+            exp_data_row.append(', '.join(list(set(temp))))
+    f_attributes = ['files.title', 'files.file_type',
+                    'files.output_type']
+    for f in row['files']:
+        if 'files.file_type' in param_list:
+            if f['file_type'] not in param_list['files.file_type']:
+                continue
+        f['href'] = request.host_url + f['href']
+        f_row = []
+        for attr in f_attributes:
+            f_row.append(f[attr[6:]])
+        data_row = f_row + exp_data_row
+        internal_prop = True
+        for prop in file_attributes:
+            if prop in f_attributes:
+                continue
+            if prop == 'files.replicate.library':
+                if not internal_prop:
+                    continue
+                internal_prop = False
+                library = next(iter(simple_path_ids(f, prop[6:])), None)
+                if library is not None:
+                    library = libraries[library]
+                    data_row.append(library.get('fragmentation_method', ''))
+                    data_row.append(library.get('size_range', ''))
+                    if 'biosample' in library:
+                        data_row.append(library['biosample'].get('age_display', ''))
+                    else:
+                        data_row.append('')
+                    continue
+                else:
+                    data_row = data_row + [''] * 3
+                    continue
+            path = prop[6:]
+            temp = []
+            for value in simple_path_ids(f, path):
+                temp.append(str(value))
+            if prop == 'files.replicate.rbns_protein_concentration':
+                if 'replicate' in f and 'rbns_protein_concentration_units' in f['replicate']:
+                    temp[0] = temp[0] + ' ' + f['replicate']['rbns_protein_concentration_units']
+            data_row.append(', '.join(list(set(temp))))
+        yield data_row
+
+
+def metadata_chunks(request, search_params):
+    """ Yields the encoded TSV a page of search results at a time
+    """
+    param_list = parse_qs(search_params)
     param_list['field'] = []
     header = []
     file_attributes = []
@@ -78,116 +222,102 @@ def metadata_tsv(context, request):
         param_list['field'] = param_list['field'] + _tsv_mapping[prop]
         if _tsv_mapping[prop][0].startswith('files'):
             file_attributes = file_attributes + [_tsv_mapping[prop][0]]
-    param_list['limit'] = ['all']
-    path = '/search/?%s' % urlencode(param_list, True)
-    results = request.embed(path, as_user=True)
-    rows = []
-    for row in results['@graph']:
-        if row['files']:
-            exp_data_row = []
-            for column in header:
-                if not _tsv_mapping[column][0].startswith('files'):
-                    temp = []
-                    for c in _tsv_mapping[column]:
-                        c_value = []
-                        for value in simple_path_ids(row, c):
-                            if str(value) not in c_value:
-                                c_value.append(str(value))
-                        if c == 'replicates.library.biosample.post_synchronization_time' and len(temp):
-                            if len(c_value):
-                                temp[0] = temp[0] + ' + ' + c_value[0]
-                        elif len(temp):
-                            if len(c_value):
-                                temp = [x + ' ' + c_value[0] for x in temp]
-                        else:
-                            temp = c_value
-                    exp_data_row.append(', '.join(list(set(temp))))
-            f_attributes = ['files.title', 'files.file_type',
-                            'files.output_type']
-            for f in row['files']:
-                if 'files.file_type' in param_list:
-                    if f['file_type'] not in param_list['files.file_type']:
-                        continue
-                f['href'] = request.host_url + f['href']
-                f_row = []
-                for attr in f_attributes:
-                    f_row.append(f[attr[6:]])
-                data_row = f_row + exp_data_row
-                internal_prop = True
-                for prop in file_attributes:
-                    if prop in f_attributes:
-                        continue
-                    if prop == 'files.replicate.library':
-                        if not internal_prop:
-                            continue
-                        internal_prop = False
-                        libraries = []
-                        for l in simple_path_ids(f, prop[6:]):
-                            libraries.append(l)
-                        if len(libraries):
-                            library = request.embed(libraries[0])
-                            data_row.append(library.get('fragmentation_method', ''))
-                            data_row.append(library.get('size_range', ''))
-                            if 'biosample' in library:
-                                data_row.append(library['biosample'].get('age_display', ''))
-                            else:
-                                data_row.append('')
-                            continue
-                        else:
-                            data_row = data_row + [''] * 3
-                            continue
-                    path = prop[6:]
-                    temp = []
-                    for value in simple_path_ids(f, path):
-                        temp.append(str(value))
-                    if prop == 'files.replicate.rbns_protein_concentration':
-                        if 'replicate' in f and 'rbns_protein_concentration_units' in f['replicate']:
-                            temp[0] = temp[0] + ' ' + f['replicate']['rbns_protein_concentration_units']
-                    data_row.append(', '.join(list(set(temp))))
-                rows.append(data_row)
+
     fout = io.StringIO()
     writer = csv.writer(fout, delimiter='\t')
     writer.writerow(header)
-    writer.writerows(rows)
-    return Response(
-        content_type='text/tsv',
-        body=fout.getvalue(),
-        content_disposition='attachment;filename="%s"' % 'metadata.tsv'
-    )
+    for graph in search_pages(request, param_list):
+        rows = [row for row in graph if row['files']]
+        libraries = {}
+        if 'files.replicate.library' in file_attributes:
+            libraries = prefetch_libraries(request, library_paths(rows))
+        for row in rows:
+            writer.writerows(metadata_rows(
+                request, row, header, file_attributes, param_list, libraries))
+        yield fout.getvalue().encode('utf-8')
+        fout.seek(0)
+        fout.truncate()
+    yield fout.getvalue().encode('utf-8')
 
 
-@view_config(route_name='batch_download', request_method='GET')
-def batch_download(context, request):
-
+def batch_download_files(request, search_params):
+    """ Yields the metadata link followed by the download URL of each file
+    """
     # adding extra params to get requied columsn
-    param_list = parse_qs(request.matchdict['search_params'])
+    param_list = parse_qs(search_params)
     param_list['field'] = ['files.href', 'files.file_type']
-    param_list['limit'] = ['all']
 
-    path = '/search/?%s' % urlencode(param_list, True)
-    results = request.embed(path, as_user=True)
-    metadata_link = '{host_url}/metadata/{search_params}/metadata.tsv'.format(
+    yield '{host_url}/metadata/{search_params}/metadata.tsv'.format(
         host_url=request.host_url,
-        search_params=request.matchdict['search_params']
+        search_params=search_params
     )
-    files = [metadata_link]
-    if 'files.file_type' in param_list:
-        for exp in results['@graph']:
+    file_types = param_list.get('files.file_type')
+    for graph in search_pages(request, param_list):
+        for exp in graph:
             for f in exp['files']:
-                if f['file_type'] in param_list['files.file_type']:
-                    files.append('{host_url}{href}'.format(
+                if file_types is None or f['file_type'] in file_types:
+                    yield '{host_url}{href}'.format(
                         host_url=request.host_url,
                         href=f['href']
-                    ))
-    else:
-        for exp in results['@graph']:
-            for f in exp['files']:
-                files.append('{host_url}{href}'.format(
-                    host_url=request.host_url,
-                    href=f['href']
-                ))
+                    )
+
+
+def batch_download_chunks(request, search_params, lines_per_chunk=METADATA_PAGE_SIZE):
+    """ Yields the encoded batch download lines a number at a time
+    """
+    lines = []
+    for line in batch_download_files(request, search_params):
+        lines.append(line + '\r\n')
+        if len(lines) >= lines_per_chunk:
+            yield ''.join(lines).encode('utf-8')
+            lines = []
+    yield ''.join(lines).encode('utf-8')
+
+
+def request_context_iter(request, chunks):
+    """ Iterate chunks as a response app_iter
+
+    The app_iter is only iterated after the view has returned, when pyramid_tm
+    has ended the request transaction and the threadlocals are popped. Each
+    chunk is produced with the request pushed and in its own read only
+    transaction.
+    """
+    chunks = iter(chunks)
+    while True:
+        manager.push({'request': request, 'registry': request.registry})
+        txn = transaction.begin()
+        txn.doom()
+        try:
+            chunk = next(chunks)
+        except StopIteration:
+            return
+        finally:
+            transaction.abort()
+            manager.pop()
+        yield chunk
+
+
+@view_config(route_name='metadata', request_method='GET')
+def metadata_tsv(context, request):
+    """ Streams the TSV, paging through the search results
+    """
+    chunks = metadata_chunks(request, request.matchdict['search_params'])
+    return Response(
+        content_type='text/tsv',
+        charset='utf-8',
+        app_iter=request_context_iter(request, chunks),
+        content_disposition='attachment;filename="%s"' % 'metadata.tsv'
+    )
+
+
+@view_config(route_name='batch_download', request_method='GET')
+def batch_download(context, request):
+    """ Streams the file download URLs, paging through the search results
+    """
+    chunks = batch_download_chunks(request, request.matchdict['search_params'])
     return Response(
         content_type='text/plain',
-        body='\r\n'.join(files),
+        charset='utf-8',
+        app_iter=request_context_iter(request, chunks),
         content_disposition='attachment; filename="%s"' % 'files.txt'
     )
@@ -0,0 +1,156 @@
+"""\
+Archive old transaction records.
+
+Records older than --days and already seen by the indexer are written to a
+gzipped JSON lines file. The updated and renamed uuid lists, which make up most
+of their size, are then dropped from the table. Records that no property sheet
+refers to are deleted. The userid and other transaction data are kept.
+
+With --create-index the index on transactions.xid is first created
+concurrently, for databases created before it was added to the model.
+
+Example:
+
+    %(prog)s production.ini --days 90 --output transactions-2016-01.jsonl.gz
+
+"""
+from contentbase.storage import (
+    DBSession,
+    PropertySheet,
+    TransactionRecord,
+)
+import datetime
+import gzip
+import json
+import logging
+import transaction
+
+EPILOG = __doc__
+
+logger = logging.getLogger(__name__)
+
+ARCHIVED_KEYS = ('updated', 'renamed')
+
+
+def create_xid_index(engine):
+    """ Create the index unless it exists, returning whether it was created
+    """
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+    connection = engine.connect().execution_options(isolation_level='AUTOCOMMIT')
+    try:
+        # IF NOT EXISTS requires Postgres 9.5
+        exists = connection.execute(
+            "SELECT 1 FROM pg_indexes "
+            "WHERE tablename = 'transactions' AND indexname = 'ix_transactions_xid';"
+        ).scalar()
+        if exists:
+            return False
+        connection.execute(
+            "CREATE INDEX CONCURRENTLY ix_transactions_xid ON transactions (xid);")
+        return True
+    finally:
+        connection.close()
+
+
+def indexed_xmin(registry):
+    """ The xmin of the last indexing run, below which records are not needed
+    """
+    from contentbase.elasticsearch.interfaces import ELASTIC_SEARCH
+    from elasticsearch.exceptions import NotFoundError
+    es = registry[ELASTIC_SEARCH]
+    try:
+        status = es.get(
+            index=registry.settings['contentbase.elasticsearch.index'],
+            doc_type='meta', id='indexing')
+    except NotFoundError:
+        return None
+    return status['_source']['xmin']
+
+
+def run(output, before, max_xid, batch_size=1000, dry_run=False):
+    session = DBSession()
+    archived = deleted = 0
+    last_order = None
+    while True:
+        with transaction.manager as txn:
+            if dry_run:
+                txn.doom()
+            query = session.query(TransactionRecord).filter(
+                TransactionRecord.timestamp < before,
+                TransactionRecord.xid < max_xid,
+            )
+            if last_order is not None:
+                query = query.filter(TransactionRecord.order > last_order)
+            records = query.order_by(TransactionRecord.order).limit(batch_size).all()
+            if not records:
+                break
+            last_order = records[-1].order
+            referenced = {
+                tid for tid, in session.query(PropertySheet.tid).filter(
+                    PropertySheet.tid.in_([record.tid for record in records])).distinct()
+            }
+            for record in records:
+                data = record.data or {}
+                if record.tid in referenced and not any(k in data for k in ARCHIVED_KEYS):
+                    continue
+                output.write(json.dumps({
+                    'order': record.order,
+                    'tid': str(record.tid),
+                    'xid': record.xid,
+                    'timestamp': record.timestamp.isoformat(),
+                    'data': data,
+                }) + '\n')
+                if record.tid in referenced:
+                    record.data = {k: v for k, v in data.items() if k not in ARCHIVED_KEYS}
+                    archived += 1
+                else:
+                    session.delete(record)
+                    deleted += 1
+        logger.info('Archived %d, deleted %d transaction records', archived, deleted)
+    return archived, deleted
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Archive old transaction records", epilog=EPILOG,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument('--app-name', help="Pyramid app name in configfile")
+    parser.add_argument('--days', type=int, default=90,
+                        help="Archive records older than this many days")
+    parser.add_argument('--output', '-o', required=True, help="Gzipped JSON lines archive file")
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--create-index', action='store_true',
+                        help="Create the transactions.xid index if missing")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="Write the archive but change nothing")
+    parser.add_argument('config_uri', help="path to configfile")
+    args = parser.parse_args()
+
+    logging.basicConfig()
+    from pyramid import paster
+    app = paster.get_app(args.config_uri, args.app_name)
+    # Loading app will have configured from config file. Reconfigure here:
+    logging.getLogger('clincoded').setLevel(logging.INFO)
+
+    if args.create_index:
+        if create_xid_index(DBSession.bind):
+            logger.info('Created index on transactions.xid')
+        else:
+            logger.info('Index on transactions.xid already exists')
+
+    max_xid = indexed_xmin(app.registry)
+    if max_xid is None:
+        logger.error('No indexing record found, not archiving')
+        return
+    before = datetime.datetime.utcnow() - datetime.timedelta(days=args.days)
+    before = before.replace(tzinfo=datetime.timezone.utc)
+    with gzip.open(args.output, 'at') as output:
+        archived, deleted = run(output, before, max_xid, args.batch_size, args.dry_run)
+    logger.info('Done: archived %d, deleted %d transaction records below xid %d',
+                archived, deleted, max_xid)
+
+
+if __name__ == '__main__':
+    main()
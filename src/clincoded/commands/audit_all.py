@@ -0,0 +1,187 @@
+"""\
+Run the audit checkers over every item in a single database snapshot.
+
+Results are written as JSON lines, one per item, followed by a summary line
+with error counts and timing for each checker. An item which fails to audit
+is written with its error and counted as failed in the summary. The search
+index is not used.
+
+Examples
+
+To audit all items on the production server:
+
+    %(prog)s production.ini --output audit.jsonl
+
+For the development.ini you must supply the paster app name:
+
+    %(prog)s development.ini --app-name app --item-type gene
+
+"""
+from collections import defaultdict
+from contentbase.elasticsearch.indexer import all_uuids
+from contentbase.elasticsearch.mpindexer import (
+    initializer,
+    snapshot,
+)
+from multiprocessing import get_context
+from multiprocessing.pool import Pool
+from pyramid.threadlocal import get_current_request
+import json
+import logging
+import sys
+import time
+import traceback
+import transaction
+
+EPILOG = __doc__
+
+logger = logging.getLogger(__name__)
+
+
+# Running in subprocess
+
+def audit_item(request, uuid):
+    request._stats = stats = {}
+    begin = time.time()
+    try:
+        item = request.root.get_by_uuid(uuid)
+        path = request.resource_path(item)
+        audit = request.embed(path, '@@audit-self')['audit']
+    except Exception:
+        logger.warning('Error auditing %s', uuid, exc_info=True)
+        return {
+            'uuid': uuid,
+            'error': traceback.format_exc(),
+            'time': int((time.time() - begin) * 1e6),
+        }
+    return {
+        'uuid': uuid,
+        '@id': path,
+        'item_type': item.item_type,
+        'audit': audit,
+        'time': int((time.time() - begin) * 1e6),
+        'checker_time': {
+            k[len('audit_'):-len('_time')]: v for k, v in stats.items()
+            if k.startswith('audit_') and k.endswith('_time') and k != 'audit_time'
+        },
+    }
+
+
+def audit_item_in_snapshot(args):
+    uuid, xmin, snapshot_id = args
+    with snapshot(xmin, snapshot_id):
+        return audit_item(get_current_request(), uuid)
+
+
+# Running in main process
+
+def export_snapshot():
+    """ Begin a read only transaction and export its snapshot for the workers
+    """
+    from contentbase.storage import DBSession
+    transaction.begin()
+    connection = DBSession().connection()
+    query = connection.execute(
+        "SET TRANSACTION ISOLATION LEVEL SERIALIZABLE, READ ONLY, DEFERRABLE;"
+        "SELECT txid_snapshot_xmin(txid_current_snapshot()), pg_export_snapshot();"
+    )
+    result, = query.fetchall()
+    xmin, snapshot_id = result
+    return xmin, snapshot_id
+
+
+class Summary(object):
+    def __init__(self):
+        self.items = 0
+        self.failed = 0
+        self.errors = defaultdict(lambda: defaultdict(int))
+        self.checker_time = defaultdict(int)
+        self.time = 0
+
+    def add(self, result):
+        self.items += 1
+        self.time += result['time']
+        if 'error' in result:
+            self.failed += 1
+            return
+        for name, duration in result['checker_time'].items():
+            self.checker_time[name] += duration
+        for error in result['audit']:
+            self.errors[error['name']][error['level_name']] += 1
+
+    def __json__(self):
+        return {
+            'items': self.items,
+            'failed': self.failed,
+            'time': self.time,
+            'errors': {name: dict(levels) for name, levels in self.errors.items()},
+            'checker_time': dict(self.checker_time),
+        }
+
+
+def run(app, output, item_types=None, processes=None, chunksize=32):
+    registry = app.registry
+    root = app.root_factory(app)
+    xmin, snapshot_id = export_snapshot()
+    # The exporting transaction must stay open while workers use the snapshot.
+    try:
+        tasks = [(uuid, xmin, snapshot_id) for uuid in all_uuids(root, item_types)]
+        logger.info('Auditing %d items at xmin %r', len(tasks), xmin)
+        pool = Pool(
+            processes=processes,
+            initializer=initializer,
+            initargs=(registry['app_factory'], registry.settings),
+            context=get_context('forkserver'),
+        )
+        summary = Summary()
+        try:
+            for i, result in enumerate(pool.imap_unordered(
+                    audit_item_in_snapshot, tasks, chunksize)):
+                summary.add(result)
+                output.write(json.dumps(result) + '\n')
+                if (i + 1) % 1000 == 0:
+                    logger.info('Audited %d', i + 1)
+        finally:
+            pool.terminate()
+            pool.join()
+    finally:
+        transaction.abort()
+    summary = summary.__json__()
+    summary['xmin'] = xmin
+    output.write(json.dumps({'summary': summary}) + '\n')
+    return summary
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Audit all items", epilog=EPILOG,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument('--item-type', action='append', help="Item type")
+    parser.add_argument('--app-name', help="Pyramid app name in configfile")
+    parser.add_argument('--processes', type=int, help="Number of worker processes")
+    parser.add_argument('--output', '-o', help="JSON lines output file (default stdout)")
+    parser.add_argument('config_uri', help="path to configfile")
+    args = parser.parse_args()
+
+    logging.basicConfig()
+    from pyramid import paster
+    app = paster.get_app(args.config_uri, args.app_name)
+    # Loading app will have configured from config file. Reconfigure here:
+    logging.getLogger('clincoded').setLevel(logging.INFO)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            summary = run(app, output, args.item_type, args.processes)
+    else:
+        summary = run(app, sys.stdout, args.item_type, args.processes)
+    logger.info('Audited %d items in %.1fs of audit time', summary['items'], summary['time'] / 1e6)
+    if summary['failed']:
+        logger.error('Failed to audit %d items', summary['failed'])
+    for name, levels in sorted(summary['errors'].items()):
+        logger.info('%s: %s', name, ', '.join('%s %d' % item for item in sorted(levels.items())))
+
+
+if __name__ == '__main__':
+    main()
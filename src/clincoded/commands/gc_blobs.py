@@ -0,0 +1,63 @@
+"""\
+Remove attachment blobs which no item references.
+
+Uploads to /@@upload which were never referenced by an item, and with file
+blob storage the files staged by aborted transactions, are deleted once they
+are older than --hours. Blobs referenced by any revision of an item are kept.
+
+With database blob storage uploads are found from the transaction records,
+so run this more often than archive-transactions removes them.
+
+Example:
+
+    %(prog)s production.ini --hours 48
+
+"""
+from contentbase.attachment import collect_garbage
+import datetime
+import logging
+import transaction
+
+EPILOG = __doc__
+
+logger = logging.getLogger(__name__)
+
+
+def run(registry, hours=24, dry_run=False):
+    before = datetime.datetime.utcnow() - datetime.timedelta(hours=hours)
+    before = before.replace(tzinfo=datetime.timezone.utc)
+    with transaction.manager as txn:
+        if dry_run:
+            txn.doom()
+        removed = collect_garbage(registry, before, dry_run)
+    return removed
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Remove unreferenced blobs", epilog=EPILOG,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument('--app-name', help="Pyramid app name in configfile")
+    parser.add_argument('--hours', type=float, default=24,
+                        help="Keep blobs stored more recently than this many hours")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="List the blobs which would be removed")
+    parser.add_argument('config_uri', help="path to configfile")
+    args = parser.parse_args()
+
+    logging.basicConfig()
+    from pyramid import paster
+    app = paster.get_app(args.config_uri, args.app_name)
+    # Loading app will have configured from config file. Reconfigure here:
+    logging.getLogger('clincoded').setLevel(logging.INFO)
+
+    removed = run(app.registry, args.hours, args.dry_run)
+    for digest in removed:
+        logger.info('Unreferenced blob %s', digest)
+    logger.info('%s %d unreferenced blobs', 'Found' if args.dry_run else 'Removed', len(removed))
+
+
+if __name__ == '__main__':
+    main()
@@ -55,13 +55,14 @@ def internal_app(configfile, app_name=None, username=''):
     return TestApp(app, environ)
 
 
-def run(testapp, filename, docsdir, method, item_type, test=False):
+def run(testapp, filename, docsdir, method, item_type, test=False, batch_size=None):
     name, ext = os.path.splitext(filename)
     if ext in ['', '.xlsx']:
         source = loadxl.read_single_sheet(filename, item_type)
     else:
         source = loadxl.read_single_sheet(filename)
-    pipeline = loadxl.get_pipeline(testapp, docsdir, test, item_type, method=method)
+    pipeline = loadxl.get_pipeline(
+        testapp, docsdir, test, item_type, method=method, batch_size=batch_size)
     loadxl.process(loadxl.combine(source, pipeline))
 
 
@@ -91,6 +92,10 @@ def main():
     parser.add_argument('--attach', '-a', action='append', default=[],
         help="Directory to search for attachments")
     parser.add_argument('--app-name', help="Pyramid app name in configfile")
+    parser.add_argument('--batch-size', type=int,
+        help="Load rows in batches of this size, one transaction per batch")
+    parser.add_argument('--processes', type=int,
+        help="Load item types that do not depend on each other in parallel")
     parser.add_argument('inpath',
         help="input zip file/directory of excel/csv/tsv sheets.")
     parser.add_argument('url',
@@ -120,9 +125,11 @@ def main():
     logging.getLogger('wsgi').setLevel(logging.WARNING)
 
     if args.method:
-        run(testapp, args.inpath, args.attach, args.method, args.item_type, args.test_only)
+        run(testapp, args.inpath, args.attach, args.method, args.item_type, args.test_only,
+            args.batch_size)
     else:
-        loadxl.load_all(testapp, args.inpath, args.attach, args.test_only)
+        loadxl.load_all(testapp, args.inpath, args.attach, args.test_only, args.batch_size,
+                        args.processes)
 
 
 if __name__ == '__main__':
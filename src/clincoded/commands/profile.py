@@ -15,6 +15,7 @@ For the development.ini you must supply the paster app name:
 import logging
 import cProfile
 import pstats
+from urllib.parse import parse_qsl
 
 EPILOG = __doc__
 
@@ -47,6 +48,19 @@ def parse_restriction(value):
     return value
 
 
+def format_stats(x_stats):
+    """ Format X-Stats one per line followed by each component's share of wsgi_time
+    """
+    stats = dict(parse_qsl(x_stats))
+    lines = ['%s=%s' % (k, v) for k, v in parse_qsl(x_stats)]
+    wsgi_time = int(stats.get('wsgi_time', 0))
+    if wsgi_time:
+        for key in ('db_time', 'es_client_time', 'render_time'):
+            if key in stats:
+                lines.append('%s share: %.1f%%' % (key, 100.0 * int(stats[key]) / wsgi_time))
+    return '\n\t'.join(lines)
+
+
 def run(testapp, method, path, data, warm_ups, filename, sortby, stats, callers, callees, response_body):
     method = method.lower()
     if method == 'get':
@@ -55,12 +69,12 @@ def run(testapp, method, path, data, warm_ups, filename, sortby, stats, callers,
         fn = lambda: getattr(testapp, method)(path, data, content_type='application/json')
     for n in range(warm_ups):
         res = fn()
-        logger.info('Warm up %d:\n\t%s', n + 1, res.headers['X-Stats'].replace('&', '\n\t'))
+        logger.info('Warm up %d:\n\t%s', n + 1, format_stats(res.headers['X-Stats']))
     pr = cProfile.Profile()
     pr.enable()
     res = fn()
     pr.disable()
-    logger.info('Run:\n\t%s', res.headers['X-Stats'].replace('&', '\n\t'))
+    logger.info('Run:\n\t%s', format_stats(res.headers['X-Stats']))
     if response_body:
         print(res.text)
     pr.create_stats()
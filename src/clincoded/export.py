@@ -0,0 +1,381 @@
+""" Background export jobs for batch downloads
+
+Large exports are enqueued with a POST to /export/ and run in a separate
+worker process pool, so they do not tie up a WSGI worker. The result is
+written gzip compressed to the export directory and the client polls the job
+until it is done and then downloads it.
+
+Jobs are kept as files in the export directory. Those left queued or running
+by a restart are resubmitted when the application starts, and finished jobs
+are removed after ``export.retention_days``.
+"""
+from multiprocessing import get_context
+from multiprocessing.pool import Pool
+from pyramid.decorator import reify
+from pyramid.events import (
+    ApplicationCreated,
+    subscriber,
+)
+from pyramid.httpexceptions import (
+    HTTPBadRequest,
+    HTTPForbidden,
+    HTTPNotFound,
+)
+from pyramid.request import apply_request_extensions
+from pyramid.response import FileResponse
+from pyramid.threadlocal import manager
+from pyramid.view import view_config
+from .batch_download import (
+    batch_download_chunks,
+    metadata_chunks,
+)
+import datetime
+import fcntl
+import gzip
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+import transaction
+import uuid
+
+log = logging.getLogger(__name__)
+
+EXPORTER = 'exporter'
+
+# Format name -> (content generator, download filename)
+EXPORT_FORMATS = {
+    'metadata': (metadata_chunks, 'metadata.tsv.gz'),
+    'files': (batch_download_chunks, 'files.txt.gz'),
+}
+
+# Number of times an export is rerun when the index changes underneath it
+MAX_ATTEMPTS = 3
+
+job_id_re = re.compile(r'^[0-9a-f]{32}$')
+
+
+def includeme(config):
+    config.add_route('export', '/export/')
+    config.add_route('export_job', '/export/{job_id}/')
+    config.add_route('export_download', '/export/{job_id}/@@download/{filename}')
+    config.scan(__name__)
+    settings = config.registry.settings
+    if settings.get('export_worker') or settings.get('indexer_worker'):
+        return
+    directory = settings.get('export.directory')
+    if directory is None:
+        directory = os.path.join(tempfile.gettempdir(), 'clincoded-exports')
+    processes = int(settings.get('export.processes', 1))
+    retention_days = float(settings.get('export.retention_days', 7))
+    config.registry[EXPORTER] = Exporter(
+        config.registry, directory, processes, retention_days * 86400)
+
+
+def utc_now():
+    return datetime.datetime.utcnow().isoformat() + 'Z'
+
+
+class JobStore(object):
+    """ Job status is kept as a JSON file next to the export result
+    """
+    def __init__(self, directory):
+        self.directory = directory
+
+    def status_path(self, job_id):
+        return os.path.join(self.directory, job_id + '.json')
+
+    def result_path(self, job_id):
+        return os.path.join(self.directory, job_id + '.gz')
+
+    def lock_path(self, job_id):
+        return os.path.join(self.directory, job_id + '.lock')
+
+    def job_ids(self):
+        try:
+            filenames = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return [
+            filename[:-len('.json')] for filename in filenames
+            if filename.endswith('.json') and job_id_re.match(filename[:-len('.json')])
+        ]
+
+    def get(self, job_id):
+        if not job_id_re.match(job_id):
+            return None
+        try:
+            with open(self.status_path(job_id)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save(self, job):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.status_path(job['uuid'])
+        with open(path + '.tmp', 'w') as f:
+            json.dump(job, f)
+        os.replace(path + '.tmp', path)
+
+    def update(self, job_id, **kw):
+        job = self.get(job_id)
+        job.update(kw)
+        self.save(job)
+        return job
+
+    def lock(self, job_id):
+        """ An exclusive lock on running the job, or None if already held
+
+        The lock is released when the returned file is closed or the process
+        holding it exits.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        f = open(self.lock_path(job_id), 'a')
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            return None
+        return f
+
+    def delete(self, job_id):
+        for path in [
+                self.result_path(job_id),
+                self.result_path(job_id) + '.tmp',
+                self.lock_path(job_id),
+                self.status_path(job_id)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+# Running in subprocess
+
+app = None
+
+
+def initializer(app_factory, settings):
+    import signal
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    # There should not be any existing connections.
+    from contentbase.storage import DBSession
+    assert not DBSession.registry.has()
+    global app
+    app = app_factory(settings, export_worker=True, create_tables=False)
+
+
+def make_request(remote_user, host_url):
+    registry = app.registry
+    request = app.request_factory.blank('/_export', base_url=host_url)
+    request.registry = registry
+    request.remote_user = remote_user
+    apply_request_extensions(request)
+    request.invoke_subrequest = app.invoke_subrequest
+    request.root = app.root_factory(request)
+    request._stats = {}
+    return request
+
+
+def run_export(args):
+    """ Run a job unless it has finished or another worker is running it
+    """
+    directory, job_id = args
+    store = JobStore(directory)
+    lock = store.lock(job_id)
+    if lock is None:
+        return job_id
+    with lock:
+        job = store.get(job_id)
+        if job is not None and job['status'] in ('queued', 'running'):
+            export_job(store, job_id)
+    return job_id
+
+
+def export_job(store, job_id):
+    """ Run a job, rerunning it if the index generation changed meanwhile
+    """
+    from contentbase.elasticsearch import index_generation
+    job = store.update(job_id, status='running', started=utc_now())
+    path = store.result_path(job_id)
+    try:
+        generate, filename = EXPORT_FORMATS[job['format']]
+        for attempt in range(MAX_ATTEMPTS):
+            txn = transaction.begin()
+            txn.doom()
+            request = make_request(job['remote_user'], job['host_url'])
+            manager.push({'request': request, 'registry': request.registry})
+            try:
+                generation = index_generation(request)
+                with gzip.open(path + '.tmp', 'wb') as f:
+                    for chunk in generate(request, job['search_params']):
+                        f.write(chunk)
+                consistent = index_generation(request) == generation
+            finally:
+                manager.pop()
+                transaction.abort()
+            if consistent:
+                break
+            log.info('Index changed during export %s, retrying', job_id)
+        os.replace(path + '.tmp', path)
+    except Exception as e:
+        log.exception('Export %s failed', job_id)
+        store.update(job_id, status='failed', finished=utc_now(), error=repr(e))
+        return
+    store.update(
+        job_id, status='done', finished=utc_now(), filename=filename,
+        generation=generation, size=os.path.getsize(path))
+
+
+# Running in main process
+
+class Exporter(object):
+    def __init__(self, registry, directory, processes=1, retention=7 * 86400):
+        self.store = JobStore(directory)
+        self.processes = processes
+        self.retention = retention
+        self.initargs = (registry['app_factory'], registry.settings,)
+
+    @reify
+    def pool(self):
+        return Pool(
+            processes=self.processes,
+            initializer=initializer,
+            initargs=self.initargs,
+            context=get_context('forkserver'),
+        )
+
+    def submit(self, job):
+        self.cleanup()
+        self.store.save(job)
+        self.pool.apply_async(run_export, [(self.store.directory, job['uuid'])])
+        return job
+
+    def requeue(self):
+        """ Resubmit the jobs left queued or running by a previous process
+        """
+        requeued = []
+        for job_id in self.store.job_ids():
+            job = self.store.get(job_id)
+            if job is not None and job['status'] in ('queued', 'running'):
+                self.pool.apply_async(run_export, [(self.store.directory, job_id)])
+                requeued.append(job_id)
+        return requeued
+
+    def cleanup(self):
+        """ Remove the jobs which finished longer than the retention period ago
+        """
+        cutoff = time.time() - self.retention
+        removed = []
+        for job_id in self.store.job_ids():
+            job = self.store.get(job_id)
+            if job is None or job['status'] not in ('done', 'failed'):
+                continue
+            try:
+                finished = os.path.getmtime(self.store.status_path(job_id))
+            except FileNotFoundError:
+                continue
+            if finished < cutoff:
+                self.store.delete(job_id)
+                removed.append(job_id)
+        return removed
+
+    def shutdown(self):
+        if 'pool' in self.__dict__:
+            self.pool.terminate()
+            self.pool.join()
+            del self.pool
+
+
+@subscriber(ApplicationCreated)
+def start_exporter(event):
+    exporter = event.app.registry.get(EXPORTER)
+    if exporter is None:
+        return
+    removed = exporter.cleanup()
+    if removed:
+        log.info('Removed %d expired exports', len(removed))
+    requeued = exporter.requeue()
+    if requeued:
+        log.info('Requeued %d exports', len(requeued))
+
+
+def export_remote_user(request):
+    """ The REMOTE_USER the worker runs the export searches as
+    """
+    userid = request.authenticated_userid
+    if userid is None:
+        return None
+    namespace, localname = userid.split('.', 1)
+    if namespace == 'accesskey':
+        access_key = request.root.by_item_type['access_key'][localname]
+        return access_key.properties['user']
+    return localname
+
+
+def job_view(request, job):
+    result = {
+        '@id': request.route_path('export_job', job_id=job['uuid']),
+        '@type': ['export'],
+    }
+    result.update(
+        (k, v) for k, v in job.items() if k not in ('remote_user', 'host_url'))
+    if job['status'] == 'done':
+        result['href'] = request.route_path(
+            'export_download', job_id=job['uuid'], filename=job['filename'])
+    return result
+
+
+def get_job(request):
+    exporter = request.registry[EXPORTER]
+    job = exporter.store.get(request.matchdict['job_id'])
+    if job is None:
+        raise HTTPNotFound()
+    if job['remote_user'] != export_remote_user(request):
+        raise HTTPForbidden()
+    return job
+
+
+@view_config(route_name='export', request_method='POST')
+def export_submit(context, request):
+    remote_user = export_remote_user(request)
+    if remote_user is None:
+        raise HTTPForbidden('Login required to export')
+    export_format = request.json.get('format', 'metadata')
+    if export_format not in EXPORT_FORMATS:
+        raise HTTPBadRequest('Unknown export format: %s' % export_format)
+    search_params = request.json.get('search_params', '')
+    job = request.registry[EXPORTER].submit({
+        'uuid': uuid.uuid4().hex,
+        'status': 'queued',
+        'format': export_format,
+        'search_params': search_params,
+        'submitted': utc_now(),
+        'remote_user': remote_user,
+        'host_url': request.host_url,
+    })
+    result = job_view(request, job)
+    request.response.status = 202
+    request.response.location = request.route_url('export_job', job_id=job['uuid'])
+    return result
+
+
+@view_config(route_name='export_job', request_method='GET')
+def export_status(context, request):
+    return job_view(request, get_job(request))
+
+
+@view_config(route_name='export_download', request_method='GET')
+def export_download(context, request):
+    job = get_job(request)
+    if job['status'] != 'done' or request.matchdict['filename'] != job['filename']:
+        raise HTTPNotFound()
+    exporter = request.registry[EXPORTER]
+    response = FileResponse(
+        exporter.store.result_path(job['uuid']), request=request,
+        content_type='application/gzip')
+    response.content_disposition = 'attachment; filename="%s"' % job['filename']
+    return response
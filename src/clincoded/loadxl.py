@@ -3,6 +3,7 @@ from .typedsheets import cast_row_values
 from functools import reduce
 import logging
 import os.path
+import time
 
 text = type(u'')
 
@@ -45,6 +46,11 @@ ORDER = [
     'curator_page', # keep at bottom so it can load other type data
 ]
 
+# Loaded after all other types when loading in parallel
+LOAD_LAST = [
+    'curator_page',
+]
+
 ##############################################################################
 # Pipeline components
 #
@@ -80,7 +86,7 @@ def warn_keys_with_unknown_value_except_for(*keys):
         for row in dictrows:
             for k, v in row.items():
                 if k not in keys and text(v).lower() == 'unknown':
-                    logger.warn('unknown %r for %s' % (k, row.get('uuid', '<empty uuid>')))
+                    logger.warning('unknown %r for %s' % (k, row.get('uuid', '<empty uuid>')))
             yield row
 
     return component
@@ -136,7 +142,7 @@ def skip_rows_with_all_falsey_value(*keys):
     return component
 
 
-def add_attachment(docsdir):
+def add_attachment(docsdir, testapp=None):
     def component(dictrows):
         for row in dictrows:
             filename = row.get('attachment', None)
@@ -145,7 +151,7 @@ def add_attachment(docsdir):
                 continue
             try:
                 path = find_doc(docsdir, filename)
-                row['attachment'] = attachment(path)
+                row['attachment'] = attachment(path, testapp)
             except ValueError as e:
                 row['_errors'] = repr(e)
             yield row
@@ -168,10 +174,11 @@ def read_single_sheet(path, name=None):
 
     if name is None:
         root, ext = os.path.splitext(path)
-        stream = open(path, 'r')
 
         if ext == '.xlsx':
-            return read_xl(stream)
+            return read_xl(open(path, 'rb'))
+
+        stream = open(path, 'r')
 
         if ext == '.tsv':
             return read_csv(stream, dialect='excel-tab')
@@ -302,6 +309,69 @@ def make_request(testapp, item_type, method):
     return component
 
 
+BULK_OPS = {
+    'POST': 'create',
+    'PUT': 'replace',
+    'PATCH': 'update',
+}
+
+
+class BulkResponse(object):
+    """ Stands in for the response to a row loaded with /@@bulk
+    """
+    def __init__(self, status_int, json, location):
+        self.status_int = status_int
+        self.status = str(status_int)
+        self.json = json
+        self.location = location
+
+
+def make_bulk_request(testapp, item_type, method, batch_size):
+    """ Load rows in batches, each a single /@@bulk request and transaction
+
+    Responses are not rendered. When a batch fails it is aborted as a whole
+    so its rows are then loaded one by one to report the failing rows.
+    """
+    json_method = getattr(testapp, method.lower() + '_json')
+    op = BULK_OPS[method]
+    status_int = 201 if method == 'POST' else 200
+
+    def load_batch(batch):
+        operations = [
+            {'op': op, 'path': row['_url'] + '?render=false', 'data': row['_value']}
+            for row in batch
+        ]
+        res = testapp.post_json('/@@bulk', {'operations': operations}, status='*')
+        if res.status_int == 200:
+            for row, result in zip(batch, res.json['@graph']):
+                row['_response'] = BulkResponse(status_int, result, result['@graph'][0])
+        else:
+            for row in batch:
+                row['_response'] = json_method(row['_url'], row['_value'], status='*')
+        return batch
+
+    def component(rows):
+        batch = []
+        for row in rows:
+            if row.get('_skip') or row.get('_errors') or not row.get('_url'):
+                continue
+
+            row['_value'] = {
+                k: v for k, v in row.items() if not k.startswith('_') and not k.startswith('@')
+            }
+            batch.append(row)
+            if len(batch) >= batch_size:
+                for loaded in load_batch(batch):
+                    yield loaded
+                batch = []
+
+        if batch:
+            for loaded in load_batch(batch):
+                yield loaded
+
+    return component
+
+
 ##############################################################################
 # Logging
 
@@ -325,6 +395,7 @@ def pipeline_logger(item_type, phase):
         errors = 0
         skipped = 0
         count = 0
+        begin = time.time()
         for index, row in enumerate(rows):
             row_number = index + 2  # header row
             count = index + 1
@@ -365,8 +436,11 @@ def pipeline_logger(item_type, phase):
             yield row
 
         loaded = created + updated
-        logger.info('Loaded %d of %d %s (phase %s). CREATED: %d, UPDATED: %d, SKIPPED: %d, ERRORS: %d' % (
-             loaded, count, item_type, phase, created, updated, skipped, errors))
+        elapsed = time.time() - begin
+        logger.info('Loaded %d of %d %s (phase %s). CREATED: %d, UPDATED: %d, SKIPPED: %d, ERRORS: %d '
+                    'in %.1fs (%.1f rows/s)' % (
+             loaded, count, item_type, phase, created, updated, skipped, errors,
+             elapsed, count / elapsed if elapsed else 0))
 
     return component
 
@@ -390,9 +464,10 @@ def find_doc(docsdir, filename):
     return path
 
 
-def attachment(path):
+def attachment(path, testapp=None):
     """ Create an attachment upload object from a filename
-    Embeds the attachment as a data url.
+    With a testapp the file is uploaded to /@@upload and referenced by its
+    hash, otherwise the attachment is embedded as a data url.
     """
     import magic
     import mimetypes
@@ -413,8 +488,13 @@ def attachment(path):
         attach = {
             'download': filename,
             'type': mime_type,
-            'href': 'data:%s;base64,%s' % (mime_type, b64encode(stream.read()).decode('ascii'))
         }
+        if testapp is None:
+            attach['href'] = 'data:%s;base64,%s' % (
+                mime_type, b64encode(stream.read()).decode('ascii'))
+        else:
+            res = testapp.post('/@@upload', stream.read(), content_type=mime_type)
+            attach['href'] = res.json['href']
 
         if mime_type in ('application/pdf', 'text/plain', 'text/tab-separated-values', 'text/html'):
             # XXX Should use chardet to detect charset for text files here.
@@ -452,7 +532,8 @@ def process(rows):
         pass
 
 
-def get_pipeline(testapp, docsdir, test_only, item_type, phase=None, method=None):
+def get_pipeline(testapp, docsdir, test_only, item_type, phase=None, method=None,
+                 batch_size=None):
     pipeline = [
         skip_rows_with_all_key_value(test='skip'),
         skip_rows_with_all_key_value(_test='skip'),
@@ -471,7 +552,7 @@ def get_pipeline(testapp, docsdir, test_only, item_type, phase=None, method=None
             'modeInheritance'
             # 'flowcell_details.machine',
         ),
-        add_attachment(docsdir),
+        add_attachment(docsdir, testapp),
     ]
     if phase == 1:
         method = 'POST'
@@ -483,7 +564,8 @@ def get_pipeline(testapp, docsdir, test_only, item_type, phase=None, method=None
     pipeline.extend([
         request_url(item_type, method),
         remove_keys('uuid') if method in ('PUT', 'PATCH') else noop,
-        make_request(testapp, item_type, method),
+        make_bulk_request(testapp, item_type, method, batch_size)
+        if batch_size else make_request(testapp, item_type, method),
         pipeline_logger(item_type, phase),
     ])
     return pipeline
@@ -557,21 +639,64 @@ PHASE2_PIPELINES = {
 }
 
 
-def load_all(testapp, filename, docsdir, test=False):
-    for item_type in ORDER:
-        try:
-            source = read_single_sheet(filename, item_type)
-        except ValueError:
+def load_levels(types, order=ORDER):
+    """ Group the item types in order into levels that may be loaded in parallel
+
+    Each type is placed in the level after the last type it links to. Only
+    links to types earlier in the order count, links to later types are
+    loaded in phase 2 as they would be when loading serially.
+    """
+    from contentbase.schema_graph import dependencies
+    deps = dependencies(types)
+    level = {}
+    for item_type in order:
+        if item_type in LOAD_LAST:
             continue
-        pipeline = get_pipeline(testapp, docsdir, test, item_type, phase=1)
-        process(combine(source, pipeline))
+        earlier = [level[dep] for dep in deps.get(item_type, ()) if dep in level]
+        level[item_type] = max(earlier) + 1 if earlier else 0
+    levels = [[] for i in range(max(level.values()) + 1 if level else 0)]
+    for item_type in order:
+        if item_type in level:
+            levels[level[item_type]].append(item_type)
+    levels.extend([item_type] for item_type in order if item_type in LOAD_LAST)
+    return levels
+
+
+def load_sheet(testapp, filename, docsdir, test, item_type, phase, batch_size=None):
+    try:
+        source = read_single_sheet(filename, item_type)
+    except ValueError:
+        return
+    pipeline = get_pipeline(testapp, docsdir, test, item_type, phase=phase, batch_size=batch_size)
+    process(combine(source, pipeline))
+
+
+def load_all(testapp, filename, docsdir, test=False, batch_size=None, processes=None):
+    from contentbase import TYPES
+    registry = getattr(testapp.app, 'registry', None)
+    if processes and processes > 1 and registry is None:
+        logger.warning('Dependency graph only available for a local app, loading serially')
+    if processes and processes > 1 and registry is not None:
+        from multiprocessing.pool import ThreadPool
+        from webtest import TestApp
+
+        def load_phase1(item_type):
+            # TestApp keeps a cookie jar so is not shared between threads
+            app = TestApp(testapp.app, testapp.extra_environ)
+            load_sheet(app, filename, docsdir, test, item_type, 1, batch_size)
+
+        pool = ThreadPool(processes)
+        try:
+            for level in load_levels(registry[TYPES].types):
+                pool.map(load_phase1, level, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for item_type in ORDER:
+            load_sheet(testapp, filename, docsdir, test, item_type, 1, batch_size)
 
     for item_type in ORDER:
         if item_type not in PHASE2_PIPELINES:
             continue
-        try:
-            source = read_single_sheet(filename, item_type)
-        except ValueError:
-            continue
-        pipeline = get_pipeline(testapp, docsdir, test, item_type, phase=2)
-        process(combine(source, pipeline))
+        load_sheet(testapp, filename, docsdir, test, item_type, 2, batch_size)
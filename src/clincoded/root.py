@@ -53,7 +53,10 @@ class ClinGenCurationRoot(Root):
     def __acl__(self):
         acl = acl_from_settings(self.registry.settings) + [
             (Allow, Everyone, ['list', 'search']),
-            (Allow, 'group.submitter', ['search_audit', 'audit']),
+            (Allow, 'group.submitter', ['search_audit', 'audit', 'upload']),
+            (Allow, 'group.curator', 'upload'),
+            (Allow, 'group.admin', 'upload'),
+            (Deny, Authenticated, 'upload'),
             (Allow, Authenticated, ALL_PERMISSIONS),
             (Allow, 'group.admin', ALL_PERMISSIONS),
             (Allow, 'group.forms', ('forms',)),
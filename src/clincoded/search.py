@@ -1,4 +1,5 @@
 import re
+from pyramid.httpexceptions import HTTPBadRequest
 from pyramid.view import view_config
 from contentbase import (
     Collection,
@@ -7,13 +8,19 @@ from contentbase import (
 )
 from contentbase.elasticsearch import ELASTIC_SEARCH
 from pyramid.security import effective_principals
+from sqlalchemy.util import LRUCache
 from urllib.parse import urlencode
 from collections import OrderedDict
 
+FACET_CACHE = 'search.facet_cache'
+
 
 def includeme(config):
     config.add_route('search', '/search{slash:/?}')
+    config.add_route('autocomplete', '/autocomplete{slash:/?}')
     config.scan(__name__)
+    capacity = int(config.registry.settings.get(FACET_CACHE + '.capacity', 100))
+    config.registry[FACET_CACHE] = LRUCache(capacity)
 
 
 sanitize_search_string_re = re.compile(r'[\\\+\-\&\|\!\(\)\{\}\[\]\^\~\:\/\\\*\?]')
@@ -35,23 +42,29 @@ audit_facets = [
 
 
 def get_filtered_query(term, search_fields, result_fields, principals):
-    return {
-        'query': {
+    """
+    Returns the query with the principals applied as a non-scoring filter
+    """
+    if term == '*':
+        query = {'match_all': {}}
+    else:
+        query = {
             'query_string': {
                 'query': term,
-                'fields': search_fields,
                 'default_operator': 'AND'
             }
-        },
-        'filter': {
-            'and': {
-                'filters': [
-                    {
-                        'terms': {
-                            'principals_allowed.view': principals
-                        }
+        }
+        if search_fields:
+            query['query_string']['fields'] = list(search_fields)
+    return {
+        'query': {
+            'filtered': {
+                'query': query,
+                'filter': {
+                    'terms': {
+                        'principals_allowed.view': principals
                     }
-                ]
+                }
             }
         },
         'aggs': {},
@@ -63,16 +76,23 @@ def sanitize_search_string(text):
     return sanitize_search_string_re.sub(r'\\\g<0>', text)
 
 
+# Unique so results with equal sort values keep their order between pages
+SORT_TIEBREAKER = {'_uid': {'order': 'asc'}}
+
+
 def get_sort_order():
     """
     specifies sort order for elasticsearch results
     """
-    return {
-        'embedded.date_created': {
-            'order': 'desc',
-            'ignore_unmapped': True,
-        }
-    }
+    return [
+        {
+            'embedded.date_created': {
+                'order': 'desc',
+                'ignore_unmapped': True,
+            }
+        },
+        SORT_TIEBREAKER,
+    ]
 
 
 def get_search_fields(request, doc_types):
@@ -119,129 +139,177 @@ def load_columns(request, doc_types, result):
     return fields
 
 
+def get_query_field(field):
+    """
+    Returns the indexed field used to filter on a search param
+    """
+    if field == 'type':
+        return '_type'
+    if field.startswith('audit'):
+        return field
+    return 'embedded.' + field + '.raw'
+
+
+def get_bool_filter(used_filters, exclude=None):
+    """
+    Returns a bool filter for the used filters or None when there are none
+
+    Params ending in ! are negated.
+    """
+    must = []
+    must_not = []
+    for field, terms in used_filters.items():
+        if field == exclude:
+            continue
+        if field.endswith('!'):
+            must_not.append({'terms': {get_query_field(field[:-1]): terms}})
+        else:
+            must.append({'terms': {get_query_field(field): terms}})
+    if not must and not must_not:
+        return None
+    bool_filter = {}
+    if must:
+        bool_filter['must'] = must
+    if must_not:
+        bool_filter['must_not'] = must_not
+    return {'bool': bool_filter}
+
+
 def set_filters(request, query, result):
     """
     Sets filters in the query
+
+    Filters are applied as a post filter so that facets may exclude their own
+    field's filter.
     """
-    query_filters = query['filter']['and']['filters']
-    used_filters = {}
+    used_filters = OrderedDict()
+    # Encode each param once for building the remove links
+    encoded_params = [
+        (v, urlencode([(k.encode('utf-8'), v.encode('utf-8'))]))
+        for k, v in request.params.items()
+    ]
     for field, term in request.params.items():
-        if field in ['type', 'limit', 'mode', 'searchTerm',
-                     'format', 'frame', 'datastore', 'field']:
+        if field in ['type', 'limit', 'from', 'mode', 'searchTerm',
+                     'format', 'frame', 'datastore', 'field', 'scroll', 'scroll_id']:
             continue
 
         # Add filter to result
-        qs = urlencode([
-            (k.encode('utf-8'), v.encode('utf-8'))
-            for k, v in request.params.items() if v != term
-        ])
+        qs = '&'.join(encoded for v, encoded in encoded_params if v != term)
         result['filters'].append({
             'field': field,
             'term': term,
             'remove': '{}?{}'.format(request.path, qs)
         })
 
-        # Add filter to query
-        if field.startswith('audit'):
-            query_field = field
-        else:
-            query_field = 'embedded.' + field + '.raw'
+        terms = used_filters.setdefault(field, [])
+        if term not in terms:
+            terms.append(term)
 
-        if field.endswith('!'):
-            if field not in used_filters:
-                # Setting not filter instead of terms filter
-                query_filters.append({
-                    'not': {
-                        'terms': {
-                            'embedded.' + field[:-1] + '.raw': [term],
-                        }
-                    }
-                })
-                query_terms = used_filters[field] = []
-            else:
-                query_filters.remove({
-                    'not': {
-                        'terms': {
-                            'embedded.' + field[:-1] + '.raw': used_filters[field]
-                        }
-                    }
-                })
-                used_filters[field].append(term)
-                query_filters.append({
-                    'not': {
-                        'terms': {
-                            'embedded.' + field[:-1] + '.raw': used_filters[field]
-                        }
-                    }
-                })
-        else:
-            if field not in used_filters:
-                query_terms = used_filters[field] = []
-                query_filters.append({
-                    'terms': {
-                        query_field: query_terms,
-                    }
-                })
-            else:
-                query_filters.remove({
-                    'terms': {
-                        query_field: used_filters[field]
-                    }
-                })
-                used_filters[field].append(term)
-                query_filters.append({
-                    'terms': {
-                        query_field: used_filters[field]
-                    }
-                })
-        used_filters[field].append(term)
+    post_filter = get_bool_filter(used_filters)
+    if post_filter is not None:
+        query['post_filter'] = post_filter
     return used_filters
 
 
-def set_facets(facets, used_filters, query, principals):
+def set_facets(facets, used_filters, query):
     """
     Sets facets in the query using filters
     """
     for field, _ in facets:
-        if field == 'type':
-            query_field = '_type'
-        elif field.startswith('audit'):
-            query_field = field
-        else:
-            query_field = 'embedded.' + field + '.raw'
         agg_name = field.replace('.', '-')
+        agg = {
+            agg_name: {
+                'terms': {
+                    'field': get_query_field(field),
+                    'min_doc_count': 0,
+                    'size': 100
+                }
+            }
+        }
 
-        terms = []
         # Adding facets based on filters
-        for q_field, q_terms in used_filters.items():
-            if q_field != field and q_field.startswith('audit'):
-                terms.append({'terms': {q_field: q_terms}})
-            elif q_field != field and not q_field.endswith('!'):
-                terms.append({'terms': {'embedded.' + q_field + '.raw': q_terms}})
-            elif q_field != field and q_field.endswith('!'):
-                terms.append({'not': {'terms': {'embedded.' + q_field[:-1] + '.raw': q_terms}}})
-
-        terms.append(
-            {'terms': {'principals_allowed.view': principals}}
-        )
+        facet_filter = get_bool_filter(used_filters, exclude=field)
+        if facet_filter is None:
+            facet_filter = {'match_all': {}}
         query['aggs'][agg_name] = {
-            'aggs': {
-                agg_name: {
-                    'terms': {
-                        'field': query_field,
-                        'min_doc_count': 0,
-                        'size': 100
-                    }
-                }
-            },
-            'filter': {
-                'bool': {
-                    'must': terms,
-                },
-            },
+            'aggs': agg,
+            'filter': facet_filter,
         }
 
 
+def facet_cache_key(request, search_term, doc_types, facets, used_filters, principals):
+    """
+    Returns the key under which facet results are cached or None if the
+    index generation is unknown
+    """
+    generation = request.index_generation
+    if generation is None:
+        return None
+    return (
+        generation,
+        search_term,
+        tuple(sorted(doc_types)),
+        tuple(field for field, _ in facets),
+        tuple(sorted(
+            (field, tuple(sorted(terms))) for field, terms in used_filters.items()
+        )),
+        tuple(sorted(principals)),
+    )
+
+
+def execute_search(request, query, doc_types, size, facet_key, from_=0, scroll=None):
+    """
+    Executes the query returning the hits and aggregations
+
+    Aggregations are served from the facet cache when possible, otherwise they
+    are run alongside the hits as a separate search in a single msearch.
+    When scrolling only the hits are wanted.
+    """
+    es = request.registry[ELASTIC_SEARCH]
+    es_index = request.registry.settings['contentbase.elasticsearch.index']
+    facet_cache = request.registry[FACET_CACHE]
+
+    aggs = query.pop('aggs')
+    if scroll is not None:
+        es_results = es.search(body=query, index=es_index,
+                               doc_type=doc_types or None, size=size, scroll=scroll)
+        return es_results, {}
+
+    aggregations = None
+    if facet_key is not None:
+        aggregations = facet_cache.get(facet_key)
+
+    if aggregations is not None or not aggs:
+        es_results = es.search(body=query, index=es_index,
+                               doc_type=doc_types or None, size=size, from_=from_)
+        return es_results, aggregations or {}
+
+    header = {'index': es_index}
+    if doc_types:
+        header['type'] = doc_types
+    query['size'] = size
+    query['from'] = from_
+    # Facet aggregations carry their own filters so the post filter is not
+    # needed and only the counts are wanted.
+    facet_query = {
+        'query': query['query'],
+        'aggs': aggs,
+        'size': 0,
+    }
+    hits_results, facet_results = es.msearch(body=[
+        header, query,
+        dict(header, search_type='count'), facet_query,
+    ])['responses']
+    for response in (hits_results, facet_results):
+        if 'error' in response:
+            raise RuntimeError(response['error'])
+
+    aggregations = facet_results.get('aggregations', {})
+    if facet_key is not None:
+        facet_cache[facet_key] = aggregations
+    return hits_results, aggregations
+
+
 def load_results(request, es_results, result):
     """
     Loads results to pass onto UI
@@ -288,8 +356,6 @@ def search(context, request, search_type=None):
     }
 
     principals = effective_principals(request)
-    es = request.registry[ELASTIC_SEARCH]
-    es_index = request.registry.settings['contentbase.elasticsearch.index']
     search_audit = request.has_permission('search_audit')
 
     # handling limit
@@ -302,6 +368,22 @@ def search(context, request, search_type=None):
         except ValueError:
             size = 25
 
+    # handling offset for paging through results
+    try:
+        from_ = max(int(request.params.get('from', 0)), 0)
+    except ValueError:
+        from_ = 0
+
+    # Scrolls read through all the results from a snapshot of the index, for
+    # embedded searches only as the scroll_id carries the user's principals.
+    scroll = request.params.get('scroll')
+    if scroll is not None:
+        if request.__parent__ is None:
+            raise HTTPBadRequest('scroll is only available to embedded searches')
+        scroll_id = request.params.get('scroll_id')
+        if scroll_id is not None:
+            return scroll_results(request, result, scroll_id, scroll)
+
     search_term = request.params.get('searchTerm', '*')
     if search_term != '*':
         search_term = sanitize_search_string(search_term.strip())
@@ -352,7 +434,7 @@ def search(context, request, search_type=None):
 
     # Builds filtered query which supports multiple facet selection
     query = get_filtered_query(search_term,
-                               search_fields,
+                               sorted(search_fields) if len(doc_types) == 1 else None,
                                sorted(load_columns(request, doc_types, result)),
                                principals)
 
@@ -362,10 +444,8 @@ def search(context, request, search_type=None):
     # Sorting the files when search term is not specified
     if search_term == '*':
         query['sort'] = get_sort_order()
-        query['query']['match_all'] = {}
-        del query['query']['query_string']
-    elif len(doc_types) != 1:
-        del query['query']['query_string']['fields']
+    elif 'from' in request.params:
+        query['sort'] = ['_score', SORT_TIEBREAKER]
     # elif size <= 25:
     #     # highlight only when search type, search term and size are specified
     #     query['highlight'] = {
@@ -387,36 +467,36 @@ def search(context, request, search_type=None):
         for audit_facet in audit_facets:
             facets.append(audit_facet)
 
-    set_facets(facets, used_filters, query, principals)
+    set_facets(facets, used_filters, query)
 
-    if doc_types == ['gdm'] or doc_types == ['interpretation']:
+    if scroll is None and (doc_types == ['gdm'] or doc_types == ['interpretation']):
         size = 99999
 
     # Execute the query
-    es_results = es.search(body=query, index=es_index,
-                           doc_type=doc_types or None, size=size)
+    facet_key = facet_cache_key(
+        request, search_term, doc_types, facets, used_filters, principals)
+    es_results, facet_results = execute_search(
+        request, query, doc_types, size, facet_key, from_, scroll)
 
     # Loading facets in to the results
-    if 'aggregations' in es_results:
-        facet_results = es_results['aggregations']
-        for field, facet in facets:
-            agg_name = field.replace('.', '-')
-            if agg_name not in facet_results:
-                continue
-            terms = facet_results[agg_name][agg_name]['buckets']
-            if len(terms) < 2:
-                continue
-            result['facets'].append({
-                'field': field,
-                'title': facet['title'],
-                'terms': terms,
-                'total': facet_results[agg_name]['doc_count']
-            })
+    for field, facet in facets:
+        agg_name = field.replace('.', '-')
+        if agg_name not in facet_results:
+            continue
+        terms = facet_results[agg_name][agg_name]['buckets']
+        if len(terms) < 2:
+            continue
+        result['facets'].append({
+            'field': field,
+            'title': facet['title'],
+            'terms': terms,
+            'total': facet_results[agg_name]['doc_count']
+        })
 
     # generate batch hub URL for experiments
-    if doc_types == ['experiment'] and any(
+    if doc_types == ['experiment'] and 'assembly' in facet_results and any(
             facet['doc_count'] > 0
-            for facet in es_results['aggregations']['assembly']['assembly']['buckets']):
+            for facet in facet_results['assembly']['assembly']['buckets']):
         search_params = request.query_string.replace('&', ',,')
         hub = request.route_url('batch_hub',
                                 search_params=search_params,
@@ -436,6 +516,89 @@ def search(context, request, search_type=None):
     # Adding total
     result['total'] = es_results['hits']['total']
     result['notification'] = 'Success' if result['total'] else 'No results found'
+    if scroll is not None:
+        result['scroll_id'] = es_results.get('_scroll_id')
+    return result
+
+
+def scroll_results(request, result, scroll_id, scroll):
+    """
+    Continues an embedded search's scroll with the next page of results
+    """
+    es = request.registry[ELASTIC_SEARCH]
+    es_results = es.scroll(scroll_id=scroll_id, scroll=scroll)
+    load_results(request, es_results, result)
+    result['total'] = es_results['hits']['total']
+    result['scroll_id'] = es_results.get('_scroll_id')
+    return result
+
+
+@view_config(route_name='autocomplete', request_method='GET', permission='search')
+def autocomplete(context, request):
+    """
+    Typeahead view matching the start of words in each type's autocomplete_values
+    """
+    types = request.registry[TYPES]
+    result = {
+        '@id': '/autocomplete/' + ('?' + request.query_string if request.query_string else ''),
+        '@type': ['autocomplete'],
+        'title': 'Autocomplete',
+        '@graph': [],
+        'notification': '',
+    }
+
+    term = request.params.get('q', '').strip()
+    if not term:
+        result['notification'] = 'Please enter search term'
+        return result
+
+    autocomplete_types = sorted(
+        item_type for item_type, type_info in types.types.items()
+        if 'autocomplete_values' in (type_info.schema or ())
+    )
+    doc_types = request.params.getall('type') or autocomplete_types
+    bad_types = [t for t in doc_types if t not in autocomplete_types]
+    if bad_types:
+        result['notification'] = "Invalid type: %s" % ', '.join(bad_types)
+        return result
+
+    try:
+        size = min(int(request.params.get('limit', 10)), 100)
+    except ValueError:
+        size = 10
+
+    fields = set()
+    for doc_type in doc_types:
+        fields.update(
+            'embedded.' + value for value in types[doc_type].schema['autocomplete_values'])
+
+    query = {
+        'query': {
+            'filtered': {
+                'query': {
+                    'multi_match': {
+                        'query': term,
+                        'fields': sorted(field + '.autocomplete' for field in fields),
+                        'operator': 'and'
+                    }
+                },
+                'filter': {
+                    'terms': {
+                        'principals_allowed.view': effective_principals(request)
+                    }
+                }
+            }
+        },
+        '_source': ['embedded.@id', 'embedded.@type'] + sorted(fields),
+    }
+
+    es = request.registry[ELASTIC_SEARCH]
+    es_index = request.registry.settings['contentbase.elasticsearch.index']
+    es_results = es.search(body=query, index=es_index, doc_type=doc_types, size=size)
+
+    result['@graph'] = [hit['_source']['embedded'] for hit in es_results['hits']['hits']]
+    result['total'] = es_results['hits']['total']
+    result['notification'] = 'Success' if result['total'] else 'No results found'
     return result
 
 
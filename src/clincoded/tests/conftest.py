@@ -67,6 +67,7 @@ def engine_url(request):
 def app_settings(request, server_host_port, connection):
     settings = _app_settings.copy()
     settings['persona.audiences'] = 'http://%s:%s' % server_host_port
+    settings['export.directory'] = str(request.config._tmpdirhandler.mktemp('exports'))
     return settings
 
 
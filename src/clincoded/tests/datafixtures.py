@@ -61,3 +61,32 @@ def gdm(testapp, owner, gene, disease):
     res = testapp.post_json('/gdm', item)
     return testapp.get(res.location).json
 
+
+@pytest.fixture
+def link_targets(testapp):
+    import uuid
+    targets = [{'uuid': str(uuid.uuid4()), 'name': 'target%d' % i} for i in range(10)]
+    for target in targets:
+        testapp.post_json('/testing_link_target', target, status=201)
+    return targets
+
+
+@pytest.fixture
+def storage_calls(registry, monkeypatch):
+    from contentbase import STORAGE
+    storage = registry[STORAGE]
+    calls = []
+
+    def recording(name):
+        method = getattr(storage, name)
+
+        def wrapper(*args):
+            calls.append(name)
+            return method(*args)
+
+        return wrapper
+
+    for name in ['get_by_uuid', 'get_by_unique_key', 'get_by_uuids', 'get_by_unique_keys']:
+        monkeypatch.setattr(storage, name, recording(name))
+    return calls
+
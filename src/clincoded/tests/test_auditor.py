@@ -126,3 +126,117 @@ def test_link_target_audit_pass(testapp):
         errors_list.extend(errors_dict[error_type])
     errors = [e for e in errors_list if e['name'] == 'testing_link_target_status']
     assert errors == []
+
+
+def test_link_target_audit_cache_invalidated_by_new_link(testapp):
+    target = {'uuid': '775795d3-4410-4114-836b-8eeecf1d0c2f', 'status': 'CHECK'}
+    testapp.post_json('/testing_link_target', target, status=201)
+    res = testapp.get('/%s/@@audit-self' % target['uuid']).maybe_follow()
+    assert [e['name'] for e in res.json['audit']] == ['testing_link_target_status']
+    source = {'uuid': '16157204-8c8f-4672-a1a4-14f4b8021fcd', 'target': target['uuid']}
+    testapp.post_json('/testing_link_source', source, status=201)
+    res = testapp.get('/%s/@@audit-self' % target['uuid']).maybe_follow()
+    assert res.json['audit'] == []
+
+
+def test_audit_cache_stores_database_results_only(testapp, registry):
+    from contentbase.auditor import AUDIT_CACHE
+    from urllib.parse import parse_qsl
+    target = {'uuid': '775795d3-4410-4114-836b-8eeecf1d0c2f', 'status': 'CHECK'}
+    res = testapp.post_json('/testing_link_target', target, status=201)
+    path = res.json['@graph'][0]['@id']
+    audit_cache = registry[AUDIT_CACHE]
+    testapp.get(path + '@@audit-self?datastore=elasticsearch')
+    assert path not in audit_cache
+    testapp.get(path + '@@audit-self?datastore=database')
+    assert path in audit_cache
+    res = testapp.get(path + '@@audit-self?datastore=database')
+    stats = dict(parse_qsl(res.headers['X-Stats']))
+    assert stats['audit_cache_hits'] == '1'
+    assert 'audit_count' not in stats
+
+
+def test_audit_file_controlled_by_leaves_value_unchanged():
+    from copy import deepcopy
+    from contentbase.auditor import AuditFailure
+    from ..audit.file import audit_file_controlled_by
+    value = {
+        '@id': '/files/ENCFF000AAA/',
+        'status': 'released',
+        'file_format': 'fastq',
+        'dataset': {'assay_term_name': 'ChIP-seq'},
+    }
+    before = deepcopy(value)
+    with pytest.raises(AuditFailure):
+        audit_file_controlled_by(value, {})
+    assert value == before
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize('item_type', ['user', 'gene', 'disease', 'curator_page'])
+def test_audit_checkers_leave_value_unchanged(workbook, testapp, registry, monkeypatch,
+                                              item_type):
+    from copy import deepcopy
+    from contentbase.auditor import AUDIT_CACHE
+    from sqlalchemy.util import LRUCache
+    auditor = registry['auditor']
+    run_checker = auditor.run_checker
+    modified = []
+
+    def checked_run_checker(request, checker, condition, value, system, path):
+        before = deepcopy(value)
+        try:
+            return run_checker(request, checker, condition, value, system, path)
+        finally:
+            if value != before:
+                modified.append((checker.__name__, path))
+
+    monkeypatch.setattr(auditor, 'run_checker', checked_run_checker)
+    monkeypatch.setitem(registry, AUDIT_CACHE, LRUCache(100))
+    res = testapp.get('/%s/?limit=all' % item_type).maybe_follow()
+    for item in res.json['@graph']:
+        testapp.get(item['@id'] + '@@audit-self')
+    assert modified == []
+
+
+def test_audit_embeds_each_frame_once(dummy_request):
+    from contentbase.auditor import Auditor
+    auditor = Auditor()
+    auditor.add_audit_checker(raising_checker, 'test')
+    auditor.add_audit_checker(returning_checker, 'test')
+    auditor.add_audit_checker(yielding_checker, 'test', frame='object')
+    embedded = []
+    dummy_request._embed['/foo/@@embedded'] = {}
+    dummy_request._embed['/foo/@@object'] = {}
+    dummy_request.embed = lambda path: embedded.append(path) or dummy_request._embed[path]
+    errors = auditor.audit(request=dummy_request, path='/foo/', types='test')
+    assert len(errors) == 3
+    assert sorted(embedded) == ['/foo/@@embedded', '/foo/@@object']
+
+
+def test_audit_cache_updated_since(testapp, session):
+    from contentbase.auditor import updated_since
+    from contentbase.changes import snapshot_xmin
+    import uuid
+    xmin = snapshot_xmin(session)
+    target = {'uuid': '775795d3-4410-4114-836b-8eeecf1d0c2f', 'status': 'CHECK'}
+    testapp.post_json('/testing_link_target', target, status=201)
+    assert updated_since(xmin, [target['uuid']])
+    assert not updated_since(xmin, [str(uuid.uuid4())])
+
+
+def test_audit_all_records_item_error(threadlocals):
+    from ..commands.audit_all import (
+        Summary,
+        audit_item,
+    )
+    import uuid
+    missing = str(uuid.uuid4())
+    result = audit_item(threadlocals, missing)
+    assert result['uuid'] == missing
+    assert 'Traceback' in result['error']
+    summary = Summary()
+    summary.add(result)
+    assert summary.__json__()['items'] == 1
+    assert summary.__json__()['failed'] == 1
+    assert summary.__json__()['errors'] == {}
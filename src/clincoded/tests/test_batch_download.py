@@ -0,0 +1,81 @@
+def test_search_pages():
+    from ..batch_download import search_pages
+    from urllib.parse import parse_qs, urlparse
+    rows = [{'@id': '/items/%d/' % i} for i in range(5)]
+    requested = []
+    cleared = []
+
+    class Elasticsearch(object):
+        def clear_scroll(self, scroll_id):
+            cleared.append(scroll_id)
+
+    class Request(object):
+        registry = {'elasticsearch': Elasticsearch()}
+
+        def embed(self, path, as_user=None):
+            params = parse_qs(urlparse(path).query)
+            requested.append(params)
+            start = int(params.get('scroll_id', ['0'])[0])
+            limit = int(params['limit'][0])
+            return {
+                '@graph': rows[start:start + limit],
+                'total': len(rows),
+                'scroll_id': str(start + limit),
+            }
+
+    pages = list(search_pages(Request(), {'type': ['gene']}, page_size=2))
+    assert [row for page in pages for row in page] == rows
+    assert [params.get('scroll_id') for params in requested] == [None, ['2'], ['4'], ['6']]
+    assert all(params['type'] == ['gene'] for params in requested)
+    assert all(params['scroll'] == ['5m'] for params in requested)
+    assert 'from' not in requested[0]
+    assert cleared == ['8']
+
+
+def test_search_pages_closed_early_clears_scroll():
+    from ..batch_download import search_pages
+    cleared = []
+
+    class Elasticsearch(object):
+        def clear_scroll(self, scroll_id):
+            cleared.append(scroll_id)
+
+    class Request(object):
+        registry = {'elasticsearch': Elasticsearch()}
+
+        def embed(self, path, as_user=None):
+            return {'@graph': [{}], 'total': 10, 'scroll_id': 'abc'}
+
+    pages = search_pages(Request(), {}, page_size=1)
+    next(pages)
+    pages.close()
+    assert cleared == ['abc']
+
+
+def test_batch_download_chunks(monkeypatch):
+    from .. import batch_download
+    monkeypatch.setattr(
+        batch_download, 'batch_download_files',
+        lambda request, search_params: ('line %d' % i for i in range(5)))
+    chunks = list(batch_download.batch_download_chunks(None, '', lines_per_chunk=2))
+    assert chunks == [b'line 0\r\nline 1\r\n', b'line 2\r\nline 3\r\n', b'line 4\r\n']
+
+
+def test_request_context_iter():
+    from pyramid.testing import DummyRequest
+    from pyramid.threadlocal import get_current_request
+    from ..batch_download import request_context_iter
+    import transaction
+    request = DummyRequest()
+
+    def chunks():
+        for i in range(3):
+            yield get_current_request() is request, transaction.get().isDoomed()
+
+    assert list(request_context_iter(request, chunks())) == [(True, True)] * 3
+    assert get_current_request() is not request
+
+
+def test_sort_order_has_unique_tiebreaker():
+    from ..search import get_sort_order
+    assert get_sort_order()[-1] == {'_uid': {'order': 'asc'}}
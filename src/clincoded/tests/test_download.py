@@ -98,3 +98,145 @@ def test_download_create_wrong_extension(testapp):
         'href': RED_DOT,
     }}
     testapp.post_json(url, item, status=422)
+
+
+def test_download_range_and_etag(testapp, testing_download):
+    from base64 import b64decode
+    data = b64decode(RED_DOT.split(',', 1)[1])
+    url = testing_download + '/@@download/attachment/red-dot.png'
+    res = testapp.get(url, headers={'Range': 'bytes=0-9'}, status=206)
+    assert res.body == data[:10]
+    etag = testapp.get(url).headers['ETag']
+    testapp.get(url, headers={'If-None-Match': etag}, status=304)
+
+
+def test_download_identical_blobs_shared(testapp, testing_download):
+    from contentbase.storage import Blob, DBSession
+    count = DBSession().query(Blob).count()
+    item = {'attachment': {
+        'download': 'red-dot-copy.png',
+        'href': RED_DOT,
+    }}
+    testapp.post_json('/testing-downloads/', item, status=201)
+    assert DBSession().query(Blob).count() == count
+
+
+def test_download_create_from_upload(testapp):
+    from base64 import b64decode
+    data = b64decode(RED_DOT.split(',', 1)[1])
+    res = testapp.post('/@@upload', data, content_type='image/png', status=201)
+    item = {'attachment': {
+        'download': 'red-dot.png',
+        'type': 'image/png',
+        'href': res.json['href'],
+    }}
+    res = testapp.post_json('/testing-downloads/', item, status=201)
+    res = testapp.get(res.location)
+    assert res.json['attachment']['width'] == 5
+    url = res.json['@id'] + res.json['attachment']['href']
+    assert testapp.get(url).body == data
+
+
+def test_download_create_unknown_upload(testapp):
+    item = {'attachment': {
+        'download': 'red-dot.png',
+        'href': 'blob:' + '0' * 64,
+    }}
+    testapp.post_json('/testing-downloads/', item, status=422)
+
+
+def test_rdb_blob_stage_existing_blob(testapp, monkeypatch):
+    from contentbase.attachment import RDBBlobStorage
+    from io import BytesIO
+    storage = RDBBlobStorage()
+    digest = storage.stage(BytesIO(b'blob data'))
+    # As if a concurrent upload inserted it after the existence check
+    monkeypatch.setattr(storage, 'exists', lambda digest: False)
+    assert storage.stage(BytesIO(b'blob data')) == digest
+    assert storage.open(digest).read() == b'blob data'
+
+
+def test_rdb_blob_download_chunks(testapp):
+    from contentbase.attachment import BlobIter, RDBBlobStorage
+    from contentbase.storage import DBSession
+    from io import BytesIO
+    storage = RDBBlobStorage()
+    digest = storage.stage(BytesIO(b'0123456789'))
+    bind = DBSession().get_bind()
+    blob_iter = BlobIter(bind, storage.blob_id(digest), chunk_size=4)
+    assert list(blob_iter) == [b'0123', b'4567', b'89']
+    assert list(blob_iter.app_iter_range(3, 9)) == [b'3456', b'78']
+
+
+def test_upload_requires_upload_permission(authenticated_testapp):
+    authenticated_testapp.post('/@@upload', b'data', content_type='text/plain', status=403)
+
+
+def test_upload_size_limit(testapp, registry, monkeypatch):
+    monkeypatch.setitem(registry.settings, 'blob.max_upload_size', '4')
+    testapp.post('/@@upload', b'data', content_type='text/plain', status=201)
+    testapp.post('/@@upload', b'data!', content_type='text/plain', status=413)
+
+
+def test_upload_garbage_collected_unless_referenced(testapp, registry):
+    from base64 import b64decode
+    from contentbase.attachment import collect_garbage
+    from contentbase.storage import Blob, DBSession
+    import datetime
+    data = b64decode(RED_DOT.split(',', 1)[1])
+    used = testapp.post('/@@upload', data, content_type='image/png', status=201).json
+    unused = testapp.post('/@@upload', b'unused', content_type='text/plain', status=201).json
+    item = {'attachment': {
+        'download': 'red-dot.png',
+        'type': 'image/png',
+        'href': used['href'],
+    }}
+    testapp.post_json('/testing-downloads/', item, status=201)
+    past = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=1)
+    assert collect_garbage(registry, past) == []
+    future = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1)
+    assert collect_garbage(registry, future, dry_run=True) == [unused['sha256']]
+    assert collect_garbage(registry, future) == [unused['sha256']]
+    DBSession().flush()
+    storage = registry['blob_storage']
+    assert DBSession().query(Blob).get(storage.blob_id(used['sha256'])) is not None
+    assert DBSession().query(Blob).get(storage.blob_id(unused['sha256'])) is None
+
+
+def test_upload_referenced_by_old_revision_not_garbage_collected(testapp, registry):
+    from base64 import b64decode
+    from contentbase.attachment import collect_garbage
+    from contentbase.storage import Blob, DBSession
+    import datetime
+    data = b64decode(RED_DOT.split(',', 1)[1])
+    old = testapp.post('/@@upload', data, content_type='image/png', status=201).json
+    item = {'attachment': {
+        'download': 'red-dot.png',
+        'type': 'image/png',
+        'href': old['href'],
+    }}
+    res = testapp.post_json('/testing-downloads/', item, status=201)
+    item = {'attachment': {
+        'download': 'blue-dot.png',
+        'href': BLUE_DOT,
+    }}
+    testapp.put_json(res.location, item, status=200)
+    future = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1)
+    assert collect_garbage(registry, future) == []
+    storage = registry['blob_storage']
+    assert DBSession().query(Blob).get(storage.blob_id(old['sha256'])) is not None
+
+
+def test_file_blob_garbage_collection(tmpdir):
+    from contentbase.attachment import FileBlobStorage
+    from io import BytesIO
+    import datetime
+    storage = FileBlobStorage(str(tmpdir))
+    used = storage.stage(BytesIO(b'used'))
+    unused = storage.stage(BytesIO(b'unused'))
+    past = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=1)
+    assert storage.collect_garbage({used}, past) == []
+    future = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1)
+    assert storage.collect_garbage({used}, future) == [unused]
+    assert storage.exists(used)
+    assert not storage.exists(unused)
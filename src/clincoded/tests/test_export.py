@@ -0,0 +1,155 @@
+import pytest
+
+
+def test_export_job_store(tmpdir):
+    from ..export import JobStore
+    store = JobStore(str(tmpdir.join('exports')))
+    job_id = 'a' * 32
+    assert store.get(job_id) is None
+    store.save({'uuid': job_id, 'status': 'queued'})
+    store.update(job_id, status='done')
+    assert store.get(job_id) == {'uuid': job_id, 'status': 'done'}
+
+
+def test_export_job_store_rejects_paths(tmpdir):
+    from ..export import JobStore
+    store = JobStore(str(tmpdir))
+    assert store.get('../' + 'a' * 29) is None
+
+
+def test_export_job_lock(tmpdir):
+    from ..export import JobStore
+    store = JobStore(str(tmpdir))
+    job_id = 'a' * 32
+    lock = store.lock(job_id)
+    assert lock is not None
+    assert store.lock(job_id) is None
+    lock.close()
+    store.lock(job_id).close()
+
+
+class RecordingPool(object):
+    def __init__(self):
+        self.submitted = []
+
+    def apply_async(self, func, args):
+        self.submitted.extend(args)
+
+
+@pytest.fixture
+def exporter(registry, tmpdir, monkeypatch):
+    from ..export import (
+        EXPORTER,
+        JobStore,
+    )
+    exporter = registry[EXPORTER]
+    monkeypatch.setattr(exporter, 'store', JobStore(str(tmpdir.join('exports'))))
+    monkeypatch.setitem(exporter.__dict__, 'pool', RecordingPool())
+    return exporter
+
+
+def test_export_submit_status_download(testapp, exporter):
+    import gzip
+    res = testapp.post_json('/export/', {'format': 'files', 'search_params': 'type=gene'},
+                            status=202)
+    job_id = res.json['uuid']
+    assert exporter.pool.submitted == [(exporter.store.directory, job_id)]
+    res = testapp.get(res.location)
+    assert res.json['status'] == 'queued'
+    assert 'remote_user' not in res.json
+    testapp.get('/export/%s/@@download/files.txt.gz' % job_id, status=404)
+
+    with gzip.open(exporter.store.result_path(job_id), 'wb') as f:
+        f.write(b'/files/a/\r\n')
+    exporter.store.update(job_id, status='done', filename='files.txt.gz')
+    res = testapp.get('/export/%s/' % job_id)
+    assert res.json['href'] == '/export/%s/@@download/files.txt.gz' % job_id
+    res = testapp.get(res.json['href'])
+    assert gzip.decompress(res.body) == b'/files/a/\r\n'
+
+
+def test_export_submit_requires_login(anontestapp, exporter):
+    anontestapp.post_json('/export/', {'format': 'files'}, status=403)
+    assert exporter.pool.submitted == []
+
+
+def test_export_requeue(exporter):
+    queued, running, done = 'a' * 32, 'b' * 32, 'c' * 32
+    exporter.store.save({'uuid': queued, 'status': 'queued'})
+    exporter.store.save({'uuid': running, 'status': 'running'})
+    exporter.store.save({'uuid': done, 'status': 'done'})
+    assert sorted(exporter.requeue()) == [queued, running]
+    assert sorted(exporter.pool.submitted) == [
+        (exporter.store.directory, queued),
+        (exporter.store.directory, running),
+    ]
+
+
+def test_export_cleanup(exporter):
+    import os
+    import time
+    old, recent, queued = 'a' * 32, 'b' * 32, 'c' * 32
+    exporter.store.save({'uuid': old, 'status': 'done'})
+    exporter.store.save({'uuid': recent, 'status': 'failed'})
+    exporter.store.save({'uuid': queued, 'status': 'queued'})
+    with open(exporter.store.result_path(old), 'wb'):
+        pass
+    expired = time.time() - exporter.retention - 60
+    for job_id in (old, queued):
+        os.utime(exporter.store.status_path(job_id), (expired, expired))
+    assert exporter.cleanup() == [old]
+    assert exporter.store.get(old) is None
+    assert not os.path.exists(exporter.store.result_path(old))
+    assert exporter.store.get(recent) is not None
+    assert exporter.store.get(queued) is not None
+
+
+@pytest.fixture
+def export_job_env(app, exporter, monkeypatch):
+    from contentbase import elasticsearch
+    from .. import export
+    generations = []
+    monkeypatch.setattr(export, 'app', app)
+    monkeypatch.setattr(elasticsearch, 'index_generation', lambda request: generations.pop(0))
+    return generations
+
+
+def test_export_job(exporter, export_job_env, monkeypatch):
+    import gzip
+    from .. import export
+    calls = []
+
+    def generate(request, search_params):
+        calls.append(request.remote_user)
+        yield search_params.encode('utf-8')
+        yield b' as ' + request.remote_user.encode('utf-8')
+
+    monkeypatch.setitem(export.EXPORT_FORMATS, 'testing', (generate, 'testing.txt.gz'))
+    job_id = 'a' * 32
+    exporter.store.save({
+        'uuid': job_id, 'status': 'queued', 'format': 'testing',
+        'search_params': 'type=gene', 'remote_user': 'TEST', 'host_url': 'http://localhost',
+    })
+    # The index changes during the first attempt
+    export_job_env.extend([1, 2, 2, 2])
+    assert export.run_export((exporter.store.directory, job_id)) == job_id
+    assert calls == ['TEST', 'TEST']
+    job = exporter.store.get(job_id)
+    assert job['status'] == 'done'
+    assert job['generation'] == 2
+    assert job['filename'] == 'testing.txt.gz'
+    with gzip.open(exporter.store.result_path(job_id)) as f:
+        assert f.read() == b'type=gene as TEST'
+
+
+def test_export_job_unknown_format(exporter, export_job_env):
+    from ..export import export_job
+    job_id = 'a' * 32
+    exporter.store.save({
+        'uuid': job_id, 'status': 'queued', 'format': 'unknown',
+        'search_params': '', 'remote_user': 'TEST', 'host_url': 'http://localhost',
+    })
+    export_job(exporter.store, job_id)
+    job = exporter.store.get(job_id)
+    assert job['status'] == 'failed'
+    assert 'unknown' in job['error']
@@ -8,3 +8,12 @@ def test_graph_svg(testapp):
     res = testapp.get('/profiles/graph.svg', status=200)
     assert res.content_type == 'image/svg+xml'
     assert res.text
+
+
+def test_graph_dependencies(registry):
+    from contentbase import TYPES
+    from contentbase.schema_graph import dependencies
+    deps = dependencies(registry[TYPES].types)
+    assert 'testing_link_target' in deps['testing_link_source']
+    assert 'testing_link_source' not in deps['testing_link_target']
+    assert all(item_type not in targets for item_type, targets in deps.items())
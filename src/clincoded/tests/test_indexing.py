@@ -123,3 +123,97 @@ def test_listening(testapp, listening_conn):
     notify = listening_conn.notifies.pop()
     assert notify.channel == 'contentbase.transaction'
     assert int(notify.payload) > 0
+
+
+def test_changes_wait_woken_by_commit(testapp):
+    import threading
+    import time
+    since = testapp.get('/changes').json['next']
+    result = {}
+
+    def wait():
+        result['res'] = testapp.get('/changes?since=%d&wait=30' % since)
+
+    waiter = threading.Thread(target=wait)
+    begin = time.time()
+    waiter.start()
+    time.sleep(1)
+    res = testapp.post_json('/testing-post-put-patch/', {'required': ''})
+    uuid = res.json['@graph'][0]['uuid']
+    waiter.join(30)
+    assert time.time() - begin < 30
+    changes = result['res'].json['@graph']
+    assert [change['updated'] for change in changes] == [[uuid]]
+
+
+def test_batch_hub_cache_invalidated_by_indexing(app, testapp, indexer_testapp):
+    from ..visualization import HUB_CACHE
+    res = testapp.post_json('/testing-post-put-patch/', {'required': ''})
+    indexer_testapp.post_json('/index', {'record': True})
+    url = '/batch_hub/type=testing_post_put_patch/hub.txt'
+    first = testapp.get(url)
+    testapp.get(url, headers={'If-None-Match': first.etag}, status=304)
+
+    def cached_generations():
+        return {
+            key[0] for key in app.registry[HUB_CACHE]
+            if key[2] == 'type=testing_post_put_patch'
+        }
+
+    assert len(cached_generations()) == 1
+    testapp.patch_json(res.json['@graph'][0]['@id'], {'required': 'changed'})
+    indexer_testapp.post_json('/index', {'record': True})
+    testapp.get(url)
+    assert len(cached_generations()) == 2
+
+
+@pytest.fixture
+def archivable(app, testapp, indexer_testapp):
+    """ Two indexed transactions updating an item and the archive arguments
+    """
+    import datetime
+    from ..commands.archive_transactions import indexed_xmin
+    res = testapp.post_json('/testing-post-put-patch/', {'required': ''})
+    item = res.json['@graph'][0]
+    testapp.patch_json(item['@id'], {'required': 'changed'})
+    indexer_testapp.post_json('/index', {'record': True})
+    before = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=1)
+    return item, before, indexed_xmin(app.registry)
+
+
+def test_archive_transactions(testapp, indexer_testapp, archivable):
+    import io
+    import json
+    from ..commands.archive_transactions import run
+    item, before, max_xid = archivable
+    assert [c['updated'] for c in testapp.get('/changes').json['@graph']] == [
+        [item['uuid']], [item['uuid']]]
+
+    output = io.StringIO()
+    archived, deleted = run(output, before, max_xid, batch_size=1)
+    lines = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert (archived, deleted) == (2, 0)
+    assert [line['data']['updated'] for line in lines] == [[item['uuid']], [item['uuid']]]
+    res = testapp.get('/changes')
+    assert [c['updated'] for c in res.json['@graph']] == [[], []]
+    assert run(io.StringIO(), before, max_xid) == (0, 0)
+
+    # Indexing and changes continue from the archived records
+    since = res.json['next']
+    testapp.patch_json(item['@id'], {'required': 'again'})
+    res = indexer_testapp.post_json('/index', {'record': True})
+    assert res.json['updated'] == [item['uuid']]
+    assert res.json['indexed'] == 1
+    res = testapp.get('/changes?since=%d' % since)
+    assert [c['updated'] for c in res.json['@graph']] == [[item['uuid']]]
+
+
+def test_archive_transactions_dry_run(testapp, archivable):
+    import io
+    from ..commands.archive_transactions import run
+    item, before, max_xid = archivable
+    changes = testapp.get('/changes').json['@graph']
+    output = io.StringIO()
+    assert run(output, before, max_xid, dry_run=True) == (2, 0)
+    assert len(output.getvalue().splitlines()) == 2
+    assert testapp.get('/changes').json['@graph'] == changes
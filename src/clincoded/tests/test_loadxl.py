@@ -0,0 +1,23 @@
+def test_load_rows_in_bulk_batches(testapp):
+    from ..loadxl import combine, get_pipeline
+    from uuid import uuid4
+    rows = [{'uuid': str(uuid4()), 'required': 'row %d' % i} for i in range(5)]
+    # Invalid, so its batch is loaded row by row
+    rows.append({'uuid': str(uuid4())})
+    pipeline = get_pipeline(
+        testapp, [], False, 'testing_post_put_patch', method='POST', batch_size=2)
+    loaded = list(combine(iter(rows), pipeline))
+    assert [row['_response'].status_int for row in loaded] == [201] * 5 + [422]
+    for row in rows[:5]:
+        res = testapp.get('/testing-post-put-patch/%s/' % row['uuid'])
+        assert res.json['required'] == row['required']
+
+
+def test_load_levels(app):
+    from contentbase import TYPES
+    from ..loadxl import ORDER, load_levels
+    levels = load_levels(app.registry[TYPES].types)
+    position = {item_type: i for i, level in enumerate(levels) for item_type in level}
+    assert sorted(position) == sorted(ORDER)
+    assert position['gdm'] > position['user']
+    assert levels[-1] == ['curator_page']
@@ -0,0 +1,16 @@
+def test_format_stats():
+    from ..commands.profile import format_stats
+    x_stats = 'db_count=3&db_time=250&es_client_time=500&wsgi_time=1000'
+    assert format_stats(x_stats).split('\n\t') == [
+        'db_count=3',
+        'db_time=250',
+        'es_client_time=500',
+        'wsgi_time=1000',
+        'db_time share: 25.0%',
+        'es_client_time share: 50.0%',
+    ]
+
+
+def test_format_stats_without_wsgi_time():
+    from ..commands.profile import format_stats
+    assert format_stats('db_time=250') == 'db_time=250'
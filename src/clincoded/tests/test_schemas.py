@@ -46,3 +46,84 @@ def test_dependencies(testapp):
 #             res = testapp.get(changelog)
 #             assert res.status_int == 200, changelog
 #             assert res.content_type == 'text/markdown'
+
+
+LINKS_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'targets': {
+            'type': 'array',
+            'items': {'type': 'string', 'linkTo': 'testing_link_target'},
+        },
+        'nested': {
+            'type': 'object',
+            'properties': {
+                'target': {'type': 'string', 'linkTo': 'testing_link_target'},
+            },
+        },
+    },
+}
+
+
+def test_iter_links(threadlocals):
+    from contentbase.schema_utils import iter_links
+    data = {'targets': ['a', 'b'], 'nested': {'target': 'c'}, 'other': 'd'}
+    links = sorted(value for link_to, value in iter_links(threadlocals, LINKS_SCHEMA, data))
+    assert links == ['a', 'b', 'c']
+
+
+def test_validate_prefetches_links(link_targets, threadlocals, storage_calls):
+    from contentbase.schema_utils import validate
+    data = {
+        'targets': [target['uuid'] for target in link_targets[:5]],
+        'nested': {'target': link_targets[5]['name']},
+    }
+    validated, errors = validate(LINKS_SCHEMA, data)
+    assert errors == []
+    assert validated['nested']['target'] == link_targets[5]['uuid']
+    assert storage_calls == ['get_by_uuids', 'get_by_unique_keys']
+
+
+def test_validate_prefetched_missing_links_fail(link_targets, threadlocals, storage_calls):
+    from contentbase.schema_utils import validate
+    import uuid
+    data = {
+        'targets': [link_targets[0]['uuid'], str(uuid.uuid4())],
+        'nested': {'target': 'missing'},
+    }
+    validated, errors = validate(LINKS_SCHEMA, data)
+    assert len(errors) == 2
+    assert all('not found' in error.message for error in errors)
+
+
+def test_validate_link_to_other_type_fails(testapp, link_targets, threadlocals):
+    from contentbase.schema_utils import validate
+    res = testapp.post_json('/testing_link_source', {'target': link_targets[0]['uuid']})
+    source_uuid = res.json['@graph'][0]['uuid']
+    validated, errors = validate(LINKS_SCHEMA, {'targets': [source_uuid]})
+    error, = errors
+    assert 'not found' in error.message
+
+
+def test_user_submits_for_cached(curator, lab, threadlocals, root):
+    from contentbase.schema_utils import (
+        _marker,
+        user_submits_for,
+    )
+    lookups = []
+
+    class Root(object):
+        def __getitem__(self, name):
+            lookups.append(name)
+            return root[name]
+
+    class Request(object):
+        effective_principals = ['system.Everyone', 'userid.' + curator['uuid']]
+
+    request = Request()
+    request.root = Root()
+    assert user_submits_for(request) == [lab['uuid']]
+    assert user_submits_for(request) == [lab['uuid']]
+    assert lookups == [curator['uuid']]
+    request.effective_principals = ['system.Everyone']
+    assert user_submits_for(request) is _marker
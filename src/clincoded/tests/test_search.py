@@ -0,0 +1,290 @@
+import pytest
+
+
+@pytest.fixture
+def search_request():
+    from pyramid.testing import DummyRequest
+    from webob.multidict import MultiDict
+    params = MultiDict([
+        ('type', 'gdm'),
+        ('status', 'in progress'),
+        ('status', 'released'),
+        ('modeInheritance!', 'Unknown'),
+        ('audit.ERROR.category', 'missing'),
+    ])
+    return DummyRequest(params=params, path='/search/')
+
+
+def test_search_filtered_query_match_all():
+    from ..search import get_filtered_query
+    query = get_filtered_query('*', ['embedded.symbol'], ['embedded.*'], ['system.Everyone'])
+    filtered = query['query']['filtered']
+    assert filtered['query'] == {'match_all': {}}
+    assert filtered['filter'] == {'terms': {'principals_allowed.view': ['system.Everyone']}}
+    assert 'filter' not in query
+
+
+def test_search_filtered_query_string():
+    from ..search import get_filtered_query
+    query = get_filtered_query('BRCA1', None, ['embedded.*'], ['system.Everyone'])
+    query_string = query['query']['filtered']['query']['query_string']
+    assert query_string['query'] == 'BRCA1'
+    assert 'fields' not in query_string
+
+
+def test_search_set_filters(search_request):
+    from ..search import set_filters
+    query = {}
+    result = {'filters': []}
+    used_filters = set_filters(search_request, query, result)
+    assert used_filters == {
+        'status': ['in progress', 'released'],
+        'modeInheritance!': ['Unknown'],
+        'audit.ERROR.category': ['missing'],
+    }
+    assert query['post_filter'] == {
+        'bool': {
+            'must': [
+                {'terms': {'embedded.status.raw': ['in progress', 'released']}},
+                {'terms': {'audit.ERROR.category': ['missing']}},
+            ],
+            'must_not': [
+                {'terms': {'embedded.modeInheritance.raw': ['Unknown']}},
+            ],
+        },
+    }
+    assert len(result['filters']) == 4
+    assert result['filters'][0]['remove'] == (
+        '/search/?type=gdm&status=released&modeInheritance%21=Unknown'
+        '&audit.ERROR.category=missing')
+
+
+def test_search_set_filters_none():
+    from pyramid.testing import DummyRequest
+    from ..search import set_filters
+    query = {}
+    used_filters = set_filters(DummyRequest(params={'type': 'gdm'}), query, {'filters': []})
+    assert used_filters == {}
+    assert 'post_filter' not in query
+
+
+def test_search_set_facets_excludes_own_filter(search_request):
+    from ..search import (
+        set_facets,
+        set_filters,
+    )
+    query = {'aggs': {}}
+    used_filters = set_filters(search_request, query, {'filters': []})
+    set_facets([('type', {}), ('status', {})], used_filters, query)
+    assert query['aggs']['type']['aggs']['type']['terms']['field'] == '_type'
+    status_filter = query['aggs']['status']['filter']['bool']
+    assert status_filter['must'] == [{'terms': {'audit.ERROR.category': ['missing']}}]
+    assert status_filter['must_not'] == [{'terms': {'embedded.modeInheritance.raw': ['Unknown']}}]
+
+
+class StubElasticsearch(object):
+    """ Records requests and answers with canned responses
+    """
+    hits = {'hits': {'total': 0, 'hits': []}}
+    aggregations = {'type': {'type': {'buckets': [{'key': 'gdm', 'doc_count': 1}]}}}
+
+    def __init__(self):
+        self.calls = []
+
+    def search(self, **kw):
+        self.calls.append(('search', kw))
+        return self.hits
+
+    def scroll(self, **kw):
+        self.calls.append(('scroll', kw))
+        return self.hits
+
+    def msearch(self, body):
+        self.calls.append(('msearch', body))
+        return {'responses': [self.hits, {'aggregations': self.aggregations}]}
+
+
+@pytest.fixture
+def stub_es(config):
+    from contentbase.elasticsearch import ELASTIC_SEARCH
+    from sqlalchemy.util import LRUCache
+    from ..search import FACET_CACHE
+    config.add_settings({'contentbase.elasticsearch.index': 'clincoded'})
+    config.registry[ELASTIC_SEARCH] = es = StubElasticsearch()
+    config.registry[FACET_CACHE] = LRUCache(10)
+    return es
+
+
+@pytest.fixture
+def es_request(stub_es):
+    from pyramid.testing import DummyRequest
+    request = DummyRequest()
+    request.index_generation = 1
+    return request
+
+
+def search_query():
+    from ..search import get_filtered_query
+    query = get_filtered_query('*', None, ['embedded.*'], ['system.Everyone'])
+    query['post_filter'] = {'bool': {'must': [{'terms': {'_type': ['gdm']}}]}}
+    query['aggs'] = {'type': {'aggs': {}, 'filter': {'match_all': {}}}}
+    return query
+
+
+def facet_key(request, generation=1):
+    from ..search import facet_cache_key
+    request.index_generation = generation
+    return facet_cache_key(request, '*', ['gdm'], [('type', {})], {}, ['system.Everyone'])
+
+
+def test_execute_search_msearch_split(es_request, stub_es):
+    from ..search import execute_search
+    hits, aggregations = execute_search(
+        es_request, search_query(), ['gdm'], 25, facet_key(es_request), from_=50)
+    assert hits == stub_es.hits
+    assert aggregations == stub_es.aggregations
+    (method, body), = stub_es.calls
+    assert method == 'msearch'
+    header, query, facet_header, facet_query = body
+    assert header == {'index': 'clincoded', 'type': ['gdm']}
+    assert (query['size'], query['from']) == (25, 50)
+    assert 'aggs' not in query
+    assert facet_header == {'index': 'clincoded', 'type': ['gdm'], 'search_type': 'count'}
+    assert facet_query['size'] == 0
+    assert facet_query['query'] == query['query']
+    assert 'post_filter' not in facet_query
+
+
+def test_execute_search_facet_cache_hit(es_request, stub_es):
+    from ..search import execute_search
+    execute_search(es_request, search_query(), ['gdm'], 25, facet_key(es_request))
+    hits, aggregations = execute_search(
+        es_request, search_query(), ['gdm'], 25, facet_key(es_request))
+    assert aggregations == stub_es.aggregations
+    assert [method for method, kw in stub_es.calls] == ['msearch', 'search']
+    assert 'aggs' not in stub_es.calls[1][1]['body']
+
+
+def test_execute_search_facet_cache_miss(es_request, stub_es):
+    from ..search import (
+        execute_search,
+        facet_cache_key,
+    )
+    execute_search(es_request, search_query(), ['gdm'], 25, facet_key(es_request))
+    other_key = facet_cache_key(
+        es_request, 'BRCA1', ['gdm'], [('type', {})], {}, ['system.Everyone'])
+    execute_search(es_request, search_query(), ['gdm'], 25, other_key)
+    assert [method for method, kw in stub_es.calls] == ['msearch', 'msearch']
+
+
+def test_execute_search_facet_cache_invalidated_by_index_generation(es_request, stub_es):
+    from ..search import execute_search
+    execute_search(es_request, search_query(), ['gdm'], 25, facet_key(es_request, 1))
+    execute_search(es_request, search_query(), ['gdm'], 25, facet_key(es_request, 2))
+    assert [method for method, kw in stub_es.calls] == ['msearch', 'msearch']
+
+
+def test_execute_search_without_index_generation_not_cached(es_request, stub_es):
+    from ..search import execute_search
+    assert facet_key(es_request, None) is None
+    execute_search(es_request, search_query(), ['gdm'], 25, None)
+    execute_search(es_request, search_query(), ['gdm'], 25, None)
+    assert [method for method, kw in stub_es.calls] == ['msearch', 'msearch']
+
+
+def test_facet_cache_key_normalized(es_request):
+    from ..search import facet_cache_key
+    key = facet_cache_key(
+        es_request, '*', ['gdm', 'gene'], [('type', {})],
+        {'status': ['released', 'in progress']}, ['b', 'a'])
+    assert key == facet_cache_key(
+        es_request, '*', ['gene', 'gdm'], [('type', {})],
+        {'status': ['in progress', 'released']}, ['a', 'b'])
+
+
+def test_execute_search_response_error(es_request, stub_es):
+    from ..search import execute_search
+    stub_es.hits = {'error': 'SearchPhaseExecutionException'}
+    with pytest.raises(RuntimeError):
+        execute_search(es_request, search_query(), ['gdm'], 25, facet_key(es_request))
+
+
+def test_execute_search_scroll(es_request, stub_es):
+    from ..search import execute_search
+    hits, aggregations = execute_search(
+        es_request, search_query(), ['gdm'], 100, facet_key(es_request), scroll='5m')
+    assert aggregations == {}
+    (method, kw), = stub_es.calls
+    assert method == 'search'
+    assert (kw['size'], kw['scroll']) == (100, '5m')
+    assert 'from_' not in kw
+    assert 'aggs' not in kw['body']
+
+
+def test_scroll_results(es_request, stub_es):
+    from webob.multidict import MultiDict
+    from ..search import scroll_results
+    stub_es.hits = {
+        '_scroll_id': 'next',
+        'hits': {'total': 3, 'hits': [{'_source': {'object': {'@id': '/genes/BRCA1/'}}}]},
+    }
+    es_request.params = MultiDict({'frame': 'object'})
+    result = scroll_results(es_request, {'@graph': []}, 'first', '5m')
+    assert result == {'@graph': [{'@id': '/genes/BRCA1/'}], 'total': 3, 'scroll_id': 'next'}
+    assert stub_es.calls == [('scroll', {'scroll_id': 'first', 'scroll': '5m'})]
+
+
+def test_search_scroll_embedded_only(testapp, autocomplete_es):
+    testapp.get('/search/?type=gene&scroll=5m', status=400)
+    assert autocomplete_es.calls == []
+
+
+@pytest.fixture
+def autocomplete_es(registry, monkeypatch):
+    from contentbase.elasticsearch import ELASTIC_SEARCH
+    es = StubElasticsearch()
+    es.hits = {'hits': {'total': 1, 'hits': [
+        {'_source': {'embedded': {'@id': '/genes/BRCA1/', 'symbol': 'BRCA1'}}},
+    ]}}
+    monkeypatch.setitem(registry, ELASTIC_SEARCH, es)
+    monkeypatch.setitem(registry.settings, 'contentbase.elasticsearch.index', 'clincoded')
+    return es
+
+
+def test_autocomplete(testapp, autocomplete_es):
+    res = testapp.get('/autocomplete/?q=brc&type=gene&limit=5')
+    assert res.json['@graph'] == [{'@id': '/genes/BRCA1/', 'symbol': 'BRCA1'}]
+    assert res.json['total'] == 1
+    (method, kw), = autocomplete_es.calls
+    assert (kw['doc_type'], kw['size']) == (['gene'], 5)
+    multi_match = kw['body']['query']['filtered']['query']['multi_match']
+    assert multi_match['query'] == 'brc'
+    assert multi_match['fields'] == ['embedded.name.autocomplete', 'embedded.symbol.autocomplete']
+
+
+def test_autocomplete_invalid_type(testapp, autocomplete_es):
+    res = testapp.get('/autocomplete/?q=brc&type=gdm')
+    assert res.json['notification'] == 'Invalid type: gdm'
+    assert autocomplete_es.calls == []
+
+
+def test_autocomplete_empty_term(testapp, autocomplete_es):
+    res = testapp.get('/autocomplete/?q=+')
+    assert res.json['notification'] == 'Please enter search term'
+    assert autocomplete_es.calls == []
+
+
+def test_type_mapping_autocomplete_subfield(registry):
+    from contentbase import TYPES
+    from contentbase.elasticsearch.create_mapping import (
+        index_settings,
+        type_mapping,
+    )
+    mapping = type_mapping(registry[TYPES], 'gene')
+    for name in ('symbol', 'name'):
+        subfield = mapping['properties'][name]['fields']['autocomplete']
+        assert subfield['index_analyzer'] == 'clincoded_autocomplete_analyzer'
+        assert subfield['search_analyzer'] == 'clincoded_search_analyzer'
+    analysis = index_settings()['index']['analysis']
+    assert 'prefix' in analysis['analyzer']['clincoded_autocomplete_analyzer']['filter']
+    assert analysis['filter']['prefix']['type'] == 'edgeNGram'
@@ -146,3 +146,49 @@ def test_keys(session):
     session.add(key3)
     with pytest.raises(FlushError):
         session.flush()
+
+
+def test_storage_get_by_uuids(link_targets, threadlocals, registry):
+    from contentbase import STORAGE
+    import uuid
+    uuids = [target['uuid'] for target in link_targets]
+    models = registry[STORAGE].get_by_uuids(uuids + [str(uuid.uuid4())])
+    assert sorted(str(model.uuid) for model in models) == sorted(uuids)
+
+
+def test_storage_get_by_unique_keys(link_targets, threadlocals, registry):
+    from contentbase import STORAGE
+    pkeys = [('testing_link_target:name', target['name']) for target in link_targets]
+    result = registry[STORAGE].get_by_unique_keys(pkeys + [('testing_link_target:name', 'x')])
+    assert {pkey: str(model.uuid) for pkey, model in result.items()} == {
+        pkey: target['uuid'] for pkey, target in zip(pkeys, link_targets)}
+
+
+def test_connection_prefetch(link_targets, threadlocals, registry, storage_calls):
+    from contentbase import CONNECTION
+    connection = registry[CONNECTION]
+    uuids = [target['uuid'] for target in link_targets[:5]]
+    pkeys = [('testing_link_target:name', target['name']) for target in link_targets[5:]]
+    connection.prefetch(uuids, pkeys)
+    assert storage_calls == ['get_by_uuids', 'get_by_unique_keys']
+    for uuid in uuids:
+        assert str(connection.get_by_uuid(uuid).uuid) == uuid
+    for pkey, target in zip(pkeys, link_targets[5:]):
+        item = connection.get_by_unique_key(*pkey)
+        assert item is connection.get_by_uuid(target['uuid'])
+    # Cached items are not fetched again
+    connection.prefetch(uuids, pkeys)
+    assert storage_calls == ['get_by_uuids', 'get_by_unique_keys']
+
+
+def test_connection_prefetch_unknown_item_type(session, threadlocals, registry):
+    from contentbase import CONNECTION
+    from contentbase.resources import UnknownItemTypeError
+    from contentbase.storage import Resource
+    resource = Resource('unknown_item_type', {'': {}})
+    session.add(resource)
+    session.flush()
+    with pytest.raises(UnknownItemTypeError):
+        registry[CONNECTION].prefetch([str(resource.rid)])
+    with pytest.raises(UnknownItemTypeError):
+        registry[CONNECTION].get_by_uuid(str(resource.rid))
@@ -287,3 +287,98 @@ def test_profiles(testapp, item_type):
     res = testapp.get('/profiles/%s.json' % item_type).maybe_follow(status=200)
     errors = Draft4Validator.check_schema(res.json)
     assert not errors
+
+
+def test_bulk_create_and_update(testapp):
+    uuid = '0f13ff76-c559-4e70-9497-a6130841df9f'
+    res = testapp.post_json('/@@bulk', {'operations': [
+        {'op': 'create', 'path': '/testing-post-put-patch/',
+         'data': {'uuid': uuid, 'required': 'first'}},
+        {'op': 'update', 'path': '/testing-post-put-patch/%s/' % uuid,
+         'data': {'simple1': 'changed'}},
+    ]})
+    assert res.json['status'] == 'success'
+    assert res.json['committed'] is True
+    assert [op['status'] for op in res.json['operations']] == ['success', 'success']
+    assert [op['code'] for op in res.json['operations']] == [201, 200]
+    assert len(res.json['@graph']) == 2
+    res = testapp.get('/testing-post-put-patch/%s/' % uuid)
+    assert res.json['required'] == 'first'
+    assert res.json['simple1'] == 'changed'
+
+
+def test_bulk_failure_aborts_all(testapp):
+    uuid = '0f13ff76-c559-4e70-9497-a6130841df9f'
+    res = testapp.post_json('/@@bulk', {'operations': [
+        {'op': 'create', 'path': '/testing-post-put-patch/',
+         'data': {'uuid': uuid, 'required': 'first'}},
+        {'op': 'create', 'path': '/testing-post-put-patch/', 'data': {}},
+    ]}, status=422)
+    assert res.json['status'] == 'error'
+    assert res.json['@graph'][-1]['status'] == 'error'
+    testapp.get('/testing-post-put-patch/%s/' % uuid, status=404)
+
+
+def test_bulk_partial_failure(testapp):
+    first = '0f13ff76-c559-4e70-9497-a6130841df9f'
+    second = '5b3f7c1a-9d2e-4c6b-8a1f-2e4d6c8b0a22'
+    res = testapp.post_json('/@@bulk', {'operations': [
+        {'op': 'create', 'path': '/testing-post-put-patch/',
+         'data': {'uuid': first, 'required': 'first'}},
+        {'op': 'update', 'path': '/testing-post-put-patch/%s/' % first,
+         'data': {'simple1': 'changed'}},
+        {'op': 'update', 'path': '/testing-post-put-patch/%s/' % second,
+         'data': {'simple1': 'changed'}},
+        {'op': 'create', 'path': '/testing-post-put-patch/',
+         'data': {'uuid': second, 'required': 'second'}},
+    ]}, status=404)
+    assert res.json['status'] == 'error'
+    assert res.json['committed'] is False
+    assert res.json['failed'] == 2
+    assert res.json['operations'] == [
+        {'op': 'create', 'path': '/testing-post-put-patch/', 'status': 'aborted', 'code': 201},
+        {'op': 'update', 'path': '/testing-post-put-patch/%s/' % first, 'status': 'aborted',
+         'code': 200},
+        {'op': 'update', 'path': '/testing-post-put-patch/%s/' % second, 'status': 'error',
+         'code': 404},
+        {'op': 'create', 'path': '/testing-post-put-patch/', 'status': 'skipped'},
+    ]
+    assert len(res.json['@graph']) == 3
+    testapp.get('/testing-post-put-patch/%s/' % first, status=404)
+    testapp.get('/testing-post-put-patch/%s/' % second, status=404)
+
+
+def test_bulk_invalid_operation(testapp):
+    res = testapp.post_json('/@@bulk', {'operations': [
+        {'op': 'create', 'path': '/testing-post-put-patch/', 'data': {'required': 'first'}},
+        {'op': 'unknown', 'path': '/testing-post-put-patch/'},
+    ]}, status=400)
+    assert [op['status'] for op in res.json['operations']] == ['aborted', 'error']
+
+
+def test_bulk_requires_permission(anontestapp):
+    anontestapp.post_json('/@@bulk', {'operations': []}, status=403)
+
+
+def test_bulk_get(testapp):
+    uuid = '0f13ff76-c559-4e70-9497-a6130841df9f'
+    missing = 'a1b2c3d4-0000-4000-8000-000000000000'
+    testapp.post_json('/testing-post-put-patch/', {'uuid': uuid, 'required': 'first'})
+    path = '/testing-post-put-patch/%s/' % uuid
+    res = testapp.post_json('/@@bulk-get', {'ids': [uuid, path, missing]})
+    assert [item['@id'] for item in res.json['@graph']] == [path, path]
+    assert res.json['@graph'][0] == testapp.get(path + '?frame=object').json
+    assert res.json['errors'] == [{'id': missing, 'code': 404}]
+    res = testapp.get('/@@bulk-get?id=%s&frame=embedded' % uuid)
+    assert res.json['@graph'][0]['required'] == 'first'
+
+
+def test_changes_excludes_transactions_in_progress(testapp):
+    # The test transaction is never committed, so is never below xmin
+    testapp.post_json('/testing-post-put-patch/', {'required': 'first'})
+    res = testapp.get('/changes')
+    assert res.json['@graph'] == []
+    assert res.json['next'] is not None
+    res = testapp.get('/changes?since=%d' % res.json['next'])
+    assert res.json['@graph'] == []
+    testapp.get('/changes?since=x', status=400)
@@ -0,0 +1,105 @@
+import pytest
+
+
+@pytest.fixture
+def hub_cache(registry, monkeypatch):
+    from sqlalchemy.util import LRUCache
+    from ..visualization import HUB_CACHE
+    cache = LRUCache(10)
+    monkeypatch.setitem(registry, HUB_CACHE, cache)
+    return cache
+
+
+@pytest.fixture
+def generated(monkeypatch):
+    from .. import visualization
+    generated = []
+
+    def generate_batch_hubs(context, request):
+        generated.append(request.matchdict['txt'])
+        return 'hub %d' % len(generated)
+
+    monkeypatch.setattr(visualization, 'generate_batch_hubs', generate_batch_hubs)
+    monkeypatch.setattr(visualization, 'effective_principals', lambda request: request.principals)
+    return generated
+
+
+def hub_request(registry, generation, principals=('system.Everyone',), **matchdict):
+    from pyramid.request import Request
+    request = Request.blank('/batch_hub/type=experiment/hub.txt')
+    request.registry = registry
+    request.matchdict = dict({'search_params': 'type=experiment', 'txt': 'hub.txt'}, **matchdict)
+    request.index_generation = generation
+    request.principals = list(principals)
+    return request
+
+
+def test_batch_hub_cache_hit(registry, hub_cache, generated):
+    from ..visualization import batch_hub
+    first = batch_hub(None, hub_request(registry, 1))
+    second = batch_hub(None, hub_request(registry, 1))
+    assert generated == ['hub.txt']
+    assert first.text == second.text == 'hub 1'
+    assert first.etag == second.etag
+
+
+def test_batch_hub_cache_keys(registry, hub_cache, generated):
+    from ..visualization import batch_hub
+    batch_hub(None, hub_request(registry, 1))
+    batch_hub(None, hub_request(registry, 1, principals=['system.Everyone', 'group.admin']))
+    batch_hub(None, hub_request(registry, 1, txt='genomes.txt'))
+    assert len(generated) == 3
+
+
+def test_batch_hub_cache_invalidated_by_index_generation(registry, hub_cache, generated):
+    from ..visualization import batch_hub
+    first = batch_hub(None, hub_request(registry, 1))
+    # The indexer has written an edit
+    second = batch_hub(None, hub_request(registry, 2))
+    assert len(generated) == 2
+    assert first.etag != second.etag
+
+
+def test_batch_hub_not_cached_without_index_generation(registry, hub_cache, generated):
+    from ..visualization import batch_hub
+    batch_hub(None, hub_request(registry, None))
+    batch_hub(None, hub_request(registry, None))
+    assert len(generated) == 2
+    assert len(hub_cache) == 0
+
+
+def test_hub_response_not_modified():
+    from pyramid.request import Request
+    from ..visualization import hub_response
+    request = Request.blank('/')
+    etag = hub_response(request, 'track hub', 'text/plain').etag
+    res = Request.blank('/', if_none_match=etag).get_response(
+        hub_response(request, 'track hub', 'text/plain'))
+    assert res.status_int == 304
+    res = Request.blank('/', if_none_match='other').get_response(
+        hub_response(request, 'track hub', 'text/plain'))
+    assert res.status_int == 200
+    assert res.cache_control.max_age == 60
+
+
+def test_generate_batch_hubs_leaves_file_query(registry):
+    from copy import deepcopy
+    from urllib.parse import (
+        parse_qs,
+        urlparse,
+    )
+    from ..visualization import (
+        FILE_QUERY,
+        generate_batch_hubs,
+    )
+    file_query = deepcopy(FILE_QUERY)
+    paths = []
+    for search_params in ['type=experiment,,status=proposed', 'type=experiment']:
+        request = hub_request(
+            registry, 1, search_params=search_params, assembly='hg19', txt='trackDb.txt')
+        request.embed = lambda path, as_user=None: paths.append(path) or {'@graph': []}
+        assert generate_batch_hubs(None, request) == ''
+        assert FILE_QUERY == file_query
+    first, second = [parse_qs(urlparse(path).query) for path in paths]
+    assert first['status'] == ['proposed']
+    assert second['status'] == ['released']
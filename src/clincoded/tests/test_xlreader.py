@@ -0,0 +1,126 @@
+import io
+import zipfile
+
+NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+REL_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+
+WORKBOOK = {
+    'xl/workbook.xml': (
+        '<workbook xmlns="%s" xmlns:r="%s"><workbookPr/><sheets>'
+        '<sheet name="gene" sheetId="1" r:id="rId1"/></sheets></workbook>' % (NS, REL_NS)),
+    'xl/_rels/workbook.xml.rels': (
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="worksheets/sheet1.xml"/></Relationships>'),
+    'xl/sharedStrings.xml': (
+        '<sst xmlns="%s"><si><t>symbol</t></si><si><t>count:integer</t></si>'
+        '<si><t>tags:array</t></si><si><t>date</t></si>'
+        '<si><r><t>BR</t></r><r><t>CA1</t></r></si></sst>' % NS),
+    'xl/styles.xml': (
+        '<styleSheet xmlns="%s"><numFmts><numFmt numFmtId="164" formatCode="yyyy\\-mm\\-dd"/>'
+        '</numFmts><cellXfs><xf numFmtId="0"/><xf numFmtId="164"/></cellXfs></styleSheet>' % NS),
+    'xl/worksheets/sheet1.xml': (
+        '<worksheet xmlns="%s"><sheetData>'
+        '<row r="1"><c r="A1" t="s"><v>0</v></c><c r="B1" t="s"><v>1</v></c>'
+        '<c r="C1" t="s"><v>2</v></c><c r="D1" t="s"><v>3</v></c></row>'
+        '<row r="2"><c r="A2" t="s"><v>4</v></c><c r="B2"><v>3.0</v></c>'
+        '<c r="C2" t="inlineStr"><is><t>a; b</t></is></c><c r="D2" s="1"><v>42370</v></c></row>'
+        '<row r="4"><c r="B4"><v>7</v></c></row>'
+        '</sheetData></worksheet>' % NS),
+}
+
+
+def make_workbook(sheet_data=None, date1904=False):
+    files = dict(WORKBOOK)
+    if sheet_data is not None:
+        files['xl/worksheets/sheet1.xml'] = (
+            '<worksheet xmlns="%s"><sheetData>%s</sheetData></worksheet>' % (NS, sheet_data))
+    if date1904:
+        files['xl/workbook.xml'] = files['xl/workbook.xml'].replace(
+            '<workbookPr/>', '<workbookPr date1904="1"/>')
+    stream = io.BytesIO()
+    with zipfile.ZipFile(stream, 'w') as zf:
+        for name, content in files.items():
+            zf.writestr(name, content)
+    stream.seek(0)
+    return stream
+
+
+def test_xlreader_rows():
+    from ..xlreader import reader
+    assert list(reader(make_workbook())) == [
+        ['symbol', 'count:integer', 'tags:array', 'date'],
+        ['BRCA1', '3', 'a; b', '2016-01-01'],
+        ['', '', '', ''],
+        ['', '7', '', ''],
+    ]
+
+
+def test_xlreader_typed_rows():
+    from ..typedsheets import cast_row_values
+    from ..xlreader import DictReader
+    rows = list(cast_row_values(DictReader(make_workbook(), sheetname='gene')))
+    assert rows[0] == {'symbol': 'BRCA1', 'count': 3, 'tags': ['a', 'b'], 'date': '2016-01-01'}
+    assert rows[1] == {'symbol': '', 'count': None, 'tags': None, 'date': ''}
+    assert rows[2] == {'symbol': '', 'count': 7, 'tags': None, 'date': ''}
+
+
+def test_xlreader_shared_strings():
+    from ..xlreader import reader
+    rows = list(reader(make_workbook(
+        '<row r="1"><c r="A1" t="s"><v>4</v></c><c r="B1" t="s"><v>0</v></c></row>')))
+    assert rows == [['BRCA1', 'symbol']]
+
+
+def test_xlreader_inline_strings():
+    from ..xlreader import reader
+    rows = list(reader(make_workbook(
+        '<row r="1"><c r="A1" t="inlineStr"><is><r><t>a</t></r><r><t>b</t></r></is></c>'
+        '<c r="B1" t="str"><v>formula</v></c><c r="C1" t="b"><v>1</v></c></row>')))
+    assert rows == [['ab', 'formula', 'TRUE']]
+
+
+def test_xlreader_dates():
+    from ..xlreader import reader
+    sheet_data = (
+        '<row r="1"><c r="A1" s="1"><v>42370</v></c><c r="B1" s="1"><v>42370.5</v></c>'
+        '<c r="C1" s="1"><v>59</v></c><c r="D1"><v>42370</v></c></row>')
+    assert list(reader(make_workbook(sheet_data))) == [
+        ['2016-01-01', '2016-01-01T12:00:00', '1900-02-28', '42370']]
+    assert list(reader(make_workbook(sheet_data, date1904=True)))[0][0] == '2020-01-02'
+
+
+def test_xlreader_sparse_cells():
+    from ..xlreader import reader
+    rows = list(reader(make_workbook(
+        '<row r="2"><c r="C2"><v>1</v></c></row>'
+        '<row r="3"><c r="A3"><v>2</v></c></row>'
+        '<row r="5"><c r="AA5"><v>3</v></c></row>')))
+    assert rows[:4] == [[], ['', '', '1'], ['2', '', ''], ['', '', '']]
+    assert len(rows) == 5
+    assert rows[4][26] == '3'
+    assert rows[4][:26] == [''] * 26
+
+
+def test_is_date_format():
+    from ..xlreader import is_date_format
+    assert is_date_format('yyyy-mm-dd')
+    assert is_date_format('[$-409]d-mmm;@')
+    assert not is_date_format('General')
+    assert not is_date_format('0.00"days"')
+    assert not is_date_format('#,##0_);[Red](#,##0)')
+
+
+def test_cast():
+    from ..typedsheets import cast
+    for types, value, expected in [
+            ([], ' text ', 'text'), (['integer'], '3', 3), (['number'], '1.5', 1.5),
+            (['integer', 'array'], '1; 2;', [1, 2]),
+            (['object'], 'a: x, b: y', {'a': 'x', 'b': 'y'}),
+            (['boolean'], 'true', True), (['array'], '', None), (['string'], 'null', None)]:
+        assert cast(types, value) == expected
+
+
+def test_cast_empty_value_of_overspecified_type():
+    from ..typedsheets import cast, compile_cast
+    assert cast(['integer', 'integer'], '') is None
+    assert compile_cast(['integer', 'array'])('') is None
@@ -1,13 +1,13 @@
 from pyramid.settings import asbool
 
 
-def parse_array(types, value):
-    return [cast(types, v) for v in value.split(';') if v.strip()]
+def parse_array(cast_item, value):
+    return [cast_item(v) for v in value.split(';') if v.strip()]
 
 
-def parse_object(types, value):
+def parse_object(cast_item, value):
     items = (part.split(':', 1) for part in value.split(',') if value.strip())
-    return {k.strip(): cast(types, v) for k, v in items}
+    return {k.strip(): cast_item(v) for k, v in items}
 
 
 def parse_string(types, value):
@@ -43,21 +43,17 @@ TYPE_BY_NAME = {
     'boolean': parse_boolean,
     'integer': parse_integer,
     'ignore': parse_ignore,
+}
+
+# Containers are passed the compiled cast of their items
+CONTAINER_BY_NAME = {
     'array': parse_array,
     'object': parse_object,
 }
 
 
 def cast(types, value):
-    types = list(types) or ['string']
-    type_name = types.pop()
-    value = value.strip()
-    if value.lower() == 'null':
-        return None
-    if value == '' and type_name != 'string':
-        return None
-    parse = TYPE_BY_NAME[type_name]
-    return parse(types, value)
+    return compile_cast(types)(value)
 
 
 def convert(name, value):
@@ -67,11 +63,57 @@ def convert(name, value):
     return parts[0], cast(parts[1:], value)
 
 
+def compile_cast(types):
+    """ cast(types, value) as a function of value
+    """
+    types = list(types) or ['string']
+    type_name = types.pop()
+    if type_name in CONTAINER_BY_NAME:
+        parse_container = CONTAINER_BY_NAME[type_name]
+        cast_item = compile_cast(types)
+
+        def parse(value):
+            return parse_container(cast_item, value)
+
+    else:
+        # Looked up and checked when called so empty and null values of an
+        # unknown or over specified type still cast to None
+        def parse(value):
+            return TYPE_BY_NAME[type_name](types, value)
+
+    def compiled(value):
+        value = value.strip()
+        if value.lower() == 'null':
+            return None
+        if value == '' and type_name != 'string':
+            return None
+        return parse(value)
+
+    return compiled
+
+
+def compile_converter(name):
+    """ fieldname:<cast>[:<cast>...] -> fieldname, compiled cast
+    """
+    parts = name.split(':')
+    return parts[0], compile_cast(parts[1:])
+
+
 def cast_row_values(dictrows):
     """ Wrapper generator for typing csv.DictReader rows
+
+    Each header's casts are parsed once per sheet.
     """
+    converters = {}
     for row in dictrows:
-        yield dict(convert(name, value or '') for name, value in row.items())
+        result = {}
+        for name, value in row.items():
+            converter = converters.get(name)
+            if converter is None:
+                converter = converters[name] = compile_converter(name)
+            fieldname, compiled = converter
+            result[fieldname] = compiled(value or '')
+        yield result
 
 
 def remove_nulls(dictrows):
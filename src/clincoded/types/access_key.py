@@ -137,7 +137,7 @@ def access_key_edit(context, request):
              name='raw')
 def item_view_raw(context, request):
     if asbool(request.params.get('upgrade', True)):
-        properties = context.upgrade_properties()
+        properties = context.upgrade_properties().copy()
     else:
         properties = context.properties.copy()
     del properties['secret_access_key_hash']
@@ -1,7 +1,9 @@
 from pyramid.response import Response
+from pyramid.security import effective_principals
 from pyramid.view import view_config
 from contentbase import Item
 from collections import OrderedDict
+from sqlalchemy.util import LRUCache
 import cgi
 from urllib.parse import (
     parse_qs,
@@ -12,9 +14,16 @@ from urllib.parse import (
 def includeme(config):
     config.add_route('batch_hub', '/batch_hub/{search_params}/{txt}')
     config.add_route('batch_hub:trackdb', '/batch_hub/{search_params}/{assembly}/{txt}')
+    capacity = int(config.registry.settings.get(HUB_CACHE + '.capacity', 100))
+    config.registry[HUB_CACHE] = LRUCache(capacity)
     config.scan(__name__)
 
 
+HUB_CACHE = 'visualization.hub_cache'
+# Genome browsers poll the hub, so let them revalidate with the ETag often
+HUB_MAX_AGE = 60
+
+
 TAB = '\t'
 NEWLINE = '\n'
 HUB_TXT = 'hub.txt'
@@ -271,9 +280,10 @@ def generate_batch_hubs(context, request):
             return generate_html(context, request) + data_policy
 
         assembly = str(request.matchdict['assembly'])
+        file_query = dict(FILE_QUERY)
         if 'status' in param_list:
-            del FILE_QUERY['status']
-        params = dict(param_list, **FILE_QUERY)
+            del file_query['status']
+        params = dict(param_list, **file_query)
         results = []
         params['assembly'] = [assembly]
 
@@ -336,10 +346,8 @@ def hub(context, request):
         assemblies = embedded['assembly']
 
     if url_ret[1][1:] == HUB_TXT:
-        return Response(
-            NEWLINE.join(get_hub(embedded['accession'])),
-            content_type='text/plain'
-        )
+        return hub_response(
+            request, NEWLINE.join(get_hub(embedded['accession'])), 'text/plain')
     elif url_ret[1][1:] == GENOMES_TXT:
         g_text = ''
         for assembly in assemblies:
@@ -347,17 +355,45 @@ def hub(context, request):
                 g_text = NEWLINE.join(get_genomes_txt(assembly))
             else:
                 g_text = g_text + 2 * NEWLINE + NEWLINE.join(get_genomes_txt(assembly))
-        return Response(g_text, content_type='text/plain')
+        return hub_response(request, g_text, 'text/plain')
     elif url_ret[1][1:].endswith(TRACKDB_TXT):
         parent_track = generate_trackDb(embedded, 'full', url_ret[1][1:].split('/')[0])
-        return Response(parent_track, content_type='text/plain')
+        return hub_response(request, parent_track, 'text/plain')
     else:
         data_policy = '<br /><a href="http://encodeproject.org/ENCODE/terms.html">ENCODE data use policy</p>'
-        return Response(generate_html(context, request) + data_policy, content_type='text/html')
+        return hub_response(request, generate_html(context, request) + data_policy, 'text/html')
 
 
 @view_config(route_name='batch_hub')
 @view_config(route_name='batch_hub:trackdb')
 def batch_hub(context, request):
-    ''' View for batch track hubs '''
-    return Response(generate_batch_hubs(context, request), content_type='text/plain')
+    ''' View for batch track hubs
+
+    The generated text is cached per index generation as it only changes when
+    the indexed search results do.
+    '''
+    generation = getattr(request, 'index_generation', None)
+    if generation is None:
+        return hub_response(request, generate_batch_hubs(context, request), 'text/plain')
+    key = (
+        generation,
+        request.host_url,
+        request.matchdict['search_params'],
+        request.matchdict.get('assembly'),
+        request.matchdict['txt'],
+        tuple(sorted(effective_principals(request))),
+    )
+    hub_cache = request.registry[HUB_CACHE]
+    body = hub_cache.get(key)
+    if body is None:
+        body = hub_cache[key] = generate_batch_hubs(context, request)
+    return hub_response(request, body, 'text/plain')
+
+
+def hub_response(request, body, content_type):
+    ''' Response with a strong ETag so repeated polls can be answered with 304 '''
+    response = Response(body, content_type=content_type, conditional_response=True)
+    response.md5_etag()
+    response.cache_control.max_age = HUB_MAX_AGE
+    response.cache_control.private = True
+    return response
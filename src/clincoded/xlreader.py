@@ -1,56 +1,229 @@
-"""csv compatible interface for xlrd sheets
+"""csv compatible interface for xlsx sheets
+
+Worksheets are parsed incrementally from the xlsx zip so only the shared
+strings table and the current row are held in memory.
 """
 
 import csv
 import datetime
+import io
 import os.path
-import xlrd
+import posixpath
+import re
 import zipfile
+from xml.etree.ElementTree import iterparse
+
+# Built in number formats which are dates
+DATE_FORMAT_IDS = set(range(14, 23)) | set(range(27, 37)) | set(range(45, 48)) | set(range(50, 59))
+
+date_format_re = re.compile(r'"[^"]*"|\[[^\]]*\]|\\.|_.|\*.')
+cell_ref_re = re.compile(r'^([A-Z]+)')
+
 
+def local_name(tag):
+    return tag.rsplit('}', 1)[-1]
 
-def cell_value(cell, datemode):
-    """ Convert to a utf-8 encoded string value (csv is not unicode aware)
+
+def iter_elements(stream, name):
+    """ Yield each completed element with the local name, then discard it
     """
-    ctype = cell.ctype
-    value = cell.value
+    parents = []
+    for event, elem in iterparse(stream, events=('start', 'end')):
+        if event == 'start':
+            parents.append(elem)
+            continue
+        parents.pop()
+        if local_name(elem.tag) == name:
+            yield elem
+            if parents:
+                parents[-1].remove(elem)
 
-    if ctype == xlrd.XL_CELL_ERROR:
-        raise ValueError(repr(cell), 'cell error')
 
-    elif ctype == xlrd.XL_CELL_BOOLEAN:
-        return str(value).upper()
+def text_content(elem):
+    """ Text of a shared or inline string, ignoring phonetic runs
+    """
+    parts = []
+    for child in elem:
+        name = local_name(child.tag)
+        if name == 't':
+            parts.append(child.text or '')
+        elif name == 'r':
+            parts.extend(t.text or '' for t in child if local_name(t.tag) == 't')
+    return ''.join(parts)
+
+
+def column_index(ref):
+    index = 0
+    for char in cell_ref_re.match(ref).group(1):
+        index = index * 26 + ord(char) - ord('A') + 1
+    return index - 1
+
+
+def is_date_format(format_code):
+    if format_code.lower() == 'general':
+        return False
+    format_code = date_format_re.sub('', format_code).lower()
+    return any(char in format_code for char in 'dmyhs')
+
+
+def xldate_value(value, date1904):
+    """ Convert an Excel serial date to an ISO formatted date or datetime
+    """
+    if date1904:
+        epoch = datetime.datetime(1904, 1, 1)
+    elif value < 60:
+        # Excel treats 1900 as a leap year
+        epoch = datetime.datetime(1899, 12, 31)
+    else:
+        epoch = datetime.datetime(1899, 12, 30)
+    days = int(value)
+    seconds = int(round((value - days) * 86400))
+    result = epoch + datetime.timedelta(days=days, seconds=seconds)
+    if seconds == 0:
+        return result.date().isoformat()
+    return result.isoformat()
 
-    elif ctype == xlrd.XL_CELL_NUMBER:
-        if value.is_integer():
-            value = int(value)
-        return str(value)
 
-    elif ctype == xlrd.XL_CELL_DATE:
-        value = xlrd.xldate_as_tuple(value, datemode)
-        if value[3:] == (0, 0, 0):
-            return datetime.date(*value[:3]).isoformat()
+class Workbook(object):
+    def __init__(self, stream):
+        try:
+            seekable = stream.seekable()
+        except AttributeError:
+            seekable = False
+        if not seekable:
+            stream = io.BytesIO(stream.read())
+        self.zf = zipfile.ZipFile(stream)
+        self.date1904 = False
+        self.sheets = []
+        with self.zf.open('xl/workbook.xml') as f:
+            for event, elem in iterparse(f):
+                name = local_name(elem.tag)
+                if name == 'workbookPr':
+                    self.date1904 = elem.get('date1904') in ('1', 'true')
+                elif name == 'sheet':
+                    rid = next(v for k, v in elem.items() if local_name(k) == 'id')
+                    self.sheets.append((elem.get('name'), rid))
+        self.targets = {}
+        with self.zf.open('xl/_rels/workbook.xml.rels') as f:
+            for event, elem in iterparse(f):
+                if local_name(elem.tag) == 'Relationship':
+                    target = elem.get('Target')
+                    if target.startswith('/'):
+                        target = target[1:]
+                    else:
+                        target = posixpath.normpath(posixpath.join('xl', target))
+                    self.targets[elem.get('Id')] = target
+        self.shared_strings = self.read_shared_strings()
+        self.date_styles = self.read_date_styles()
+
+    def read_shared_strings(self):
+        try:
+            f = self.zf.open('xl/sharedStrings.xml')
+        except KeyError:
+            return []
+        with f:
+            return [text_content(si) for si in iter_elements(f, 'si')]
+
+    def read_date_styles(self):
+        """ Indexes of the cell formats which display numbers as dates
+        """
+        try:
+            f = self.zf.open('xl/styles.xml')
+        except KeyError:
+            return set()
+        date_formats = set(DATE_FORMAT_IDS)
+        date_styles = set()
+        with f:
+            in_cell_xfs = False
+            index = 0
+            for event, elem in iterparse(f, events=('start', 'end')):
+                name = local_name(elem.tag)
+                if name == 'cellXfs':
+                    in_cell_xfs = event == 'start'
+                elif event == 'end' and name == 'numFmt':
+                    if is_date_format(elem.get('formatCode', '')):
+                        date_formats.add(int(elem.get('numFmtId')))
+                elif event == 'end' and name == 'xf' and in_cell_xfs:
+                    if int(elem.get('numFmtId', 0)) in date_formats:
+                        date_styles.add(index)
+                    index += 1
+        return date_styles
+
+    def sheet_path(self, sheetname=None):
+        if sheetname is None:
+            (name, rid), = self.sheets
         else:
-            return datetime.datetime(*value).isoformat()
+            rid = dict(self.sheets)[sheetname]
+        return self.targets[rid]
+
+    def cell_value(self, cell):
+        ctype = cell.get('t', 'n')
+        value = None
+        for child in cell:
+            name = local_name(child.tag)
+            if name == 'v':
+                value = child.text
+            elif name == 'is':
+                return text_content(child)
+
+        if value is None:
+            return ''
+
+        elif ctype == 's':
+            return self.shared_strings[int(value)]
+
+        elif ctype == 'e':
+            raise ValueError(cell.get('r'), value, 'cell error')
 
-    elif ctype in (xlrd.XL_CELL_TEXT, xlrd.XL_CELL_EMPTY, xlrd.XL_CELL_BLANK):
-        return value.encode('utf-8')
+        elif ctype == 'b':
+            return 'TRUE' if value == '1' else 'FALSE'
 
-    raise ValueError(repr(cell), 'unknown cell type')
+        elif ctype in ('str', 'inlineStr'):
+            return value
 
+        elif ctype == 'n':
+            number = float(value)
+            if int(cell.get('s', 0)) in self.date_styles:
+                return xldate_value(number, self.date1904)
+            if number.is_integer():
+                number = int(number)
+            return str(number)
+
+        raise ValueError(cell.get('r'), ctype, 'unknown cell type')
+
+    def rows(self, sheetname=None):
+        """ Yield the values of each row, padded with '' to the widest so far
+
+        Empty trailing cells and empty rows are not stored, so rows are padded
+        and empty rows filled in as xlrd did, keeping row numbers in step.
+        """
+        width = 0
+        row_number = 0
+        with self.zf.open(self.sheet_path(sheetname)) as f:
+            for row in iter_elements(f, 'row'):
+                row_number += 1
+                ref = row.get('r')
+                if ref is not None:
+                    for _ in range(int(ref) - row_number):
+                        yield [''] * width
+                    row_number = int(ref)
+                values = []
+                for cell in row:
+                    if local_name(cell.tag) != 'c':
+                        continue
+                    ref = cell.get('r')
+                    if ref is not None:
+                        values.extend([''] * (column_index(ref) - len(values)))
+                    values.append(self.cell_value(cell))
+                width = max(width, len(values))
+                values.extend([''] * (width - len(values)))
+                yield values
 
 
 def reader(stream, sheetname=None):
     """ Read named sheet or first and only sheet from xlsx file
     """
-    book = xlrd.open_workbook(file_contents=stream.read())
-    if sheetname is None:
-        sheet, = book.sheets()        
-    else:
-        sheet = book.sheet_by_name(sheetname)
-
-    datemode = sheet.book.datemode
-    for index in range(sheet.nrows):
-        yield [cell_value(cell, datemode) for cell in sheet.row(index)]
+    return Workbook(stream).rows(sheetname)
 
 
 class DictReader:
@@ -70,7 +243,7 @@ class DictReader:
     def fieldnames(self):
         if self._fieldnames is None:
             try:
-                self._fieldnames = self.reader.next()
+                self._fieldnames = next(self.reader)
             except StopIteration:
                 pass
             else:
@@ -82,18 +255,18 @@ class DictReader:
     def fieldnames(self, value):
         self._fieldnames = value
 
-    def next(self):
+    def __next__(self):
         if self._fieldnames is None:
             # Used only for its side effect.
             self.fieldnames
-        row = self.reader.next()
+        row = next(self.reader)
         self.line_num += 1
 
         # unlike the basic reader, we prefer not to return blanks,
         # because we will typically wind up with a dict full of None
         # values
         while row == []:
-            row = self.reader.next()
+            row = next(self.reader)
         d = dict(zip(self.fieldnames, row))
         lf = len(self.fieldnames)
         lr = len(row)
@@ -104,19 +277,19 @@ class DictReader:
                 d[key] = self.restval
         return d
 
+    next = __next__
+
 
 def zipfile_to_csv(zipfilename, outpath, ext='.csv', dialect='excel', **fmtparams):
     """ For Google Drive download zips
     """
-    zf = ZipFile(zipfilename)
+    zf = zipfile.ZipFile(zipfilename)
     for name in zf.namelist():
         subpath, entry_ext = os.path.splitext(name)
         if entry_ext.lower() != '.xlsx':
             continue
         f = zf.open(name)
-        book = xlrd.open_workbook(file_contents=f.read())
-        sheet, = book.sheets()  # Only single worksheet books are handled
-        csvfile = open(os.path.join(outpath, subpath + ext), 'w')
-        wr = csv.writer(csvfile, dialect=dialect, **fmtparams)
-        wr.writerows(list(reader(sheet)))
-
+        # Only single worksheet books are handled
+        with open(os.path.join(outpath, subpath + ext), 'w') as csvfile:
+            wr = csv.writer(csvfile, dialect=dialect, **fmtparams)
+            wr.writerows(reader(f))
@@ -23,6 +23,8 @@ def includeme(config):
     config.include('.upgrader')
     config.include('.auditor')
     config.include('.resources')
+    config.include('.bulk')
+    config.include('.changes')
     config.include('.attachment')
     config.include('.schema_graph')
     config.include('.jsonld_context')
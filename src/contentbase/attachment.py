@@ -2,29 +2,290 @@ from base64 import b64decode
 from io import BytesIO
 from mimetypes import guess_type
 from PIL import Image
-from pyramid.httpexceptions import HTTPNotFound
-from pyramid.response import Response
+from hashlib import sha256
+from pyramid.httpexceptions import (
+    HTTPBadRequest,
+    HTTPNotFound,
+    HTTPRequestEntityTooLarge,
+)
+from pyramid.response import (
+    FileResponse,
+    Response,
+)
 from pyramid.view import view_config
+from sqlalchemy import (
+    func,
+    orm,
+    text,
+    types,
+)
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import FlushError
 from urllib.parse import (
     quote,
-    unquote,
+    unquote_to_bytes,
 )
 from uuid import (
     UUID,
-    uuid4,
+    uuid5,
+)
+from contentbase import (
+    Item,
+    Root,
 )
-from contentbase import Item
 from .storage import (
     Blob,
     DBSession,
+    PropertySheet,
 )
 from .validation import ValidationFailure
 import magic
 import mimetypes
+import os
+import re
+import tempfile
+import transaction
+
+BLOB_STORAGE = 'blob_storage'
+
+# Blob ids are derived from the content hash so identical uploads share a blob
+BLOB_NAMESPACE = UUID('b8e3b5f2-3a0c-4c52-9a4e-1f4a6d1c2e70')
+
+# Size of the chunks uploads are read in and of the sample used to detect type
+CHUNK_SIZE = 1 << 16
+
+# Size of the chunks database blobs are downloaded in
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+
+# Default for blob.max_upload_size
+MAX_UPLOAD_SIZE = 100 * 1024 * 1024
+
+sha256_re = re.compile(r'^[0-9a-f]{64}$')
 
 
 def includeme(config):
     config.scan(__name__)
+    directory = config.registry.settings.get('blob.directory')
+    if directory:
+        config.registry[BLOB_STORAGE] = FileBlobStorage(directory)
+    else:
+        config.registry[BLOB_STORAGE] = RDBBlobStorage()
+
+
+class BlobIter(object):
+    """ Iterate a database blob in chunks as a response app_iter
+
+    The app_iter is only iterated after pyramid_tm has ended the request
+    transaction, so each chunk is read with a new session. Blobs never change
+    so the chunks are consistent.
+    """
+    def __init__(self, bind, blob_id, start=0, stop=None, chunk_size=DOWNLOAD_CHUNK_SIZE):
+        self.bind = bind
+        self.blob_id = blob_id
+        self.start = start
+        self.stop = stop
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        pos = self.start
+        while self.stop is None or pos < self.stop:
+            size = self.chunk_size
+            if self.stop is not None:
+                size = min(size, self.stop - pos)
+            session = orm.Session(bind=self.bind)
+            try:
+                # Postgres substring is 1-based
+                chunk = session.query(
+                    func.substring(Blob.data, pos + 1, size, type_=types.LargeBinary)
+                ).filter(Blob.blob_id == self.blob_id).scalar()
+            finally:
+                session.close()
+            if not chunk:
+                return
+            pos += len(chunk)
+            yield bytes(chunk)
+
+    def app_iter_range(self, start, stop):
+        """ Called by webob to serve a range request
+        """
+        return BlobIter(self.bind, self.blob_id, start, stop, self.chunk_size)
+
+
+class RDBBlobStorage(object):
+    """ Blobs stored in the database blobs table
+
+    Downloads are streamed in chunks but an upload is held in memory whole
+    while it is stored, so large attachments should use ``blob.directory``.
+    """
+    def blob_id(self, digest):
+        return uuid5(BLOB_NAMESPACE, digest)
+
+    def stage(self, stream):
+        """ Store the content of stream, returning its sha256
+
+        The whole content is read as the blob is inserted in one statement.
+        """
+        data = stream.read()
+        digest = sha256(data).hexdigest()
+        if self.exists(digest):
+            return digest
+        # A concurrent upload of the same content may insert the blob first.
+        # INSERT ... ON CONFLICT requires Postgres 9.5, so use a savepoint.
+        session = DBSession()
+        sp = session.begin_nested()
+        try:
+            session.add(Blob(blob_id=self.blob_id(digest), data=data))
+            sp.commit()
+        except (IntegrityError, FlushError):
+            sp.rollback()
+        return digest
+
+    def exists(self, digest):
+        return DBSession().query(Blob).get(self.blob_id(digest)) is not None
+
+    def open(self, digest):
+        return BytesIO(DBSession().query(Blob).get(self.blob_id(digest)).data)
+
+    def reference(self, download_meta):
+        download_meta['blob_id'] = str(self.blob_id(download_meta['sha256']))
+
+    def response(self, download_meta):
+        blob_id = UUID(download_meta['blob_id'])
+        session = DBSession()
+        length = session.query(func.length(Blob.data)).filter(Blob.blob_id == blob_id).scalar()
+        if length is None:
+            raise HTTPNotFound('blob not found')
+        app_iter = BlobIter(session.get_bind(), blob_id)
+        return Response(app_iter=app_iter, content_length=length)
+
+    def collect_garbage(self, referenced, before, dry_run=False):
+        """ Delete the blobs uploaded before a time which nothing references
+
+        Only uploads can leave a blob unreferenced here, as attachments sent
+        as data URIs are stored in the transaction that references them.
+        Uploads are found from the transaction records, so this must run
+        before archive-transactions deletes those older records.
+        """
+        session = DBSession()
+        uploaded = set()
+        query = session.execute(text(
+            "SELECT data->'uploaded' FROM transactions "
+            "WHERE timestamp < :before AND data ? 'uploaded';"
+        ), {'before': before})
+        for digests, in query:
+            uploaded.update(digests)
+        removed = []
+        for digest in sorted(uploaded - referenced):
+            blob = session.query(Blob).get(self.blob_id(digest))
+            if blob is None:
+                continue
+            if not dry_run:
+                session.delete(blob)
+            removed.append(digest)
+        return removed
+
+
+class FileBlobStorage(object):
+    """ Blobs stored as files named by their content hash
+
+    Enabled with ``blob.directory``. A file is written once and never changed,
+    so files from aborted transactions are harmless and are reused by a later
+    upload of the same content.
+    """
+    name = 'file'
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, digest):
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def stage(self, stream):
+        """ Copy stream to its file in chunks, returning its sha256
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.directory)
+        try:
+            h = sha256()
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                    h.update(chunk)
+                    f.write(chunk)
+            digest = h.hexdigest()
+            path = self.path(digest)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp, path)
+        except Exception:
+            os.remove(tmp)
+            raise
+        return digest
+
+    def exists(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def open(self, digest):
+        return open(self.path(digest), 'rb')
+
+    def reference(self, download_meta):
+        download_meta['blob_store'] = self.name
+
+    def response(self, download_meta):
+        return FileResponse(self.path(download_meta['sha256']))
+
+    def collect_garbage(self, referenced, before, dry_run=False):
+        """ Delete the files written before a time which nothing references
+
+        This includes the files of uploads never used, files staged by
+        aborted transactions and temporary files left by a failed copy.
+        """
+        cutoff = before.timestamp()
+        removed = []
+        for dirpath, dirnames, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if filename in referenced:
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    if os.path.getmtime(path) >= cutoff:
+                        continue
+                    if not dry_run:
+                        os.remove(path)
+                except FileNotFoundError:
+                    continue
+                removed.append(filename)
+        return removed
+
+
+def blob_storage(registry, download_meta):
+    """ The storage holding a download's blob
+    """
+    if download_meta.get('blob_store') == FileBlobStorage.name:
+        storage = registry[BLOB_STORAGE]
+        if not isinstance(storage, FileBlobStorage):
+            raise HTTPNotFound('blob.directory is not configured')
+        return storage
+    return RDBBlobStorage()
+
+
+def referenced_digests():
+    """ The sha256 of every blob referenced by any revision of an attachment
+    """
+    session = DBSession()
+    query = session.query(PropertySheet.properties).filter(PropertySheet.name == 'downloads')
+    return {
+        download_meta['sha256']
+        for downloads, in query.yield_per(1000)
+        for download_meta in downloads.values()
+        if 'sha256' in download_meta
+    }
+
+
+def collect_garbage(registry, before, dry_run=False):
+    """ Delete unreferenced blobs stored before a time, returning their sha256
+
+    The time should leave long enough for an upload to be referenced.
+    """
+    return registry[BLOB_STORAGE].collect_garbage(referenced_digests(), before, dry_run)
 
 
 def parse_data_uri(uri):
@@ -47,7 +308,7 @@ def parse_data_uri(uri):
     if is_base64:
         data = b64decode(data)
     else:
-        data = unquote(data)
+        data = unquote_to_bytes(data)
 
     return mime_type, charset, data
 
@@ -66,13 +327,13 @@ class ItemWithAttachment(Item):
     download_property = 'attachment'
 
     @classmethod
-    def _process_downloads(cls, properties, sheets):
+    def _process_downloads(cls, registry, properties, sheets):
         prop_name = cls.download_property
         attachment = properties.get(prop_name, {})
         href = attachment.get('href', None)
         if href is not None:
-            if not href.startswith('data:'):
-                msg = "Expected data URI."
+            if not href.startswith(('data:', 'blob:')):
+                msg = "Expected data URI or uploaded blob."
                 raise ValidationFailure('body', [prop_name, 'href'], msg)
 
             properties = properties.copy()
@@ -85,55 +346,72 @@ class ItemWithAttachment(Item):
             sheets['downloads'] = downloads = {}
             download_meta = downloads[prop_name] = {}
 
+            storage = registry[BLOB_STORAGE]
+            data = None
+            if href.startswith('blob:'):
+                # Uploaded beforehand with POST /@@upload
+                digest = href[len('blob:'):]
+                if not sha256_re.match(digest) or not storage.exists(digest):
+                    msg = 'Uploaded blob not found.'
+                    raise ValidationFailure('body', [prop_name, 'href'], msg)
+                mime_type_declared = attachment.get('type')
+                stream = storage.open(digest)
+                sample = stream.read(CHUNK_SIZE)
+            else:
+                try:
+                    mime_type_declared, charset, data = parse_data_uri(href)
+                except (ValueError, TypeError):
+                    msg = 'Could not parse data URI.'
+                    raise ValidationFailure('body', [prop_name, 'href'], msg)
+                if charset is not None:
+                    download_meta['charset'] = charset
+                stream = BytesIO(data)
+                sample = data
             try:
-                mime_type_declared, charset, data = parse_data_uri(href)
-            except (ValueError, TypeError):
-                msg = 'Could not parse data URI.'
-                raise ValidationFailure('body', [prop_name, 'href'], msg)
-            if charset is not None:
-                download_meta['charset'] = charset
-            # Make sure the mimetype appears to be what the client says it is
-            mime_type_detected = magic.from_buffer(data, mime=True).decode('utf-8')
-            if mime_type_declared and not mimetypes_are_equal(
-                    mime_type_declared, mime_type_detected):
-                msg = "Incorrect file type. (Appears to be %s)" % mime_type_detected
-                raise ValidationFailure('body', [prop_name, 'href'], msg)
-            mime_type = mime_type_declared or mime_type_detected
-            attachment['type'] = mime_type
-            if mime_type is not None:
-                download_meta['type'] = mime_type
+                # Make sure the mimetype appears to be what the client says it is
+                mime_type_detected = magic.from_buffer(sample, mime=True).decode('utf-8')
+                if mime_type_declared and not mimetypes_are_equal(
+                        mime_type_declared, mime_type_detected):
+                    msg = "Incorrect file type. (Appears to be %s)" % mime_type_detected
+                    raise ValidationFailure('body', [prop_name, 'href'], msg)
+                mime_type = mime_type_declared or mime_type_detected
+                attachment['type'] = mime_type
+                if mime_type is not None:
+                    download_meta['type'] = mime_type
 
-            # Make sure mimetype is not disallowed
-            try:
-                allowed_types = cls.schema['properties'][prop_name]['properties']['type']['enum']
-            except KeyError:
-                pass
-            else:
-                if mime_type not in allowed_types:
+                # Make sure mimetype is not disallowed
+                try:
+                    prop_schema = cls.schema['properties'][prop_name]
+                    allowed_types = prop_schema['properties']['type']['enum']
+                except KeyError:
+                    pass
+                else:
+                    if mime_type not in allowed_types:
+                        raise ValidationFailure(
+                            'body', [prop_name, 'href'], 'Mimetype is not allowed.')
+
+                # Make sure the file extensions matches the mimetype
+                download_meta['download'] = filename = attachment['download']
+                mime_type_from_filename, _ = mimetypes.guess_type(filename)
+                if not mimetypes_are_equal(mime_type, mime_type_from_filename):
                     raise ValidationFailure(
-                        'body', [prop_name, 'href'], 'Mimetype is not allowed.')
-
-            # Make sure the file extensions matches the mimetype
-            download_meta['download'] = filename = attachment['download']
-            mime_type_from_filename, _ = mimetypes.guess_type(filename)
-            if not mimetypes_are_equal(mime_type, mime_type_from_filename):
-                raise ValidationFailure(
-                    'body', [prop_name, 'href'],
-                    'Wrong file extension for %s mimetype.' % mime_type)
-
-            # Validate images and store height/width
-            major, minor = mime_type.split('/')
-            if major == 'image' and minor in ('png', 'jpeg', 'gif', 'tiff'):
-                stream = BytesIO(data)
-                im = Image.open(stream)
-                im.verify()
-                attachment['width'], attachment['height'] = im.size
-
-            blob_id = uuid4()
-            download_meta['blob_id'] = str(blob_id)
-            session = DBSession()
-            blob = Blob(blob_id=blob_id, data=data)
-            session.add(blob)
+                        'body', [prop_name, 'href'],
+                        'Wrong file extension for %s mimetype.' % mime_type)
+
+                # Validate images and store height/width
+                major, minor = mime_type.split('/')
+                if major == 'image' and minor in ('png', 'jpeg', 'gif', 'tiff'):
+                    stream.seek(0)
+                    im = Image.open(stream)
+                    im.verify()
+                    attachment['width'], attachment['height'] = im.size
+            finally:
+                stream.close()
+
+            if data is not None:
+                digest = storage.stage(BytesIO(data))
+            download_meta['sha256'] = digest
+            storage.reference(download_meta)
             attachment['href'] = '@@download/%s/%s' % (
                 prop_name, quote(filename))
 
@@ -141,7 +419,7 @@ class ItemWithAttachment(Item):
 
     @classmethod
     def create(cls, registry, uuid, properties, sheets=None):
-        properties, sheets = cls._process_downloads(properties, sheets)
+        properties, sheets = cls._process_downloads(registry, properties, sheets)
         item = super(ItemWithAttachment, cls).create(registry, uuid, properties, sheets)
         return item
 
@@ -156,10 +434,10 @@ class ItemWithAttachment(Item):
                 except KeyError:
                     existing = None
                 if existing != href:
-                    msg = "Expected data uri or existing uri."
+                    msg = "Expected data uri, uploaded blob or existing uri."
                     raise ValidationFailure('body', [prop_name, 'href'], msg)
             else:
-                properties, sheets = self._process_downloads(properties, sheets)
+                properties, sheets = self._process_downloads(self.registry, properties, sheets)
 
         super(ItemWithAttachment, self).update(properties, sheets)
 
@@ -177,18 +455,38 @@ def download(context, request):
     if download_meta['download'] != filename:
         raise HTTPNotFound(filename)
 
-    blob_id = UUID(download_meta['blob_id'])
-
     mimetype, content_encoding = guess_type(filename, strict=False)
     if mimetype is None:
         mimetype = 'application/octet-stream'
 
-    session = DBSession()
-    blob = session.query(Blob).get(blob_id)
+    response = blob_storage(request.registry, download_meta).response(download_meta)
+    response.content_type = mimetype
+    # Blobs never change so may be served conditionally and by range
+    response.etag = download_meta.get('sha256') or download_meta['blob_id']
+    response.accept_ranges = 'bytes'
+    response.conditional_response = True
+    return response
 
-    headers = {
-        'Content-Type': mimetype,
-    }
 
-    response = Response(body=blob.data, headers=headers)
-    return response
+@view_config(context=Root, name='upload', request_method='POST', permission='upload')
+def upload(context, request):
+    """ Store the request body as a blob to be referenced as blob:<sha256>
+
+    Lets clients send attachments as raw bytes instead of a base64 data URI in
+    the item JSON. Blobs never referenced are removed by ``collect_garbage``.
+    """
+    if request.content_length is None:
+        raise HTTPBadRequest('Content-Length required')
+    max_size = int(request.registry.settings.get('blob.max_upload_size', MAX_UPLOAD_SIZE))
+    if request.content_length > max_size:
+        raise HTTPRequestEntityTooLarge('Uploads are limited to %d bytes' % max_size)
+    digest = request.registry[BLOB_STORAGE].stage(request.body_file)
+    # Recorded with the transaction to find uploads for garbage collection
+    transaction.get().setExtendedInfo('uploaded', [digest])
+    request.response.status = 201
+    return {
+        '@type': ['result'],
+        'status': 'success',
+        'href': 'blob:' + digest,
+        'sha256': digest,
+    }
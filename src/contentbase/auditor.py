@@ -5,14 +5,25 @@ We also need to perform higher order checking between linked objects.
 """
 
 from past.builtins import basestring
+from sqlalchemy import text
+from sqlalchemy.util import LRUCache
+from .changes import snapshot_xmin
+from .storage import DBSession
+from .util import get_root_request
 import logging
+import time
+import transaction
 import venusian
 
 logger = logging.getLogger(__name__)
 
+AUDIT_CACHE = 'audit_cache'
+
 
 def includeme(config):
     config.registry['auditor'] = Auditor()
+    capacity = int(config.registry.settings.get(AUDIT_CACHE + '.capacity', 1000))
+    config.registry[AUDIT_CACHE] = LRUCache(capacity)
     config.add_directive('add_audit_checker', add_audit_checker)
     config.add_request_method(audit, 'audit')
 
@@ -85,6 +96,9 @@ class Auditor(object):
             'types': types,
         }
         system.update(kw)
+        # Each distinct frame is rendered once and shared by its checkers,
+        # so checkers must not modify the value.
+        values = {}
         for order, checker, condition, frame in sorted(checkers):
             if frame is None:
                 uri = path
@@ -92,52 +106,107 @@ class Auditor(object):
                 uri = '%s@@%s' % (path, frame)
             else:
                 uri = '%s@@expand?expand=%s' % (path, '&expand='.join(frame))
-            value = request.embed(uri)
-
-            if condition is not None:
-                try:
-                    if not condition(value, system):
-                        continue
-                except Exception as e:
-                    detail = '%s: %r' % (checker.__name__, e)
-                    failure = AuditFailure(
-                        'audit condition error', detail, 'ERROR', path, checker.__name__)
-                    errors.append(failure.__json__(request))
-                    logger.warning('audit condition error auditing %s', path, exc_info=True)
-                    continue
+            if uri not in values:
+                values[uri] = request.embed(uri)
+            begin = time.time()
             try:
-                try:
-                    result = checker(value, system)
-                except AuditFailure as e:
-                    e = e.__json__(request)
-                    if e['path'] is None:
-                        e['path'] = path
-                    e['name'] = checker.__name__
-                    errors.append(e)
-                    continue
-                if result is None:
-                    continue
-                if isinstance(result, AuditFailure):
-                    result = [result]
-                for item in result:
-                    if isinstance(item, AuditFailure):
-                        item = item.__json__(request)
-                        if item['path'] is None:
-                            item['path'] = path
-                        item['name'] = checker.__name__
-                        errors.append(item)
-                        continue
-                    raise ValueError(item)
+                errors.extend(self.run_checker(
+                    request, checker, condition, values[uri], system, path))
+            finally:
+                stats_record_checker(checker, time.time() - begin)
+        return errors
+
+    def run_checker(self, request, checker, condition, value, system, path):
+        if condition is not None:
+            try:
+                if not condition(value, system):
+                    return []
             except Exception as e:
                 detail = '%s: %r' % (checker.__name__, e)
                 failure = AuditFailure(
-                    'audit script error', detail, 'ERROR', path, checker.__name__)
-                errors.append(failure.__json__(request))
-                logger.warning('audit script error auditing %s', path, exc_info=True)
-                continue
+                    'audit condition error', detail, 'ERROR', path, checker.__name__)
+                logger.warning('audit condition error auditing %s', path, exc_info=True)
+                return [failure.__json__(request)]
+        errors = []
+        try:
+            try:
+                result = checker(value, system)
+            except AuditFailure as e:
+                e = e.__json__(request)
+                if e['path'] is None:
+                    e['path'] = path
+                e['name'] = checker.__name__
+                return [e]
+            if result is None:
+                return []
+            if isinstance(result, AuditFailure):
+                result = [result]
+            for item in result:
+                if isinstance(item, AuditFailure):
+                    item = item.__json__(request)
+                    if item['path'] is None:
+                        item['path'] = path
+                    item['name'] = checker.__name__
+                    errors.append(item)
+                    continue
+                raise ValueError(item)
+        except Exception as e:
+            detail = '%s: %r' % (checker.__name__, e)
+            failure = AuditFailure(
+                'audit script error', detail, 'ERROR', path, checker.__name__)
+            errors.append(failure.__json__(request))
+            logger.warning('audit script error auditing %s', path, exc_info=True)
         return errors
 
 
+def stats_record_checker(checker, duration):
+    """ Record audit_count/audit_time and the time of each checker in request stats
+    """
+    request = get_root_request()
+    stats = getattr(request, '_stats', None)
+    if stats is None:
+        return
+    duration = int(duration * 1e6)
+    stats['audit_count'] = stats.get('audit_count', 0) + 1
+    stats['audit_time'] = stats.get('audit_time', 0) + duration
+    key = 'audit_%s_time' % checker.__name__
+    stats[key] = stats.get(key, 0) + duration
+
+
+def audit_cache_xmin():
+    """ The snapshot xmin to store with a result, or None if it may not be cached
+
+    Results computed after this transaction has written may be rolled back.
+    """
+    if '_contentbase_transaction_record' in transaction.get()._extension:
+        return None
+    return snapshot_xmin(DBSession())
+
+
+def updated_since(xmin, uuids):
+    """ Whether a transaction possibly unseen by a snapshot updated any uuids
+
+    Every transaction not visible to a snapshot has an xid at or above its
+    xmin. Their updated uuids include the targets of new links, as recorded
+    for index invalidation.
+
+    The check is recorded in request stats as audit_cache_hits/misses and
+    audit_cache_check_time, to compare with the audit_time of recomputing.
+    """
+    start = time.time()
+    updated = DBSession().execute(text(
+        "SELECT EXISTS (SELECT 1 FROM transactions "
+        "WHERE xid >= :xmin AND data->'updated' ?| :uuids);"
+    ), {'xmin': xmin, 'uuids': sorted(uuids)}).scalar()
+    stats = getattr(get_root_request(), '_stats', None)
+    if stats is not None:
+        key = 'audit_cache_misses' if updated else 'audit_cache_hits'
+        stats[key] = stats.get(key, 0) + 1
+        duration = int((time.time() - start) * 1e6)
+        stats['audit_cache_check_time'] = stats.get('audit_cache_check_time', 0) + duration
+    return updated
+
+
 # Imperative configuration
 def add_audit_checker(config, checker, item_type, condition=None, frame='embedded'):
     auditor = config.registry['auditor']
@@ -1,19 +1,28 @@
 """\
 Also run this when the links or keys are changed in the schema.
 
+With --checkpoint completed batches are recorded so that an interrupted run
+can be resumed by running it again with the same file.
+
 Example:
 
     %(prog)s production.ini --app-name app
 
 """
+import collections
+import json
 import logging
+import threading
 import transaction
 from copy import deepcopy
 from contentbase.storage import (
     DBSession,
+    Resource,
     update_keys,
     update_rels,
 )
+from pyramid.scripting import prepare
+from pyramid.settings import asbool
 from pyramid.view import view_config
 from pyramid.traversal import find_resource
 
@@ -21,45 +30,103 @@ EPILOG = __doc__
 logger = logging.getLogger(__name__)
 
 from .schema_utils import validate
-import itertools
+
+
+UPGRADE_WRITE_BACK = 'upgrade_write_back'
 
 
 def includeme(config):
     config.add_route('batch_upgrade', '/batch_upgrade')
     config.scan(__name__)
+    settings = config.registry.settings
+    if asbool(settings.get('upgrade.write_back', False)):
+        config.registry[UPGRADE_WRITE_BACK] = UpgradeWriteBack(
+            config.registry,
+            batch_size=int(settings.get('upgrade.write_back.batch_size', 50)),
+            interval=float(settings.get('upgrade.write_back.interval', 10)),
+        )
 
 
-def batched(iterable, n=1):
-    l = len(iterable)
-    for ndx in range(0, l, n):
-        yield iterable[ndx:min(ndx+n, l)]
+def uuid_batches(types=None, batch_size=500, completed=None):
+    """ Yields (item_type, uuids) in uuid order using keyset pagination
 
-
-def internal_app(configfile, app_name=None, username=None):
-    from webtest import TestApp
-    from pyramid import paster
-    app = paster.get_app(configfile, app_name)
-    if not username:
-        username = 'UPGRADE'
-    environ = {
-        'HTTP_ACCEPT': 'application/json',
-        'REMOTE_USER': username,
-    }
-    return TestApp(app, environ)
+    Each page is read in its own short transaction. Uuids within ranges already
+    completed (item_type -> [(first, last)]) are skipped.
+    """
+    session = DBSession()
+    if types is None:
+        types = sorted(
+            item_type for item_type, in session.query(Resource.item_type).distinct())
+        transaction.abort()
+    completed = completed or {}
+    for item_type in types:
+        done = completed.get(item_type, ())
+        last = None
+        while True:
+            query = session.query(Resource.rid).filter(Resource.item_type == item_type)
+            if last is not None:
+                query = query.filter(Resource.rid > last)
+            uuids = [str(rid) for rid, in query.order_by(Resource.rid).limit(batch_size)]
+            transaction.abort()
+            if not uuids:
+                break
+            last = uuids[-1]
+            uuids = [
+                uuid for uuid in uuids
+                if not any(first <= uuid <= end for first, end in done)
+            ]
+            if uuids:
+                yield item_type, uuids
+
+
+def load_checkpoint(filename):
+    """ Completed batch ranges by item type from a JSON lines checkpoint file
+    """
+    completed = {}
+    try:
+        with open(filename) as f:
+            for line in f:
+                record = json.loads(line)
+                completed.setdefault(record['item_type'], []).append(
+                    (record['first'], record['last']))
+    except FileNotFoundError:
+        pass
+    return completed
+
+
+def upgrade_batch(registry, batch, username=None):
+    """ Upgrade a batch of uuids in a single managed transaction
+    """
+    env = prepare(registry=registry)
+    request = env['request']
+    request.datastore = 'database'
+    request._stats = {}
+    try:
+        with transaction.manager as txn:
+            txn.setExtendedInfo('upgrade', True)
+            if username is not None:
+                txn.setUser('remoteuser.%s' % username, '')
+            return upgrade_uuids(request, batch)
+    finally:
+        env['closer']()
 
 
 # Running in subprocess
-testapp = None
+app = None
+worker_username = None
 
 
-def initializer(*args, **kw):
-    global testapp
-    testapp = internal_app(*args, **kw)
+def initializer(config_uri, app_name=None, username=None):
+    from pyramid import paster
+    global app, worker_username
+    app = paster.get_app(config_uri, app_name)
+    worker_username = username or 'UPGRADE'
 
 
-def worker(batch):
-    res = testapp.post_json('/batch_upgrade', {'batch': batch})
-    return res.json
+def worker(args):
+    item_type, batch = args
+    results = upgrade_batch(app.registry, batch, worker_username)
+    return item_type, batch[0], batch[-1], results
 
 
 def update_item(context):
@@ -99,6 +166,10 @@ def batch_upgrade(request):
     request.datastore = 'database'
     transaction.get().setExtendedInfo('upgrade', True)
     batch = request.json['batch']
+    return {'results': upgrade_uuids(request, batch)}
+
+
+def upgrade_uuids(request, batch):
     root = request.root
     session = DBSession()
     results = []
@@ -127,22 +198,92 @@ def batch_upgrade(request):
             else:
                 sp.commit()
         results.append((item_type, uuid, update, error))
-    return {'results': results}
-
-
-def run(config_uri, app_name=None, username=None, types=None, batch_size=500, processes=None):
+    return results
+
+
+class UpgradeWriteBack(object):
+    """ Persist objects upgraded on read in the background
+
+    Enabled with ``upgrade.write_back = true``. Uuids recorded by
+    ``Item.upgrade_properties`` are written back in batches by a daemon thread
+    in their own transaction, without modification events, as batchupgrade
+    does. A uuid which fails is not recorded again from the same schema
+    version, as it would only fail again.
+    """
+    def __init__(self, registry, batch_size=50, interval=10):
+        self.registry = registry
+        self.batch_size = batch_size
+        self.interval = interval
+        self.pending = set()
+        self.failed = set()
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def record(self, uuid, version):
+        with self.condition:
+            if (uuid, version) in self.failed:
+                return
+            self.pending.add((uuid, version))
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.run, name='upgrade_write_back', daemon=True)
+                self.thread.start()
+            if len(self.pending) >= self.batch_size:
+                self.condition.notify()
+
+    def take_batch(self):
+        with self.condition:
+            if len(self.pending) < self.batch_size:
+                self.condition.wait(self.interval)
+            batch = []
+            while self.pending and len(batch) < self.batch_size:
+                batch.append(self.pending.pop())
+            return batch
+
+    def run(self):
+        while True:
+            batch = self.take_batch()
+            if not batch:
+                continue
+            try:
+                self.write_back(batch)
+            except Exception:
+                logger.exception('Error writing back upgraded items')
+
+    def write_back(self, batch):
+        """ Upgrade a batch of (uuid, version), remembering those which fail
+        """
+        versions = dict(batch)
+        try:
+            results = upgrade_batch(self.registry, list(versions))
+        except Exception:
+            with self.condition:
+                self.failed.update(batch)
+            raise
+        failed = {(uuid, versions[uuid]) for item_type, uuid, update, error in results if error}
+        with self.condition:
+            self.failed.update(failed)
+        updated = sum(update for item_type, uuid, update, error in results)
+        logger.info('Upgrade write back: Updated %d of %d (errors %d)',
+                    updated, len(results), len(failed))
+
+
+def run(config_uri, app_name=None, username=None, types=None, batch_size=500,
+        processes=None, checkpoint=None):
     # multiprocessing.get_context is Python 3 only.
     from multiprocessing import get_context
     from multiprocessing.pool import Pool
+    from pyramid import paster
 
+    paster.get_app(config_uri, app_name)
     # Loading app will have configured from config file. Reconfigure here:
     logging.getLogger('contentbase').setLevel(logging.DEBUG)
 
-    testapp = internal_app(config_uri, app_name, username)
-    connection = testapp.app.registry['connection']
-    uuids = [str(uuid) for uuid in connection]
-    transaction.abort()
-    logger.info('Total items: %d' % len(uuids))
+    completed = None
+    checkpoint_file = None
+    if checkpoint is not None:
+        completed = load_checkpoint(checkpoint)
+        checkpoint_file = open(checkpoint, 'a')
 
     pool = Pool(
         processes=processes,
@@ -151,30 +292,31 @@ def run(config_uri, app_name=None, username=None, types=None, batch_size=500, pr
         context=get_context('forkserver'),
     )
 
-    all_results = []
+    totals = collections.defaultdict(lambda: [0, 0, 0])
     try:
-        for result in pool.imap_unordered(worker, batched(uuids, batch_size), chunksize=1):
-            results = result['results']
-            errors = sum(error for item_type, path, update, error in results)
-            updated = sum(update for item_type, path, update, error in results)
+        batches = uuid_batches(types, batch_size, completed)
+        for item_type, first, last, results in pool.imap_unordered(worker, batches, chunksize=1):
+            errors = sum(error for item_type_, path, update, error in results)
+            updated = sum(update for item_type_, path, update, error in results)
             logger.info('Batch: Updated %d of %d (errors %d)' %
                         (updated, len(results), errors))
-            all_results.extend(results)
+            total = totals[item_type]
+            total[0] += updated
+            total[1] += len(results)
+            total[2] += errors
+            if checkpoint_file is not None:
+                checkpoint_file.write(json.dumps(
+                    {'item_type': item_type, 'first': first, 'last': last}) + '\n')
+                checkpoint_file.flush()
     finally:
         pool.terminate()
         pool.join()
+        if checkpoint_file is not None:
+            checkpoint_file.close()
 
-    def result_item_type(result):
-        # Ensure we always return a string
-        return result[0] or ''
-
-    for item_type, results in itertools.groupby(
-            sorted(all_results, key=result_item_type), key=result_item_type):
-        results = list(results)
-        errors = sum(error for item_type, path, update, error in results)
-        updated = sum(update for item_type, path, update, error in results)
+    for item_type, (updated, count, errors) in sorted(totals.items()):
         logger.info('Collection %s: Updated %d of %d (errors %d)' %
-                    (item_type, updated, len(results), errors))
+                    (item_type, updated, count, errors))
 
 
 def main():
@@ -189,6 +331,7 @@ def main():
     parser.add_argument('--batch-size', type=int, default=500)
     parser.add_argument('--processes', type=int)
     parser.add_argument('--username')
+    parser.add_argument('--checkpoint', help="file recording completed batches to resume from")
     args = parser.parse_args()
     logging.basicConfig()
     run(**vars(args))
@@ -0,0 +1,235 @@
+""" Apply many creates and updates in one transaction
+
+POST /@@bulk with a list of operations::
+
+    {"operations": [
+        {"op": "create", "path": "/families/", "data": {...}},
+        {"op": "update", "path": "/gdm/<uuid>/", "data": {...}},
+        {"op": "replace", "path": "/groups/<uuid>/", "data": {...}},
+        {"op": "delete", "path": "/individuals/<uuid>/"}
+    ]}
+
+Each operation is run as a subrequest to the ordinary collection add or item
+edit view, so permissions and validation are unchanged, but they share the
+request caches and a single transaction, transaction record and indexing
+notification. The bulk permission is needed to post at all.
+
+The operations are all or nothing. Processing stops at the first failed
+operation and the whole transaction is aborted, so ``committed`` is false and
+each entry of ``operations`` has the status ``aborted`` if it ran before the
+failure, ``error`` for the failure itself or ``skipped`` if it never ran.
+Otherwise every operation has the status ``success``. The results of the
+operations that ran are in ``@graph``.
+
+GET or POST /@@bulk-get renders the object or embedded frame of many items in
+one response::
+
+    {"ids": ["<uuid>", "/genes/BRCA1/", {"unique_key": "alias", "name": "..."}],
+     "frame": "object"}
+
+or ``?id=<uuid>&id=/genes/BRCA1/&frame=embedded``.
+"""
+from pyramid.httpexceptions import (
+    HTTPBadRequest,
+    HTTPException,
+)
+from pyramid.view import view_config
+from pyramid.traversal import find_resource
+from .resources import (
+    CONNECTION,
+    Item,
+    Root,
+)
+from .validation import (
+    ValidationFailure,
+    failed_validation,
+    http_error,
+)
+from uuid import UUID
+import json
+import transaction
+
+# op -> (method, whether data is required)
+OPERATIONS = {
+    'create': ('POST', True),
+    'update': ('PATCH', True),
+    'replace': ('PUT', True),
+    # Items are never removed, deletion sets the status
+    'delete': ('PATCH', False),
+}
+
+
+def includeme(config):
+    config.scan(__name__)
+
+
+def make_bulk_subrequest(request, method, path, data):
+    env = request.environ.copy()
+    path_info, _, query_string = path.partition('?')
+    env['PATH_INFO'] = path_info
+    env['QUERY_STRING'] = query_string
+    subreq = request.__class__(
+        env, method=method, content_type='application/json',
+        body=json.dumps(data).encode('utf-8'))
+    subreq.__parent__ = request
+    subreq.override_renderer = 'null_renderer'
+    return subreq
+
+
+def parse_operation(operation):
+    """ The method, path and body of an operation's subrequest
+    """
+    if not isinstance(operation, dict):
+        raise HTTPBadRequest('Invalid operation: %r' % (operation,))
+    op = operation.get('op')
+    path = operation.get('path')
+    if op not in OPERATIONS or not path:
+        raise HTTPBadRequest('Invalid operation: %r' % operation)
+    method, data_required = OPERATIONS[op]
+    if op == 'delete':
+        data = {'status': 'deleted'}
+    else:
+        data = operation.get('data')
+        if data_required and not isinstance(data, dict):
+            raise HTTPBadRequest('Operation requires data: %r' % operation)
+    return method, path, data
+
+
+def run_operation(request, operation):
+    """ Run an operation as a subrequest, returning its status code and result
+    """
+    try:
+        method, path, data = parse_operation(operation)
+    except HTTPBadRequest as e:
+        result = http_error(e, request)
+        return result['code'], result
+    subreq = make_bulk_subrequest(request, method, path, data)
+    try:
+        result = request.invoke_subrequest(subreq)
+    except ValidationFailure as e:
+        result = failed_validation(e, subreq)
+    except HTTPException as e:
+        result = http_error(e, subreq)
+    # Record the subrequest's updates so they are reported by this request
+    for uuid, names in subreq._updated_uuid_paths.items():
+        request._updated_uuid_paths[uuid].update(names)
+    return subreq.response.status_int, result
+
+
+def operation_status(operation, status, code=None):
+    if not isinstance(operation, dict):
+        operation = {}
+    status = {'op': operation.get('op'), 'path': operation.get('path'), 'status': status}
+    if code is not None:
+        status['code'] = code
+    return status
+
+
+@view_config(context=Root, request_method='POST', name='bulk', permission='bulk')
+def bulk(context, request):
+    operations = request.json.get('operations')
+    if not isinstance(operations, list):
+        raise HTTPBadRequest('Expected a list of operations')
+    results = []
+    statuses = []
+    for index, operation in enumerate(operations):
+        code, result = run_operation(request, operation)
+        results.append(result)
+        if result.get('status') != 'error':
+            statuses.append(operation_status(operation, 'success', code))
+            continue
+        transaction.doom()
+        # Nothing is written so nothing should be reported for indexing
+        request._updated_uuid_paths.clear()
+        statuses = [dict(status, status='aborted') for status in statuses]
+        statuses.append(operation_status(operation, 'error', code))
+        statuses.extend(
+            operation_status(skipped, 'skipped') for skipped in operations[index + 1:])
+        request.response.status = code
+        return {
+            '@type': ['result'],
+            'status': 'error',
+            'code': code,
+            'committed': False,
+            'failed': index,
+            'operations': statuses,
+            '@graph': results,
+        }
+    return {
+        '@type': ['result'],
+        'status': 'success',
+        'committed': True,
+        'operations': statuses,
+        '@graph': results,
+    }
+
+
+BULK_GET_FRAMES = ('object', 'embedded')
+
+
+def is_uuid(value):
+    try:
+        UUID(value)
+    except ValueError:
+        return False
+    return True
+
+
+def resolve_id(request, value):
+    connection = request.registry[CONNECTION]
+    if isinstance(value, dict):
+        return connection.get_by_unique_key(value.get('unique_key'), value.get('name'))
+    if is_uuid(value):
+        return connection.get_by_uuid(value)
+    try:
+        return find_resource(request.root, value.replace(':', '%3A'))
+    except KeyError:
+        return None
+
+
+@view_config(context=Root, request_method=('GET', 'POST'), name='bulk-get')
+def bulk_get(context, request):
+    if request.method == 'POST':
+        ids = request.json.get('ids')
+        frame = request.json.get('frame', 'object')
+    else:
+        ids = request.params.getall('id')
+        frame = request.params.get('frame', 'object')
+    if not isinstance(ids, list):
+        raise HTTPBadRequest('Expected a list of ids')
+    if frame not in BULK_GET_FRAMES:
+        raise HTTPBadRequest('frame must be one of %s' % ', '.join(BULK_GET_FRAMES))
+
+    # Load everything that can be found by uuid or unique key in two queries
+    uuids = set()
+    unique_keys = set()
+    for value in ids:
+        if isinstance(value, dict):
+            unique_keys.add((value.get('unique_key'), value.get('name')))
+        elif is_uuid(value):
+            uuids.add(value)
+        else:
+            segments = [segment for segment in value.split('/') if segment]
+            if segments and is_uuid(segments[-1]):
+                uuids.add(segments[-1])
+    request.registry[CONNECTION].prefetch(uuids, unique_keys)
+
+    results = []
+    errors = []
+    for value in ids:
+        item = resolve_id(request, value)
+        if not isinstance(item, Item):
+            errors.append({'id': value, 'code': 404})
+            continue
+        # Permissions are checked here, with this request's principals, and
+        # the frames rendered as subrequests sharing the embed cache.
+        if not request.has_permission('view', item):
+            errors.append({'id': value, 'code': 403})
+            continue
+        results.append(request.embed(request.resource_path(item), '@@' + frame))
+    return {
+        '@type': ['result'],
+        'status': 'success',
+        '@graph': results,
+        'errors': errors,
+    }
@@ -0,0 +1,153 @@
+""" Feed of committed transactions in xid order
+
+GET /changes?since=<xid> returns the transaction records after ``since`` with
+their updated and renamed uuids. Only transactions older than the current
+snapshot xmin are returned, so every transaction with a lower xid has already
+committed or aborted and ``next`` may safely be used as the following
+``since``. With ``wait=<seconds>`` an empty page is held open until a new
+transaction is notified on the ``contentbase.transaction`` channel.
+"""
+from pyramid.httpexceptions import HTTPBadRequest
+from pyramid.view import view_config
+from sqlalchemy import (
+    func,
+    orm,
+)
+from .storage import (
+    DBSession,
+    TransactionRecord,
+)
+import select
+import time
+
+DEFAULT_LIMIT = 1000
+MAX_LIMIT = 10000
+MAX_WAIT = 60
+
+
+def includeme(config):
+    config.add_route('changes', '/changes')
+    config.scan(__name__)
+
+
+def int_param(request, name, default):
+    value = request.params.get(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise HTTPBadRequest('%s must be an integer' % name)
+
+
+def snapshot_xmin(session):
+    """ Lowest xid still in progress
+    """
+    return session.query(func.txid_snapshot_xmin(func.txid_current_snapshot())).scalar()
+
+
+def transactions_since(session, since, limit):
+    xmin = snapshot_xmin(session)
+    query = session.query(TransactionRecord).filter(TransactionRecord.xid < xmin)
+    if since is not None:
+        query = query.filter(TransactionRecord.xid > since)
+    records = query.order_by(TransactionRecord.xid).limit(limit).all()
+    if len(records) == limit:
+        next_xid = records[-1].xid
+    else:
+        # Everything below xmin has been seen
+        next_xid = xmin - 1
+        if since is not None:
+            next_xid = max(since, next_xid)
+    return records, next_xid
+
+
+def requery_transactions_since(session, since, limit):
+    """ transactions_since in a new transaction
+
+    The request's transaction is REPEATABLE READ so does not see later commits.
+    """
+    fresh = orm.Session(bind=session.get_bind())
+    try:
+        return transactions_since(fresh, since, limit)
+    finally:
+        fresh.close()
+
+
+def listen(session):
+    """ A raw connection listening for new transactions
+    """
+    # noqa http://docs.sqlalchemy.org/en/latest/faq.html#how-do-i-get-at-the-raw-dbapi-connection-when-using-an-engine
+    connection = session.bind.pool.unique_connection()
+    connection.detach()
+    conn = connection.connection
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute("""LISTEN "contentbase.transaction";""")
+    return connection
+
+
+def wait_for_notify(conn, timeout):
+    readable, writable, err = select.select([conn], [], [conn], timeout)
+    if err:
+        raise Exception('Socket error')
+    if conn in readable:
+        conn.poll()
+    notified = bool(conn.notifies)
+    del conn.notifies[:]
+    return notified
+
+
+def record_view(record):
+    data = record.data or {}
+    return {
+        'xid': record.xid,
+        'tid': str(record.tid),
+        'timestamp': record.timestamp.isoformat(),
+        'userid': data.get('userid'),
+        'updated': data.get('updated', []),
+        'renamed': data.get('renamed', []),
+    }
+
+
+@view_config(route_name='changes', request_method='GET', permission='index')
+def changes(context, request):
+    since = int_param(request, 'since', None)
+    limit = min(int_param(request, 'limit', DEFAULT_LIMIT), MAX_LIMIT)
+    wait = min(int_param(request, 'wait', 0), MAX_WAIT)
+    if limit < 1:
+        raise HTTPBadRequest('limit must be positive')
+
+    session = DBSession()
+    listener = None
+    try:
+        if wait > 0:
+            # Listen before the first query so no notification is missed
+            listener = listen(session)
+        records, next_xid = transactions_since(session, since, limit)
+        deadline = time.time() + wait
+        notified = False
+        while not records and listener is not None:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            # A notified transaction may still be held back by an older one
+            # in progress, which need not notify when it ends, so poll then.
+            if notified:
+                remaining = min(remaining, 1)
+            if wait_for_notify(listener.connection, remaining):
+                notified = True
+            if notified:
+                records, next_xid = requery_transactions_since(session, since, limit)
+    finally:
+        if listener is not None:
+            listener.close()
+
+    return {
+        '@id': request.route_path('changes', _query={'since': since} if since is not None else {}),
+        '@type': ['changes'],
+        'since': since,
+        'next': next_xid,
+        'next_href': request.route_path('changes', _query={'since': next_xid, 'limit': limit}),
+        '@graph': [record_view(record) for record in records],
+    }
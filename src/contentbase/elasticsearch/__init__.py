@@ -2,7 +2,9 @@ from contentbase.json_renderer import json_renderer
 from contentbase.util import get_root_request
 from elasticsearch import Elasticsearch
 from elasticsearch.connection import Urllib3HttpConnection
+from elasticsearch.exceptions import NotFoundError
 from elasticsearch.serializer import SerializationError
+from elasticsearch.transport import Transport
 from pyramid.settings import (
     asbool,
     aslist,
@@ -11,6 +13,7 @@ from .interfaces import ELASTIC_SEARCH
 
 import json
 import sys
+import time
 PY2 = sys.version_info.major == 2
 
 
@@ -19,12 +22,14 @@ def includeme(config):
     settings.setdefault('contentbase.elasticsearch.index', 'contentbase')
 
     config.add_request_method(datastore, 'datastore', reify=True)
+    config.add_request_method(index_generation, 'index_generation', reify=True)
 
     addresses = aslist(settings['elasticsearch.server'])
     config.registry[ELASTIC_SEARCH] = Elasticsearch(
         addresses,
         serializer=PyramidJSONSerializer(json_renderer),
         connection_class=TimedUrllib3HttpConnection,
+        transport_class=TimedTransport,
         retry_on_timeout=True,
     )
 
@@ -50,6 +55,23 @@ def datastore(request):
     return datastore
 
 
+def index_generation(request):
+    """ The xmin recorded by the last indexing run, or None if unknown.
+
+    Changes whenever the indexer has written new documents, so may be used to
+    key caches of search results.
+    """
+    if request.__parent__ is not None:
+        return request.__parent__.index_generation
+    es = request.registry[ELASTIC_SEARCH]
+    es_index = request.registry.settings['contentbase.elasticsearch.index']
+    try:
+        status = es.get(index=es_index, doc_type='meta', id='indexing')
+    except NotFoundError:
+        return None
+    return status['_source']['xmin']
+
+
 class PyramidJSONSerializer(object):
     mimetype = 'application/json'
 
@@ -96,3 +118,47 @@ class TimedUrllib3HttpConnection(Urllib3HttpConnection):
         self.stats_record(duration)
         return super(TimedUrllib3HttpConnection, self).log_request_fail(
             method, full_url, body, duration, status_code, exception)
+
+
+def response_took(data):
+    """ Sum of the server reported took (in ms) for a search or msearch response
+    """
+    if not isinstance(data, dict):
+        return 0
+    if 'responses' in data:
+        return sum(response_took(response) for response in data['responses'])
+    return data.get('took', 0)
+
+
+class TimedTransport(Transport):
+    """ Records client wall time and server reported took in request stats.
+
+    Client time includes serialization and retries, connection time
+    (TimedUrllib3HttpConnection) only the HTTP round trip.
+    """
+    stats_time_key = 'es_client_time'
+    stats_took_key = 'es_took_time'
+
+    def perform_request(self, method, url, params=None, body=None):
+        begin = time.time()
+        result = None
+        try:
+            result = super(TimedTransport, self).perform_request(method, url, params, body)
+            return result
+        finally:
+            self.stats_record(time.time() - begin, result)
+
+    def stats_record(self, duration, result):
+        request = get_root_request()
+        if request is None:
+            return
+
+        stats = request._stats
+        duration = int(duration * 1e6)
+        stats[self.stats_time_key] = stats.get(self.stats_time_key, 0) + duration
+
+        # elasticsearch-py 1.x returns (status, data)
+        data = result[1] if isinstance(result, tuple) else result
+        took = response_took(data)
+        if took:
+            stats[self.stats_took_key] = stats.get(self.stats_took_key, 0) + int(took * 1000)
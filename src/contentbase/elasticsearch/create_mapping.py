@@ -148,10 +148,10 @@ def index_settings():
         'index': {
             'analysis': {
                 'filter': {
-                    'substring': {
-                        'type': 'nGram',
+                    'prefix': {
+                        'type': 'edgeNGram',
                         'min_gram': 1,
-                        'max_gram': 33
+                        'max_gram': 20
                     }
                 },
                 'analyzer': {
@@ -165,6 +165,16 @@ def index_settings():
                         ]
                     },
                     'clincoded_index_analyzer': {
+                        'type': 'custom',
+                        'tokenizer': 'whitespace',
+                        'char_filter': 'html_strip',
+                        'filter': [
+                            'standard',
+                            'lowercase',
+                            'asciifolding'
+                        ]
+                    },
+                    'clincoded_autocomplete_analyzer': {
                         'type': 'custom',
                         'tokenizer': 'whitespace',
                         'char_filter': 'html_strip',
@@ -172,7 +182,7 @@ def index_settings():
                             'standard',
                             'lowercase',
                             'asciifolding',
-                            'substring'
+                            'prefix'
                         ]
                     },
                     'clincoded_search_analyzer': {
@@ -455,6 +465,20 @@ def type_mapping(types, item_type, embed=True):
         if 'include_in_all' in new_mapping[last]:
             del new_mapping[last]['include_in_all']
 
+    # Prefix matching subfield used by the autocomplete view
+    for value in schema.get('autocomplete_values', ()):
+        props = value.split('.')
+        last = props.pop()
+        new_mapping = mapping['properties']
+        for prop in props:
+            new_mapping = new_mapping[prop]['properties']
+        new_mapping[last].setdefault('fields', {})['autocomplete'] = {
+            'type': 'string',
+            'index_analyzer': 'clincoded_autocomplete_analyzer',
+            'search_analyzer': 'clincoded_search_analyzer',
+            'include_in_all': False
+        }
+
     # Automatic boost for uuid
     if 'uuid' in mapping['properties']:
         mapping['properties']['uuid']['index'] = 'not_analyzed'
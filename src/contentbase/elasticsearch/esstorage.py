@@ -93,6 +93,17 @@ class PickStorage(object):
                 return self.write.get_by_unique_key(unique_key, name)
         return model
 
+    def get_by_uuids(self, uuids):
+        # Only prefetch when reading from the database
+        if self.storage() is self.read:
+            return []
+        return self.write.get_by_uuids(uuids)
+
+    def get_by_unique_keys(self, pkeys):
+        if self.storage() is self.read:
+            return {}
+        return self.write.get_by_unique_keys(pkeys)
+
     def get_rev_links(self, model, rel, *item_types):
         return self.storage().get_rev_links(model, rel, *item_types)
 
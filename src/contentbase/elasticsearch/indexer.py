@@ -78,16 +78,19 @@ def index(request):
         result['types'] = types = request.json.get('types', None)
         invalidated = all_uuids(request.root, types)
     else:
-        txns = session.query(TransactionRecord).filter(
+        # Stream the rows with a server side cursor rather than loading them all
+        txns = session.query(
+            TransactionRecord.xid, TransactionRecord.timestamp, TransactionRecord.data,
+        ).filter(
             TransactionRecord.xid >= last_xmin,
-        )
+        ).yield_per(1000)
 
         invalidated = set()
         updated = set()
         renamed = set()
         max_xid = 0
         txn_count = 0
-        for txn in txns.all():
+        for txn in txns:
             txn_count += 1
             max_xid = max(max_xid, txn.xid)
             if first_txn is None:
@@ -138,11 +141,13 @@ def index(request):
 
     if not dry_run:
         result['indexed'] = indexer.update_objects(request, invalidated, xmin, snapshot_id)
+        es.indices.refresh(index=INDEX)
+
+        # Record only once the new documents are searchable as the recorded
+        # xmin is used as the index generation to key search result caches.
         if record:
             es.index(index=INDEX, doc_type='meta', body=result, id='indexing')
 
-        es.indices.refresh(index=INDEX)
-
     if first_txn is not None:
         result['lag'] = str(datetime.datetime.now(pytz.utc) - first_txn)
 
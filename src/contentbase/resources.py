@@ -41,6 +41,12 @@ from uuid import (
     UUID,
     uuid4,
 )
+from .auditor import (
+    AUDIT_CACHE,
+    audit_cache_xmin,
+    updated_since,
+)
+from .batchupgrade import UPGRADE_WRITE_BACK
 from .cache import ManagerLRUCache
 from .calculated import (
     calculate_properties,
@@ -70,6 +76,8 @@ _marker = object()
 
 logger = logging.getLogger(__name__)
 
+upgraded_properties_cache = ManagerLRUCache('contentbase.upgraded_properties_cache', 1000)
+
 
 def includeme(config):
     registry = config.registry
@@ -130,13 +138,13 @@ def validate_item_content_put(context, request):
     if 'uuid' in data and UUID(data['uuid']) != context.uuid:
         msg = 'uuid may not be changed'
         raise ValidationFailure('body', ['uuid'], msg)
-    current = context.upgrade_properties().copy()
+    current = deepcopy(context.upgrade_properties())
     current['uuid'] = str(context.uuid)
     validate_request(schema, request, data, current)
 
 
 def validate_item_content_patch(context, request):
-    data = context.upgrade_properties().copy()
+    data = deepcopy(context.upgrade_properties())
     if 'schema_version' in data:
         del data['schema_version']
     data.update(request.json)
@@ -144,7 +152,7 @@ def validate_item_content_patch(context, request):
     if 'uuid' in data and UUID(data['uuid']) != context.uuid:
         msg = 'uuid may not be changed'
         raise ValidationFailure('body', ['uuid'], msg)
-    current = context.upgrade_properties().copy()
+    current = deepcopy(context.upgrade_properties())
     current['uuid'] = str(context.uuid)
     validate_request(schema, request, data, current)
 
@@ -372,15 +380,7 @@ class Connection(object):
         if model is None:
             return default
 
-        try:
-            Item = self.types[model.item_type].factory
-        except KeyError:
-            raise UnknownItemTypeError(model.item_type)
-
-        item = Item(self.registry, model)
-        model.used_for(item)
-        self.item_cache[uuid] = item
-        return item
+        return self._cache_model(model)
 
     def get_by_unique_key(self, unique_key, name, default=None):
         pkey = (unique_key, name)
@@ -393,8 +393,30 @@ class Connection(object):
         if model is None:
             return default
 
-        uuid = model.uuid
-        self.unique_key_cache[pkey] = uuid
+        self.unique_key_cache[pkey] = model.uuid
+        return self._cache_model(model)
+
+    def prefetch(self, uuids=(), unique_keys=()):
+        """ Load the items for many uuids and (unique_key, name) pairs at once
+
+        Subsequent get_by_uuid / get_by_unique_key calls are served from the
+        request caches.
+        """
+        storage = self.storage
+        uuids = [uuid for uuid in uuids if uuid not in self.item_cache]
+        if uuids and hasattr(storage, 'get_by_uuids'):
+            for model in storage.get_by_uuids(uuids):
+                self._cache_model(model)
+        pkeys = [pkey for pkey in unique_keys if pkey not in self.unique_key_cache]
+        if pkeys and hasattr(storage, 'get_by_unique_keys'):
+            for pkey, model in storage.get_by_unique_keys(pkeys).items():
+                self.unique_key_cache[pkey] = model.uuid
+                self._cache_model(model)
+
+    def _cache_model(self, model):
+        """ The item for a storage model, from the request item cache if present
+        """
+        uuid = str(model.uuid)
         cached = self.item_cache.get(uuid)
         if cached is not None:
             return cached
@@ -607,10 +629,27 @@ class Item(object):
         }
 
     def upgrade_properties(self):
-        properties = deepcopy(self.properties)
-        current_version = properties.get('schema_version', '')
+        """ Returns the upgraded properties
+
+        The upgraded properties are cached for the request per (uuid, tid).
+        When no upgrade is needed the stored properties are returned as is,
+        so the result is shared: callers that modify it must copy it first.
+        """
+        source = self.properties
+        key = (str(self.uuid), str(self.tid))
+        cached = upgraded_properties_cache.get(key)
+        # Several writes in one transaction share a tid.
+        if cached is None or cached[0] is not source:
+            cached = (source, self._upgrade_properties(source))
+            upgraded_properties_cache[key] = cached
+        return cached[1]
+
+    def _upgrade_properties(self, source):
+        current_version = source.get('schema_version', '')
         target_version = self.type_info.schema_version
+        properties = source
         if target_version is not None and current_version != target_version:
+            properties = deepcopy(source)
             migrator = self.registry['migrator']
             try:
                 properties = migrator.upgrade(
@@ -623,12 +662,17 @@ class Item(object):
                     'Unable to upgrade %s from %r to %r',
                     resource_path(self.__parent__, self.uuid),
                     current_version, target_version, exc_info=True)
+            else:
+                write_back = self.registry.get(UPGRADE_WRITE_BACK)
+                if write_back is not None:
+                    write_back.record(str(self.uuid), current_version)
         return properties
 
     def __json__(self, request):
         # Record embedding objects
         request._embedded_uuids.add(str(self.uuid))
-        return self.upgrade_properties()
+        # Links are canonicalized in place by the embedding.
+        return deepcopy(self.upgrade_properties())
 
     def __resource_url__(self, request, info):
         # Record linking objects
@@ -1098,10 +1142,37 @@ def item_view_columns(context, request):
              name='audit-self')
 def item_view_audit_self(context, request):
     path = request.resource_path(context)
+    audit_cache = request.registry[AUDIT_CACHE]
+    cached = audit_cache.get(path)
+    if cached is not None:
+        audit, embedded_uuids, linked_uuids, xmin = cached
+        if not updated_since(xmin, embedded_uuids):
+            request._embedded_uuids.update(embedded_uuids)
+            request._linked_uuids.update(linked_uuids)
+            return {
+                '@id': path,
+                'audit': deepcopy(audit),
+            }
     types = [context.item_type] + context.base_types
+    audit = request.audit(types=types, path=path)
+    # Checkers embed as the EMBED user so the result is the same for all users.
+    # Results embedded from elasticsearch may be stale, so are not stored.
+    if getattr(request, 'datastore', 'database') != 'database':
+        return {
+            '@id': path,
+            'audit': audit,
+        }
+    xmin = audit_cache_xmin()
+    if xmin is not None:
+        audit_cache[path] = (
+            deepcopy(audit),
+            frozenset(request._embedded_uuids),
+            frozenset(request._linked_uuids),
+            xmin,
+        )
     return {
         '@id': path,
-        'audit': request.audit(types=types, path=path),
+        'audit': audit,
     }
 
 
@@ -1121,7 +1192,7 @@ def item_view_audit(context, request):
              name='raw')
 def item_view_raw(context, request):
     if asbool(request.params.get('upgrade', True)):
-        return context.upgrade_properties()
+        return deepcopy(context.upgrade_properties())
     return context.properties
 
 
@@ -1263,7 +1334,7 @@ def inherit_audits(request, embedded, embedded_paths):
 @view_config(context=Item, name='index-data', permission='index', request_method='GET')
 def item_index_data(context, request):
     uuid = str(context.uuid)
-    properties = context.upgrade_properties()
+    properties = deepcopy(context.upgrade_properties())
     links = context.links(properties)
     unique_keys = context.unique_keys(properties)
 
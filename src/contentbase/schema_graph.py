@@ -33,19 +33,54 @@ def node(item_type, props):
     yield '  </table>>];'
 
 
-def edges(source, name, linkTo, exclude, subclasses):
-    if isinstance(linkTo, basestring):
-        if linkTo in subclasses:
-            linkTo = subclasses[linkTo]
-        else:
-            linkTo = [linkTo]
+def edges(source, name, targets, exclude):
     exclude = [source] + exclude
     return [
         '{source}:{name} -> {target}:uuid;'.format(source=source, name=quoteattr(name), target=target)
-        for target in linkTo if target not in exclude
+        for target in sorted(targets) if target not in exclude
     ]
 
 
+def subclass_map(types):
+    subclasses = defaultdict(list)
+    for source, type_info in sorted(types.items()):
+        for base in type_info.base_types[:-1]:
+            subclasses[base].append(source)
+    return subclasses
+
+
+def link_targets(schema, subclasses):
+    """ The item types linked to from a schema, including nested objects
+    """
+    targets = set()
+    if schema.get('calculatedProperty'):
+        return targets
+    linkTo = schema.get('linkTo')
+    if linkTo is not None:
+        if isinstance(linkTo, basestring):
+            linkTo = subclasses.get(linkTo, [linkTo])
+        targets.update(linkTo)
+    if isinstance(schema.get('items'), dict):
+        targets.update(link_targets(schema['items'], subclasses))
+    for prop in schema.get('properties', {}).values():
+        targets.update(link_targets(prop, subclasses))
+    return targets
+
+
+def dependencies(types):
+    """ item_type -> set of other item types it links to
+    """
+    subclasses = subclass_map(types)
+    result = {}
+    for source, type_info in types.items():
+        if type_info.schema is None:
+            continue
+        targets = link_targets(type_info.schema, subclasses)
+        targets.discard(source)
+        result[source] = targets
+    return result
+
+
 def digraph(types, exclude=None):
     if not exclude:
         exclude = ['submitted_by', 'lab', 'award']
@@ -54,10 +89,7 @@ def digraph(types, exclude=None):
         'rankdir=LR',
     ]
 
-    subclasses = defaultdict(list)
-    for source, type_info in sorted(types.items()):
-        for base in type_info.base_types[:-1]:
-            subclasses[base].append(source)
+    subclasses = subclass_map(types)
 
     for source, type_info in sorted(types.items()):
         if type_info.schema is None:
@@ -68,11 +100,9 @@ def digraph(types, exclude=None):
             continue
         out.extend(node(source, type_info.schema['properties']))
         for name, prop in type_info.schema['properties'].items():
-            if name in exclude or prop.get('calculatedProperty'):
+            if name in exclude:
                 continue
-            prop = prop.get('items', prop)
-            if 'linkTo' in prop:
-                out.extend(edges(source, name, prop['linkTo'], exclude, subclasses))
+            out.extend(edges(source, name, link_targets(prop, subclasses), exclude))
 
     out.append('}')
     return '\n'.join(out)
@@ -1,3 +1,4 @@
+from past.builtins import basestring
 from pyramid.path import (
     AssetResolver,
     caller_package,
@@ -5,10 +6,13 @@ from pyramid.path import (
 from pyramid.security import has_permission
 from pyramid.threadlocal import get_current_request
 from pyramid.traversal import find_resource
+from sqlalchemy.util import LRUCache
+from .cache import ManagerLRUCache
 import json
 import codecs
 import collections
 import copy
+import threading
 from jsonschema import (
     Draft4Validator,
     FormatChecker,
@@ -106,14 +110,8 @@ def linkTo(validator, linkTo, instance, schema):
             return
 
     if schema.get('linkSubmitsFor'):
-        userid = None
-        for principal in request.effective_principals:
-            if principal.startswith('userid.'):
-                userid = principal[len('userid.'):]
-                break
-        if userid is not None:
-            user = request.root[userid]
-            submits_for = user.upgrade_properties().get('submits_for')
+        submits_for = user_submits_for(request)
+        if submits_for is not _marker:
             if (submits_for is not None and
                     not any(UUID(uuid) == item.uuid for uuid in submits_for) and
                     not request.has_permission('submit_for_any')):
@@ -126,6 +124,76 @@ def linkTo(validator, linkTo, instance, schema):
         validator._validated[-1] = str(item.uuid)
 
 
+_marker = object()
+submits_for_cache = ManagerLRUCache('submits_for_cache', 10)
+
+
+def user_submits_for(request):
+    """ The current user's submits_for, looked up once per request
+
+    Returns _marker when there is no current user.
+    """
+    userid = None
+    for principal in request.effective_principals:
+        if principal.startswith('userid.'):
+            userid = principal[len('userid.'):]
+            break
+    if userid is None:
+        return _marker
+    cached = submits_for_cache.get(userid)
+    if cached is None:
+        user = request.root[userid]
+        cached = submits_for_cache[userid] = (user.upgrade_properties().get('submits_for'),)
+    return cached[0]
+
+
+def iter_links(request, schema, instance):
+    """ Yields (linkTo, value) for every linkTo string value in instance
+    """
+    from contentbase import TYPES
+
+    if isinstance(instance, basestring):
+        if 'linkTo' in schema:
+            yield schema['linkTo'], instance
+    elif isinstance(instance, dict):
+        if 'linkFrom' in schema:
+            linkType, linkProp = schema['linkFrom'].split('.')
+            schema = link_from_subschema(request.registry[TYPES][linkType].schema, linkProp)
+        properties = schema.get('properties', {})
+        for name, value in instance.items():
+            if name in properties:
+                for link in iter_links(request, properties[name], value):
+                    yield link
+    elif isinstance(instance, list):
+        items = schema.get('items')
+        if isinstance(items, dict):
+            for value in instance:
+                for link in iter_links(request, items, value):
+                    yield link
+
+
+def prefetch_links(request, schema, data):
+    """ Resolve all the linkTo values in data with batched storage calls
+    """
+    from contentbase import CONNECTION
+
+    uuids = set()
+    unique_keys = set()
+    by_item_type = request.root.by_item_type
+    for link_to, value in iter_links(request, schema, data):
+        try:
+            uuids.add(str(UUID(value)))
+            continue
+        except ValueError:
+            pass
+        if isinstance(link_to, basestring) and link_to in by_item_type:
+            unique_key = by_item_type[link_to].unique_key
+            if unique_key is not None and '/' not in value:
+                unique_keys.add((unique_key, value))
+    if uuids or unique_keys:
+        request.registry[CONNECTION].prefetch(uuids, unique_keys)
+
+
 def linkFrom(validator, linkFrom, instance, schema):
     # avoid circular import
     from contentbase import Item, TYPES
@@ -159,12 +227,7 @@ def linkFrom(validator, linkFrom, instance, schema):
         if '@id' in instance:
             del instance['@id']
 
-        # treat the link property as not required
-        # because it will be filled in when the child is created/updated
-        subschema = request.registry[TYPES][linkType].schema
-        subschema = copy.deepcopy(subschema)
-        if linkProp in subschema['required']:
-            subschema['required'].remove(linkProp)
+        subschema = link_from_subschema(request.registry[TYPES][linkType].schema, linkProp)
 
         for error in validator.descend(instance, subschema):
             yield error
@@ -180,6 +243,25 @@ def linkFrom(validator, linkFrom, instance, schema):
             validator._validated[-1] = validated_instance
 
 
+_link_from_subschemas = {}
+
+
+def link_from_subschema(schema, linkProp):
+    """ The child schema with the link property not required
+
+    The link property is filled in when the child is created/updated.
+    Computed once per schema and link property.
+    """
+    key = (id(schema), linkProp)
+    cached = _link_from_subschemas.get(key)
+    if cached is None or cached[0] is not schema:
+        subschema = copy.deepcopy(schema)
+        if linkProp in subschema['required']:
+            subschema['required'].remove(linkProp)
+        cached = _link_from_subschemas[key] = (schema, subschema)
+    return cached[1]
+
+
 class IgnoreUnchanged(ValidationError):
     pass
 
@@ -254,15 +336,56 @@ def load_schema(filename):
         resolver = RefResolver('file://' + asset.abspath(), schema)
     schema = mixinProperties(schema, resolver)
 
-    # SchemaValidator is not thread safe for now
-    SchemaValidator(schema, resolver=resolver, serialize=True)
+    # Compiled once here and reused by validate in this thread
+    release_validator(schema, new_validator(schema))
     return schema
 
 
-def validate(schema, data, current=None):
+# SchemaValidator keeps the state of a validation (_validated and the resolver
+# scope) on the instance, so validators are cached per thread and taken out of
+# the cache while in use. Entries are keyed by id(schema) and hold a reference
+# to the schema, so the id cannot be reused by another object while cached.
+_validators = threading.local()
+
+
+def new_validator(schema):
     resolver = NoRemoteResolver.from_schema(schema)
-    sv = SchemaValidator(schema, resolver=resolver, serialize=True, format_checker=format_checker)
-    validated, errors = sv.serialize(data)
+    return SchemaValidator(schema, resolver=resolver, serialize=True, format_checker=format_checker)
+
+
+def validator_cache():
+    cache = getattr(_validators, 'cache', None)
+    if cache is None:
+        cache = _validators.cache = LRUCache(100)
+    return cache
+
+
+def acquire_validator(schema):
+    """ A validator for schema not in use by any other caller in this thread
+    """
+    cached = validator_cache().get(id(schema))
+    if cached is not None and cached[0] is schema and cached[1]:
+        return cached[1].pop()
+    return new_validator(schema)
+
+
+def release_validator(schema, sv):
+    cache = validator_cache()
+    cached = cache.get(id(schema))
+    if cached is None or cached[0] is not schema:
+        cached = cache[id(schema)] = (schema, [])
+    cached[1].append(sv)
+
+
+def validate(schema, data, current=None):
+    request = get_current_request()
+    if request is not None:
+        prefetch_links(request, schema, data)
+    sv = acquire_validator(schema)
+    try:
+        validated, errors = sv.serialize(data)
+    finally:
+        release_validator(schema, sv)
 
     filtered_errors = []
     for error in errors:
@@ -10,6 +10,7 @@ from sqlalchemy import (
     orm,
     schema,
     text,
+    tuple_,
     types,
 )
 from sqlalchemy.dialects import postgresql
@@ -64,6 +65,25 @@ class RDBStorage(object):
         else:
             return key.resource
 
+    def get_by_uuids(self, rids):
+        session = DBSession()
+        return session.query(Resource).filter(
+            Resource.rid.in_([uuid.UUID(rid) for rid in rids])).all()
+
+    def get_by_unique_keys(self, pkeys):
+        """ Returns a mapping of (unique_key, name) to resource
+        """
+        session = DBSession()
+        keys = session.query(Key).options(
+            orm.joinedload_all(
+                Key.resource,
+                Resource.data,
+                CurrentPropertySheet.propsheet,
+                innerjoin=True,
+            ),
+        ).filter(tuple_(Key.name, Key.value).in_(list(pkeys)))
+        return {(key.name, key.value): key.resource for key in keys}
+
     def get_rev_links(self, model, rel, *item_types):
         if item_types:
             return [
@@ -423,7 +443,7 @@ class TransactionRecord(Base):
     timestamp = Column(
         types.DateTime(timezone=True), nullable=False, server_default=func.now())
     # A server_default is necessary for the notify_ddl overwrite to work
-    xid = Column(types.BigInteger, nullable=True, server_default=null())
+    xid = Column(types.BigInteger, nullable=True, server_default=null(), index=True)
     __mapper_args__ = {
         'eager_defaults': True,
     }
@@ -0,0 +1,178 @@
+import pytest
+
+TARGET_UUIDS = [
+    '1e8c2dd5-0e4e-4a8c-9f9c-3f1b2a0d7c11',
+    '5b3f7c1a-9d2e-4c6b-8a1f-2e4d6c8b0a22',
+    'c7a9e3b5-1f4d-4e8a-b2c6-9d0e1f2a3b33',
+]
+
+
+@pytest.yield_fixture
+def resources(monkeypatch):
+    """ Resources in an in memory sqlite database used by uuid_batches
+    """
+    from contentbase import batchupgrade
+    from contentbase.storage import Resource
+    from sqlalchemy import create_engine, orm
+    engine = create_engine('sqlite://')
+    Resource.__table__.create(bind=engine)
+    session = orm.scoped_session(orm.sessionmaker(bind=engine))
+    for uuid in reversed(TARGET_UUIDS):
+        session.add(Resource('testing_link_target', rid=uuid))
+    session.add(Resource('testing_link_source'))
+    session.commit()
+    monkeypatch.setattr(batchupgrade, 'DBSession', session)
+    yield TARGET_UUIDS
+    session.remove()
+    engine.dispose()
+
+
+
+@pytest.fixture
+def write_back():
+    from contentbase.batchupgrade import UpgradeWriteBack
+
+    class StoppedWriteBack(UpgradeWriteBack):
+        # Batches are taken by the test rather than the thread
+        def run(self):
+            pass
+
+    return StoppedWriteBack(None, batch_size=2, interval=0)
+
+
+@pytest.fixture
+def upgrade_results(monkeypatch):
+    from contentbase import batchupgrade
+    results = {}
+
+    def upgrade_batch(registry, batch):
+        return [('testing', uuid) + results[uuid] for uuid in batch]
+
+    monkeypatch.setattr(batchupgrade, 'upgrade_batch', upgrade_batch)
+    return results
+
+
+def test_write_back_record(write_back):
+    write_back.record('a', '1')
+    write_back.record('a', '1')
+    assert write_back.pending == {('a', '1')}
+
+
+def test_write_back_take_batch(write_back):
+    for uuid in 'abc':
+        write_back.record(uuid, '1')
+    first = write_back.take_batch()
+    assert len(first) == 2
+    second = write_back.take_batch()
+    assert sorted(first + second) == [('a', '1'), ('b', '1'), ('c', '1')]
+    assert write_back.take_batch() == []
+
+
+def test_write_back_skips_failed(write_back, upgrade_results):
+    upgrade_results.update({'a': (True, False), 'b': (False, True)})
+    write_back.record('a', '1')
+    write_back.record('b', '1')
+    write_back.write_back(write_back.take_batch())
+    assert write_back.failed == {('b', '1')}
+    write_back.record('b', '1')
+    assert write_back.pending == set()
+    write_back.record('b', '2')
+    assert write_back.pending == {('b', '2')}
+
+
+def test_write_back_batch_exception(write_back, monkeypatch):
+    from contentbase import batchupgrade
+
+    def upgrade_batch(registry, batch):
+        raise ValueError()
+
+    monkeypatch.setattr(batchupgrade, 'upgrade_batch', upgrade_batch)
+    write_back.record('a', '1')
+    with pytest.raises(ValueError):
+        write_back.write_back(write_back.take_batch())
+    write_back.record('a', '1')
+    assert write_back.pending == set()
+
+
+def test_uuid_batches(resources):
+    from contentbase.batchupgrade import uuid_batches
+    batches = list(uuid_batches(['testing_link_target'], batch_size=2))
+    assert batches == [
+        ('testing_link_target', resources[:2]),
+        ('testing_link_target', resources[2:]),
+    ]
+
+
+def test_uuid_batches_all_types(resources):
+    from contentbase.batchupgrade import uuid_batches
+    item_types = [item_type for item_type, uuids in uuid_batches(batch_size=2)]
+    assert item_types == ['testing_link_source', 'testing_link_target', 'testing_link_target']
+
+
+def test_uuid_batches_skips_completed(resources):
+    from contentbase.batchupgrade import uuid_batches
+    completed = {'testing_link_target': [(resources[0], resources[1])]}
+    batches = list(uuid_batches(['testing_link_target'], batch_size=2, completed=completed))
+    assert batches == [('testing_link_target', resources[2:])]
+
+
+def test_load_checkpoint(tmpdir):
+    from contentbase.batchupgrade import load_checkpoint
+    import json
+    path = tmpdir.join('checkpoint.jsonl')
+    assert load_checkpoint(str(path)) == {}
+    records = [
+        {'item_type': 'gene', 'first': 'a', 'last': 'b'},
+        {'item_type': 'gene', 'first': 'c', 'last': 'd'},
+        {'item_type': 'user', 'first': 'e', 'last': 'f'},
+    ]
+    path.write(''.join(json.dumps(record) + '\n' for record in records))
+    assert load_checkpoint(str(path)) == {
+        'gene': [('a', 'b'), ('c', 'd')],
+        'user': [('e', 'f')],
+    }
+
+
+@pytest.fixture
+def prepared(monkeypatch):
+    from contentbase import batchupgrade
+
+    class Request(object):
+        pass
+
+    env = {'request': Request(), 'closed': False}
+
+    def closer():
+        env['closed'] = True
+
+    env['closer'] = closer
+    monkeypatch.setattr(batchupgrade, 'prepare', lambda registry: env)
+    return env
+
+
+def test_upgrade_batch(prepared, monkeypatch):
+    from contentbase import batchupgrade
+    import transaction
+
+    def upgrade_uuids(request, batch):
+        assert request.datastore == 'database'
+        assert request._stats == {}
+        assert transaction.get().user.endswith('remoteuser.upgrader')
+        return [('testing', uuid, True, False) for uuid in batch]
+
+    monkeypatch.setattr(batchupgrade, 'upgrade_uuids', upgrade_uuids)
+    results = batchupgrade.upgrade_batch(None, ['a', 'b'], username='upgrader')
+    assert results == [('testing', 'a', True, False), ('testing', 'b', True, False)]
+    assert prepared['closed']
+
+
+def test_upgrade_batch_exception_closes(prepared, monkeypatch):
+    from contentbase import batchupgrade
+
+    def upgrade_uuids(request, batch):
+        raise ValueError()
+
+    monkeypatch.setattr(batchupgrade, 'upgrade_uuids', upgrade_uuids)
+    with pytest.raises(ValueError):
+        batchupgrade.upgrade_batch(None, ['a'])
+    assert prepared['closed']
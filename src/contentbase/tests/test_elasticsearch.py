@@ -0,0 +1,62 @@
+import pytest
+
+
+class DummyRequest(object):
+    def __init__(self):
+        self._stats = {}
+
+
+@pytest.yield_fixture
+def root_request():
+    from pyramid.threadlocal import manager
+    request = DummyRequest()
+    manager.push({'request': request, 'registry': None})
+    yield request
+    manager.pop()
+
+
+@pytest.fixture
+def transport(monkeypatch):
+    from elasticsearch.transport import Transport
+    from contentbase.elasticsearch import TimedTransport
+    responses = []
+
+    def perform_request(self, method, url, params=None, body=None):
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    monkeypatch.setattr(Transport, 'perform_request', perform_request)
+    transport = TimedTransport([{'host': 'localhost', 'port': 9200}])
+    transport.responses = responses
+    return transport
+
+
+def test_timed_transport_accumulates_stats(root_request, transport):
+    transport.responses.extend([
+        (200, {'took': 5, 'hits': {}}),
+        (200, {'responses': [{'took': 2}, {'took': 3}]}),
+        (200, {'found': True}),
+    ])
+    assert transport.perform_request('GET', '/_search') == (200, {'took': 5, 'hits': {}})
+    assert root_request._stats['es_took_time'] == 5000
+    transport.perform_request('GET', '/_msearch')
+    transport.perform_request('GET', '/index/meta/indexing')
+    stats = root_request._stats
+    assert stats['es_took_time'] == 10000
+    assert stats['es_client_time'] >= 0
+    assert set(stats) == {'es_client_time', 'es_took_time'}
+
+
+def test_timed_transport_records_failures(root_request, transport):
+    transport.responses.append(ValueError())
+    with pytest.raises(ValueError):
+        transport.perform_request('GET', '/_search', body={})
+    assert 'es_client_time' in root_request._stats
+    assert 'es_took_time' not in root_request._stats
+
+
+def test_timed_transport_without_request(transport):
+    transport.responses.append((200, {'took': 5}))
+    assert transport.perform_request('GET', '/_search') == (200, {'took': 5})
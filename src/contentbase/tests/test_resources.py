@@ -0,0 +1,84 @@
+import pytest
+
+
+class Registry(dict):
+    settings = {}
+
+
+class TypeInfo(object):
+    schema_version = '2'
+
+
+class Migrator(object):
+    def __init__(self):
+        self.upgrades = []
+
+    def upgrade(self, item_type, properties, current_version, target_version, **kw):
+        self.upgrades.append(current_version)
+        properties['schema_version'] = target_version
+        return properties
+
+
+class Model(object):
+    def __init__(self, properties):
+        import uuid
+        self.uuid = uuid.uuid4()
+        self.tid = uuid.uuid4()
+        self.properties = properties
+
+
+@pytest.yield_fixture
+def registry():
+    from pyramid.threadlocal import manager
+    registry = Registry(migrator=Migrator())
+    manager.push({'request': None, 'registry': registry})
+    yield registry
+    manager.pop()
+
+
+@pytest.fixture
+def item_factory(registry):
+    from contentbase.resources import Item
+
+    class TestingItem(Item):
+        item_type = 'testing_item'
+        type_info = TypeInfo()
+
+    def factory(properties):
+        return TestingItem(registry, Model(properties))
+
+    return factory
+
+
+def test_upgrade_properties_current_not_copied(item_factory, registry):
+    item = item_factory({'schema_version': '2', 'attachment': {'type': 'image/png'}})
+    assert item.upgrade_properties() is item.properties
+    assert registry['migrator'].upgrades == []
+
+
+def test_upgrade_properties_cache_hit(item_factory, registry):
+    item = item_factory({'schema_version': '1'})
+    first = item.upgrade_properties()
+    assert item.upgrade_properties() is first
+    assert first == {'schema_version': '2'}
+    assert item.properties == {'schema_version': '1'}
+    assert registry['migrator'].upgrades == ['1']
+
+
+def test_upgrade_properties_cache_miss_after_source_change(item_factory, registry):
+    item = item_factory({'schema_version': '1'})
+    item.upgrade_properties()
+    item.model.properties = {'schema_version': '1', 'changed': True}
+    assert item.upgrade_properties() == {'schema_version': '2', 'changed': True}
+    assert registry['migrator'].upgrades == ['1', '1']
+
+
+def test_json_isolated_from_cache(item_factory):
+    from pyramid.testing import DummyRequest
+    request = DummyRequest(_embedded_uuids=set())
+    item = item_factory({'schema_version': '2', 'attachment': {'type': 'image/png'}})
+    value = item.__json__(request)
+    value['attachment']['type'] = 'changed'
+    assert item.upgrade_properties() == {
+        'schema_version': '2', 'attachment': {'type': 'image/png'}}
+    assert request._embedded_uuids == {str(item.uuid)}
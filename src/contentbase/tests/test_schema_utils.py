@@ -0,0 +1,64 @@
+SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'name': {'type': 'string'},
+    },
+}
+
+
+def make_schema():
+    import copy
+    return copy.deepcopy(SCHEMA)
+
+
+def test_validator_reused():
+    from contentbase.schema_utils import (
+        acquire_validator,
+        release_validator,
+    )
+    schema = make_schema()
+    sv = acquire_validator(schema)
+    assert sv.schema is schema
+    release_validator(schema, sv)
+    assert acquire_validator(schema) is sv
+
+
+def test_validator_reentrant():
+    from contentbase.schema_utils import (
+        acquire_validator,
+        release_validator,
+    )
+    schema = make_schema()
+    outer = acquire_validator(schema)
+    inner = acquire_validator(schema)
+    assert inner is not outer
+    release_validator(schema, inner)
+    release_validator(schema, outer)
+    assert {id(acquire_validator(schema)), id(acquire_validator(schema))} == {
+        id(outer), id(inner)}
+
+
+def test_validator_not_shared_by_other_schema_with_same_id():
+    from contentbase.schema_utils import (
+        acquire_validator,
+        new_validator,
+        validator_cache,
+    )
+    schema = make_schema()
+    other = make_schema()
+    # As if other had been allocated at the address of a collected schema
+    validator_cache()[id(other)] = (schema, [new_validator(schema)])
+    assert acquire_validator(other).schema is other
+
+
+def test_load_schema_validator_reused():
+    from contentbase.schema_utils import (
+        acquire_validator,
+        load_schema,
+        validator_cache,
+    )
+    schema = load_schema(make_schema())
+    (cached_schema, validators) = validator_cache()[id(schema)]
+    assert cached_schema is schema
+    sv, = validators
+    assert acquire_validator(schema) is sv
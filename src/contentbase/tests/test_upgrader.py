@@ -31,6 +31,22 @@ def test_upgrade(schema_migrator):
     assert value['step2']
 
 
+def test_upgrade_path_memoized(schema_migrator):
+    steps, version = schema_migrator.upgrade_path('', '3')
+    assert [step.step for step in steps] == [step1, step2]
+    assert version == '3'
+    assert schema_migrator.upgrade_path('', '3') is schema_migrator.upgrade_path('', '3')
+
+
+def test_upgrade_path_invalidated_by_new_step():
+    from contentbase.upgrader import SchemaMigrator
+    schema_migrator = SchemaMigrator('test', '3')
+    schema_migrator.add_upgrade_step(step1, dest='2')
+    assert schema_migrator.upgrade_path('', '3')[1] == '2'
+    schema_migrator.add_upgrade_step(step2, source='2', dest='3')
+    assert schema_migrator.upgrade_path('', '3')[1] == '3'
+
+
 def test_finalizer(schema_migrator):
     schema_migrator.finalizer = finalizer
     value = schema_migrator.upgrade({})
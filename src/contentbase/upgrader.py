@@ -1,10 +1,14 @@
-from pkg_resources import parse_version
+from functools import lru_cache
+from pkg_resources import parse_version as _parse_version
 from pyramid.interfaces import (
     PHASE1_CONFIG,
     PHASE2_CONFIG,
 )
 import venusian
 
+# Parsed versions are immutable and the same few strings are parsed repeatedly
+parse_version = lru_cache(maxsize=1024)(_parse_version)
+
 
 def includeme(config):
     config.registry['migrator'] = Migrator()
@@ -69,6 +73,7 @@ class SchemaMigrator(object):
         self.version = version
         self.upgrade_steps = {}
         self.finalizer = finalizer
+        self._upgrade_paths = {}
 
     def add_upgrade_step(self, step, source='', dest=None):
         if dest is None:
@@ -78,13 +83,18 @@ class SchemaMigrator(object):
         if parse_version(source) in self.upgrade_steps:
             raise ConfigurationError('duplicate step for source', source)
         self.upgrade_steps[parse_version(source)] = UpgradeStep(step, source, dest)
+        self._upgrade_paths.clear()
 
-    def upgrade(self, value, current_version='', target_version=None, **kw):
-        if target_version is None:
-            target_version = self.version
+    def upgrade_path(self, current_version, target_version):
+        """ The ordered steps from current to target version and the version reached
 
-        if parse_version(current_version) > parse_version(target_version):
-            raise VersionTooHigh(self.__name__, current_version, target_version)
+        Memoized until another step is added.
+        """
+        key = (current_version, target_version)
+        try:
+            return self._upgrade_paths[key]
+        except KeyError:
+            pass
 
         # Try to find a path from current to target versions
         steps = []
@@ -109,6 +119,18 @@ class SchemaMigrator(object):
             steps.append(step)
             version = step.dest
 
+        result = self._upgrade_paths[key] = (tuple(steps), version)
+        return result
+
+    def upgrade(self, value, current_version='', target_version=None, **kw):
+        if target_version is None:
+            target_version = self.version
+
+        if parse_version(current_version) > parse_version(target_version):
+            raise VersionTooHigh(self.__name__, current_version, target_version)
+
+        steps, version = self.upgrade_path(current_version, target_version)
+
         if version != target_version:
             raise UpgradePathNotFound(
                 self.__name__, current_version, target_version, version)